@@ -1,7 +1,7 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 from django.contrib.auth.models import User
-from .models import UserProfile
+from .models import UserProfile, EmailVerificationToken
 
 class UserProfileInline(admin.StackedInline):
     model = UserProfile
@@ -29,4 +29,11 @@ class UserProfileAdmin(admin.ModelAdmin):
     list_display = ('user', 'role', 'department', 'phone', 'created_at')
     list_filter = ('role', 'department')
     search_fields = ('user__username', 'user__email', 'department')
-    readonly_fields = ('created_at', 'updated_at')
\ No newline at end of file
+    readonly_fields = ('created_at', 'updated_at')
+
+
+@admin.register(EmailVerificationToken)
+class EmailVerificationTokenAdmin(admin.ModelAdmin):
+    list_display = ('user', 'expires_at', 'created_at')
+    search_fields = ('user__username', 'user__email')
+    readonly_fields = ('token_hash', 'created_at')
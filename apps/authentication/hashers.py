@@ -0,0 +1,50 @@
+import threading
+
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+
+class HashingPoolBusy(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Servicio de autenticación saturado, inténtalo de nuevo en unos segundos.'
+    default_code = 'auth_busy'
+
+
+# Límite de hashes simultáneos por proceso. hashlib.pbkdf2_hmac libera el GIL:
+# sin límite, una ráfaga de logins ocupa todos los núcleos; con él, como mucho
+# AUTH_HASHING_MAX_CONCURRENT. El hash sigue calculándose en el hilo de la
+# petición, que espera hasta que termina: no libera workers síncronos, solo
+# acota la CPU que el hashing quita al resto de la API. Entre procesos no hay
+# coordinación (cada uno tiene su límite).
+_max_concurrent = getattr(settings, 'AUTH_HASHING_MAX_CONCURRENT', 2)
+_running = threading.BoundedSemaphore(_max_concurrent)
+# Hashes en curso + en espera; por encima de esto se rechaza sin esperar
+_admitted = threading.BoundedSemaphore(_max_concurrent + getattr(settings, 'AUTH_HASHING_MAX_PENDING', 8))
+
+
+def run_bounded(func, *args):
+    """Ejecutar func cuando haya turno o lanzar HashingPoolBusy si hay demasiados esperando"""
+    if not _admitted.acquire(blocking=False):
+        raise HashingPoolBusy()
+    try:
+        if not _running.acquire(timeout=getattr(settings, 'AUTH_HASHING_WAIT_SECONDS', 2)):
+            raise HashingPoolBusy()
+        try:
+            return func(*args)
+        finally:
+            _running.release()
+    finally:
+        _admitted.release()
+
+
+class BoundedPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """
+    PBKDF2 (mismo algoritmo y formato que el hasher por defecto) con un
+    límite de cálculos simultáneos por proceso (ver run_bounded). La petición
+    sigue bloqueada mientras se calcula su hash.
+    """
+
+    def encode(self, password, salt, iterations=None):
+        return run_bounded(super().encode, password, salt, iterations)
@@ -0,0 +1,115 @@
+# logs.py - Logging estructurado (JSON), redactado y sin bloqueo para las vistas de autenticación
+import json
+import logging
+import os
+import queue
+import random
+from collections.abc import Mapping
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+# Campos cuyo valor nunca llega al log (contraseñas y tokens de un solo uso)
+SENSITIVE_FIELDS = frozenset({
+    'password', 'password_confirm', 'old_password', 'new_password', 'confirm_password', 'token', 'uid',
+})
+REDACTED = '[redactado]'
+
+# Atributos propios de LogRecord: el resto vienen de extra= y van al JSON
+_RECORD_ATTRS = frozenset(logging.makeLogRecord({}).__dict__) | {'message', 'asctime'}
+
+
+def redact(data):
+    """Copia de data con los valores de SENSITIVE_FIELDS sustituidos, a cualquier profundidad"""
+    if isinstance(data, Mapping):
+        return {
+            key: REDACTED if str(key).lower() in SENSITIVE_FIELDS else redact(value)
+            for key, value in data.items()
+        }
+    if isinstance(data, (list, tuple)):
+        return [redact(value) for value in data]
+    return data
+
+
+class Redacted:
+    """
+    Argumento de log perezoso: solo se redacta y se formatea si el registro
+    se emite (logger.debug('... %s', Redacted(request.data))).
+    """
+    __slots__ = ('data',)
+
+    def __init__(self, data):
+        self.data = data
+
+    def __str__(self):
+        return json.dumps(redact(self.data), default=str, ensure_ascii=False)
+
+
+class DebugSampleFilter(logging.Filter):
+    """Deja pasar una fracción `rate` de los registros DEBUG; los de más nivel, todos"""
+
+    def __init__(self, rate=1.0):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno > logging.DEBUG or random.random() < self.rate
+
+
+class JsonFormatter(logging.Formatter):
+    """Una línea JSON por registro, con los campos de extra= (p. ej. event, username)"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update((key, value) for key, value in record.__dict__.items() if key not in _RECORD_ATTRS)
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class BackgroundHandler(QueueHandler):
+    """
+    Encola los registros y un QueueListener los escribe en JSON desde su
+    propio hilo: la petición solo paga resolver el mensaje (sin formatter,
+    prepare() no hace más), nunca el JSON ni la E/S.
+    Con la cola llena el registro se descarta (se cuenta en `dropped`) en vez
+    de bloquear. Tras un fork (workers con preload) el hilo no existe en el
+    hijo: se arranca otro con su propia cola.
+    """
+
+    def __init__(self, stream=None, queue_size=10000):
+        super().__init__(queue.Queue(queue_size))
+        self.stream = stream
+        self.queue_size = queue_size
+        self.dropped = 0
+        self._pid = None
+        self.listener = None
+        self._start()
+
+    def _start(self):
+        target = logging.StreamHandler(self.stream)
+        target.setFormatter(JsonFormatter())
+        if self._pid is not None:
+            self.queue = queue.Queue(self.queue_size)
+        self._pid = os.getpid()
+        self.listener = QueueListener(self.queue, target)
+        self.listener.start()
+
+    def enqueue(self, record):
+        if self._pid != os.getpid():
+            self._start()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        # logging.shutdown() cierra los handlers al salir: se vacía la cola
+        if self.listener is not None and self._pid == os.getpid():
+            self.listener.stop()
+            self.listener = None
+        super().close()
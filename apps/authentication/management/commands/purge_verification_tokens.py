@@ -0,0 +1,52 @@
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from apps.authentication.models import EmailVerificationToken
+
+
+class Command(BaseCommand):
+    help = (
+        "Elimina por lotes los tokens de verificación de email expirados y, "
+        "opcionalmente, las cuentas nunca verificadas con más de N días."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Filas borradas por sentencia DELETE (default: 1000)')
+        parser.add_argument('--inactive-days', type=int, default=None,
+                            help='Borrar también usuarios inactivos sin verificar registrados hace más de N días')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Solo contar, sin borrar nada')
+
+    def handle(self, *args, batch_size, inactive_days, dry_run, **options):
+        now = timezone.now()
+
+        expired = EmailVerificationToken.objects.filter(expires_at__lt=now)
+        deleted = self._purge(expired, batch_size, dry_run)
+        self.stdout.write(f"Tokens expirados {'encontrados' if dry_run else 'eliminados'}: {deleted}")
+
+        if inactive_days is not None:
+            # Solo cuentas sin requester: Request -> Requester es DO_NOTHING
+            stale_users = User.objects.filter(
+                is_active=False,
+                userprofile__email_verified=False,
+                date_joined__lt=now - timedelta(days=inactive_days),
+                requester_profile__isnull=True,
+            )
+            deleted = self._purge(stale_users, batch_size, dry_run)
+            self.stdout.write(f"Usuarios sin verificar {'encontrados' if dry_run else 'eliminados'}: {deleted}")
+
+    def _purge(self, queryset, batch_size, dry_run):
+        """Borrar en lotes por clave primaria para no bloquear la tabla con un DELETE enorme"""
+        if dry_run:
+            return queryset.count()
+        total = 0
+        while True:
+            pks = list(queryset.values_list('pk', flat=True)[:batch_size])
+            if not pks:
+                return total
+            queryset.model.objects.filter(pk__in=pks).delete()
+            total += len(pks)
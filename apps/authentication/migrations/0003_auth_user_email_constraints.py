@@ -0,0 +1,63 @@
+from django.db import migrations, models
+from django.db.models import Count, Value
+from django.db.models.functions import NullIf
+
+
+def _email_index():
+    return models.Index(fields=['email'], name='auth_user_email_idx')
+
+
+def _email_constraint():
+    # NULLIF permite varios usuarios sin email ('') sin romper la unicidad
+    return models.UniqueConstraint(NullIf('email', Value('')), name='auth_user_email_uniq')
+
+
+def check_duplicate_emails(apps, schema_editor):
+    """
+    Abortar si ya hay emails repetidos: la restricción no se podría crear y
+    fusionar cuentas (requesters, tokens, perfiles) no se puede hacer a ciegas
+    """
+    User = apps.get_model('auth', 'User')
+    duplicates = (
+        User.objects.using(schema_editor.connection.alias).exclude(email='')
+        .values('email').annotate(users=Count('id')).filter(users__gt=1).order_by('email')
+    )
+    if duplicates:
+        lines = [
+            f"  {row['email']}: usuarios "
+            + ', '.join(str(pk) for pk in User.objects.using(schema_editor.connection.alias)
+                        .filter(email=row['email']).values_list('id', flat=True))
+            for row in duplicates
+        ]
+        raise RuntimeError(
+            "No se puede crear la restricción UNIQUE de auth_user.email: hay emails repetidos.\n"
+            + '\n'.join(lines)
+            + "\nCambia o vacía el email de las cuentas sobrantes y vuelve a ejecutar migrate."
+        )
+
+
+def add_email_constraints(apps, schema_editor):
+    check_duplicate_emails(apps, schema_editor)
+    User = apps.get_model('auth', 'User')
+    schema_editor.add_index(User, _email_index())
+    schema_editor.add_constraint(User, _email_constraint())
+
+
+def remove_email_constraints(apps, schema_editor):
+    User = apps.get_model('auth', 'User')
+    schema_editor.remove_constraint(User, _email_constraint())
+    schema_editor.remove_index(User, _email_index())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('authentication', '0002_userprofile_email_verification_sent_at_and_more'),
+    ]
+
+    operations = [
+        # auth_user pertenece a django.contrib.auth, por eso se usa el schema
+        # editor directamente en lugar de AddIndex/AddConstraint
+        migrations.RunPython(add_email_constraints, remove_email_constraints),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:38
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from datetime import timedelta
+import hashlib
+
+
+def copy_pending_tokens(apps, schema_editor):
+    # Conservar los enlaces ya enviados: se guarda el hash del token existente
+    UserProfile = apps.get_model('authentication', 'UserProfile')
+    EmailVerificationToken = apps.get_model('authentication', 'EmailVerificationToken')
+    db_alias = schema_editor.connection.alias
+    pending = (
+        UserProfile.objects.using(db_alias)
+        .filter(email_verified=False, email_verification_token__isnull=False,
+                email_verification_sent_at__isnull=False)
+        .exclude(email_verification_token='')
+        .values_list('user_id', 'email_verification_token', 'email_verification_sent_at')
+    )
+    EmailVerificationToken.objects.using(db_alias).bulk_create(
+        (
+            EmailVerificationToken(
+                user_id=user_id,
+                token_hash=hashlib.sha256(token.encode('utf-8')).hexdigest(),
+                expires_at=sent_at + timedelta(hours=24),
+            )
+            for user_id, token, sent_at in pending.iterator()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0003_auth_user_email_constraints'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmailVerificationToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token_hash', models.CharField(max_length=64, unique=True)),
+                ('expires_at', models.DateTimeField(db_index=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='email_verification_tokens', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.RunPython(copy_pending_tokens, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='userprofile',
+            name='email_verification_token',
+        ),
+    ]
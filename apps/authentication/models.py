@@ -9,7 +9,34 @@ from django.utils.http import urlsafe_base64_encode
 from django.utils.encoding import force_bytes
 from django.core.mail import send_mail
 from django.conf import settings
-import uuid
+from datetime import timedelta
+import hashlib
+import re
+import secrets
+
+# Restricción UNIQUE sobre auth_user.email creada en la migración 0003. El nombre
+# se usa para mapear IntegrityError al error de validación correspondiente.
+USER_EMAIL_UNIQUE_CONSTRAINT = 'auth_user_email_uniq'
+# Índice UNIQUE de auth_user.username (unique=True del modelo User): MySQL y
+# MariaDB lo nombran como la columna
+USER_USERNAME_UNIQUE_INDEX = 'username'
+
+# "Duplicate entry '...' for key 'username'" (MariaDB; MySQL 8 antepone la tabla)
+# y "UNIQUE constraint failed: auth_user.username" o "... index 'nombre'" (SQLite)
+_UNIQUE_VIOLATION = re.compile(
+    r"Duplicate entry '.*' for key '(?P<key>[^']*)'"
+    r"|UNIQUE constraint failed: (?:index '(?P<index>[^']*)'|(?P<columns>.*))",
+    re.DOTALL,
+)
+
+
+def is_unique_violation(exc, model, name):
+    """El IntegrityError lo causa el índice o la restricción UNIQUE `name` de la tabla de `model`"""
+    match = _UNIQUE_VIOLATION.fullmatch(str(exc.args[-1])) if exc.args else None
+    if match is None:
+        return False
+    qualified = f'{model._meta.db_table}.{name}'
+    return bool({name, qualified} & {match['key'], match['index'], match['columns']})
 
 class UserProfile(models.Model):
     """
@@ -28,7 +55,6 @@ class UserProfile(models.Model):
     
     # Campos para verificación de email
     email_verified = models.BooleanField(default=False)
-    email_verification_token = models.CharField(max_length=100, blank=True, null=True)
     email_verification_sent_at = models.DateTimeField(blank=True, null=True)
     
     created_at = models.DateTimeField(auto_now_add=True)
@@ -38,11 +64,19 @@ class UserProfile(models.Model):
         return f"{self.user.username} - {self.role}"
     
     def generate_email_verification_token(self):
-        """Generar token único para verificación de email"""
-        self.email_verification_token = str(uuid.uuid4())
-        self.email_verification_sent_at = timezone.now()
-        self.save()
-        return self.email_verification_token
+        """Generar token único para verificación de email (solo se guarda su hash)"""
+        token = secrets.token_urlsafe(32)
+        now = timezone.now()
+        # Un token nuevo invalida los enlaces enviados anteriormente
+        EmailVerificationToken.objects.filter(user_id=self.user_id).delete()
+        EmailVerificationToken.objects.create(
+            user_id=self.user_id,
+            token_hash=EmailVerificationToken.hash_token(token),
+            expires_at=now + EmailVerificationToken.lifetime(),
+        )
+        self.email_verification_sent_at = now
+        self.save(update_fields=['email_verification_sent_at', 'updated_at'])
+        return token
     
     def send_email_verification(self):
         """Enviar email de verificación"""
@@ -79,21 +113,40 @@ Equipo BGBM
             print(f"Error enviando email de verificación: {str(e)}")
             return False
     
-    def verify_email_token(self, token):
-        """Verificar token de email"""
-        if self.email_verification_token == token:
-            # Verificar que no haya expirado (24 horas)
-            if self.email_verification_sent_at:
-                expiry_time = self.email_verification_sent_at + timezone.timedelta(hours=24)
-                if timezone.now() <= expiry_time:
-                    self.email_verified = True
-                    self.user.is_active = True
-                    self.email_verification_token = None
-                    self.email_verification_sent_at = None
-                    self.save()
-                    self.user.save()
-                    return True
-        return False
+    def mark_email_verified(self):
+        """Activar la cuenta y descartar los tokens pendientes"""
+        self.email_verified = True
+        self.email_verification_sent_at = None
+        self.save(update_fields=['email_verified', 'email_verification_sent_at', 'updated_at'])
+        User.objects.filter(pk=self.user_id).update(is_active=True)
+        self.user.is_active = True
+        EmailVerificationToken.objects.filter(user_id=self.user_id).delete()
+
+class EmailVerificationToken(models.Model):
+    """
+    Token de verificación de email. Solo se guarda el hash SHA-256 (indexado),
+    así un clic en el enlace es una búsqueda por índice y una fuga de la tabla
+    no permite activar cuentas.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='email_verification_tokens')
+    token_hash = models.CharField(max_length=64, unique=True)
+    expires_at = models.DateTimeField(db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.user_id} - expira {self.expires_at:%Y-%m-%d %H:%M}"
+
+    @staticmethod
+    def hash_token(token):
+        return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def lifetime():
+        return timedelta(hours=getattr(settings, 'EMAIL_VERIFICATION_TOKEN_HOURS', 24))
+
+    @property
+    def is_expired(self):
+        return timezone.now() > self.expires_at
 
 # Señales para crear automáticamente token y perfil cuando se crea un usuario
 @receiver(post_save, sender=User)
@@ -106,9 +159,11 @@ def create_user_token(sender, instance, created, **kwargs):
 def create_user_profile(sender, instance, created, **kwargs):
     """Crear perfil automáticamente cuando se crea un usuario"""
     if created:
-        # Usuario inactivo hasta verificar email
+        # Usuario inactivo hasta verificar email. Se usa update() para no
+        # disparar post_save otra vez: save_user_profile crearía el perfil antes
+        # que nosotros y el índice UNIQUE de user_id rechazaría este create()
         instance.is_active = False
-        instance.save()
+        User.objects.filter(pk=instance.pk).update(is_active=False)
         
         profile = UserProfile.objects.create(user=instance)
         # Enviar email de verificación automáticamente
@@ -1,7 +1,12 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
 from django.contrib.auth import authenticate
-from .models import UserProfile
+from django.contrib.auth.validators import UnicodeUsernameValidator
+from django.db import IntegrityError, transaction
+from .models import (
+    UserProfile, EmailVerificationToken, USER_EMAIL_UNIQUE_CONSTRAINT, USER_USERNAME_UNIQUE_INDEX,
+    is_unique_violation,
+)
 from django.contrib.auth.tokens import default_token_generator
 from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
 from django.utils.encoding import force_bytes, force_str
@@ -13,29 +18,33 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
     """Serializer para registro de usuarios"""
     password = serializers.CharField(write_only=True, min_length=8)
     password_confirm = serializers.CharField(write_only=True)
+    duplicate_email_message = "Ya existe un usuario con este email"
     
     class Meta:
         model = User
         fields = ('username', 'email', 'first_name', 'last_name', 'password', 'password_confirm')
+        # Sin UniqueValidator: la unicidad de username y email la garantizan los
+        # índices UNIQUE de auth_user y se mapea en create()
+        extra_kwargs = {
+            'username': {'validators': [UnicodeUsernameValidator()]},
+        }
     
     def validate(self, attrs):
         if attrs['password'] != attrs['password_confirm']:
             raise serializers.ValidationError("Las contraseñas no coinciden")
         return attrs
     
-    def validate_email(self, value):
-        if User.objects.filter(email=value).exists():
-            raise serializers.ValidationError("Ya existe un usuario con este email")
-        return value
-    
-    def validate_username(self, value):
-        if User.objects.filter(username=value).exists():
-            raise serializers.ValidationError("Ya existe un usuario con este nombre de usuario")
-        return value
-    
     def create(self, validated_data):
         validated_data.pop('password_confirm')
-        user = User.objects.create_user(**validated_data)
+        try:
+            with transaction.atomic():
+                user = User.objects.create_user(**validated_data)
+        except IntegrityError as exc:
+            if is_unique_violation(exc, User, USER_EMAIL_UNIQUE_CONSTRAINT):
+                raise serializers.ValidationError({'email': [self.duplicate_email_message]})
+            if is_unique_violation(exc, User, USER_USERNAME_UNIQUE_INDEX):
+                raise serializers.ValidationError({'username': ["Ya existe un usuario con este nombre de usuario"]})
+            raise
         # El usuario se crea inactivo hasta verificar email (se maneja en signals)
         return user
 
@@ -67,13 +76,15 @@ class EmailVerificationSerializer(serializers.Serializer):
     
     def validate_token(self, value):
         try:
-            profile = UserProfile.objects.get(email_verification_token=value)
-            if profile.verify_email_token(value):
-                return value
-            else:
-                raise serializers.ValidationError("Token expirado o inválido")
-        except UserProfile.DoesNotExist:
+            verification = EmailVerificationToken.objects.select_related('user__userprofile').get(
+                token_hash=EmailVerificationToken.hash_token(value)
+            )
+        except EmailVerificationToken.DoesNotExist:
             raise serializers.ValidationError("Token inválido")
+        if verification.is_expired:
+            raise serializers.ValidationError("Token expirado o inválido")
+        verification.user.userprofile.mark_email_verified()
+        return value
 
 class ResendVerificationSerializer(serializers.Serializer):
     """Serializer para reenviar verificación de email"""
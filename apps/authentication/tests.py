@@ -1,3 +1,264 @@
-from django.test import TestCase
+import io
+import json
+import logging
+import threading
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import IntegrityError
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+from rest_framework.test import APIClient, APIRequestFactory
+
+from . import hashers, throttles
+from .logs import REDACTED, BackgroundHandler, DebugSampleFilter, redact
+from .models import (
+    USER_EMAIL_UNIQUE_CONSTRAINT, USER_USERNAME_UNIQUE_INDEX, EmailVerificationToken, is_unique_violation,
+)
+
+
+class EmailUniquenessTests(TestCase):
+    """El índice UNIQUE de auth_user.email se traduce a un 400 en registro y perfil"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.ana = User.objects.create_user('ana', 'ana@example.org', 'x')
+        cls.bea = User.objects.create_user('bea', 'bea@example.org', 'x')
+
+    def setUp(self):
+        caches['throttle'].clear()
+
+    def test_register_with_taken_email(self):
+        response = APIClient().post('/api/auth/register/', {
+            'username': 'otra', 'email': 'ana@example.org', 'first_name': 'O', 'last_name': 'T',
+            'password': 'long-enough-1', 'password_confirm': 'long-enough-1',
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['email'], ['Ya existe un usuario con este email'])
+        self.assertFalse(User.objects.filter(username='otra').exists())
+
+    def test_profile_update_with_taken_email(self):
+        client = APIClient()
+        client.force_authenticate(self.bea)
+        response = client.put('/api/auth/profile/update/', {'email': 'ana@example.org'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['email'], ['Ya existe un usuario con este email'])
+        self.bea.refresh_from_db()
+        self.assertEqual(self.bea.email, 'bea@example.org')
+
+        response = client.put('/api/auth/profile/update/', {'email': 'bea@new.example.org'}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_register_with_taken_username(self):
+        response = APIClient().post('/api/auth/register/', {
+            'username': 'ana', 'email': 'otra@example.org', 'first_name': 'O', 'last_name': 'T',
+            'password': 'long-enough-1', 'password_confirm': 'long-enough-1',
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['username'], ['Ya existe un usuario con este nombre de usuario'])
+        self.assertFalse(User.objects.filter(email='otra@example.org').exists())
+
+    def test_other_integrity_errors_are_not_mapped(self):
+        with mock.patch.object(User.objects, 'create_user',
+                               side_effect=IntegrityError('NOT NULL constraint failed: auth_user.username')):
+            with self.assertRaises(IntegrityError):
+                APIClient().post('/api/auth/register/', {
+                    'username': 'otra', 'email': 'otra@example.org', 'first_name': 'O', 'last_name': 'T',
+                    'password': 'long-enough-1', 'password_confirm': 'long-enough-1',
+                }, format='json')
+
+    def test_violated_index_is_read_from_the_message(self):
+        mariadb = IntegrityError(1062, "Duplicate entry 'auth_user_email_uniq' for key 'username'")
+        self.assertTrue(is_unique_violation(mariadb, User, USER_USERNAME_UNIQUE_INDEX))
+        self.assertFalse(is_unique_violation(mariadb, User, USER_EMAIL_UNIQUE_CONSTRAINT))
+        mysql = IntegrityError(1062, "Duplicate entry 'ana@example.org' for key 'auth_user.auth_user_email_uniq'")
+        self.assertTrue(is_unique_violation(mysql, User, USER_EMAIL_UNIQUE_CONSTRAINT))
+        sqlite = IntegrityError("UNIQUE constraint failed: index 'auth_user_email_uniq'")
+        self.assertTrue(is_unique_violation(sqlite, User, USER_EMAIL_UNIQUE_CONSTRAINT))
+        self.assertFalse(is_unique_violation(sqlite, User, USER_USERNAME_UNIQUE_INDEX))
+        not_null = IntegrityError('NOT NULL constraint failed: auth_user.username')
+        self.assertFalse(is_unique_violation(not_null, User, USER_USERNAME_UNIQUE_INDEX))
+
+
+class EmailVerificationTests(TestCase):
+    """Tokens de verificación: solo se guarda el hash y caducan"""
+
+    def setUp(self):
+        caches['throttle'].clear()
+        self.user = User.objects.create_user('ana', 'ana@example.org', 'x')
+        self.token = self.user.userprofile.generate_email_verification_token()
+
+    def verify(self, token):
+        return APIClient().post('/api/auth/verify-email/', {'token': token}, format='json')
+
+    def test_only_the_hash_is_stored(self):
+        stored = EmailVerificationToken.objects.get(user=self.user)
+        self.assertNotEqual(stored.token_hash, self.token)
+        self.assertEqual(stored.token_hash, EmailVerificationToken.hash_token(self.token))
+        self.assertFalse(EmailVerificationToken.objects.filter(token_hash=self.token).exists())
+
+    def test_valid_token_activates_the_user_once(self):
+        response = self.verify(self.token)
+        self.assertEqual(response.status_code, 200)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.is_active)
+        self.assertTrue(self.user.userprofile.email_verified)
+        self.assertFalse(EmailVerificationToken.objects.filter(user=self.user).exists())
+        self.assertEqual(self.verify(self.token).status_code, 400)
+
+    def test_stored_hash_is_not_a_token(self):
+        stored = EmailVerificationToken.objects.get(user=self.user)
+        self.assertEqual(self.verify(stored.token_hash).status_code, 400)
+
+    def test_expired_token_is_rejected(self):
+        EmailVerificationToken.objects.filter(user=self.user).update(expires_at=timezone.now() - timedelta(seconds=1))
+        response = self.verify(self.token)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['token'], ['Token expirado o inválido'])
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.is_active)
+
+
+class PurgeVerificationTokensTests(TestCase):
+
+    def setUp(self):
+        now = timezone.now()
+        self.fresh = User.objects.create_user('fresh', 'fresh@example.org', 'x')
+        self.stale = User.objects.create_user('stale', 'stale@example.org', 'x')
+        User.objects.filter(pk=self.stale.pk).update(date_joined=now - timedelta(days=40))
+        EmailVerificationToken.objects.filter(user=self.stale).update(expires_at=now - timedelta(days=39))
+
+    def purge(self, *args):
+        out = io.StringIO()
+        call_command('purge_verification_tokens', *args, stdout=out)
+        return out.getvalue()
+
+    def test_dry_run_only_counts(self):
+        output = self.purge('--dry-run', '--inactive-days', '30')
+        self.assertIn('Tokens expirados encontrados: 1', output)
+        self.assertIn('Usuarios sin verificar encontrados: 1', output)
+        self.assertEqual(EmailVerificationToken.objects.count(), 2)
+        self.assertEqual(User.objects.count(), 2)
+
+    def test_purges_expired_tokens_in_batches(self):
+        User.objects.create_user('other', 'other@example.org', 'x')
+        EmailVerificationToken.objects.exclude(user=self.fresh).update(expires_at=timezone.now() - timedelta(days=1))
+        output = self.purge('--batch-size', '1')
+        self.assertIn('Tokens expirados eliminados: 2', output)
+        self.assertEqual(list(EmailVerificationToken.objects.values_list('user_id', flat=True)), [self.fresh.pk])
+
+    def test_inactive_days_removes_only_old_unverified_accounts(self):
+        output = self.purge('--inactive-days', '30')
+        self.assertIn('Usuarios sin verificar eliminados: 1', output)
+        self.assertEqual(list(User.objects.values_list('username', flat=True)), ['fresh'])
+
+
+class TokenBucketTests(SimpleTestCase):
+    """Token bucket por clave: ráfaga hasta la capacidad y relleno continuo"""
+
+    class TwoPerMinute(throttles.AuthIPThrottle):
+        rate = '2/min'
+
+    def setUp(self):
+        caches['throttle'].clear()
+        self.now = 1000.0
+        patcher = mock.patch.object(throttles, 'time')
+        patcher.start().monotonic.side_effect = lambda: self.now
+        self.addCleanup(patcher.stop)
+
+    def allow(self, ip='10.0.0.1'):
+        request = APIRequestFactory().post('/api/auth/login/', REMOTE_ADDR=ip)
+        throttle = self.TwoPerMinute()
+        return throttle.allow_request(request, None), throttle.wait()
+
+    def test_burst_then_refill(self):
+        self.assertEqual([self.allow()[0] for _ in range(3)], [True, True, False])
+        self.assertAlmostEqual(self.allow()[1], 30.0)
+        self.now += 30
+        self.assertEqual([self.allow()[0] for _ in range(2)], [True, False])
+
+    def test_keys_are_isolated(self):
+        self.allow()
+        self.allow()
+        self.assertFalse(self.allow()[0])
+        self.assertTrue(self.allow('10.0.0.2')[0])
+
+    def test_exhausted_bucket_returns_429_with_retry_after(self):
+        client = APIClient()
+        # Sin contraseña: el serializer rechaza la petición sin calcular ningún hash
+        statuses = [client.post('/api/auth/login/', {'username': 'ana'}, format='json').status_code
+                    for _ in range(10)]
+        self.assertEqual(set(statuses), {400})
+        response = client.post('/api/auth/login/', {'username': 'ana'}, format='json')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '6')
+
+
+class BoundedHashingTests(TestCase):
+    """Con demasiados hashes en curso o en espera el login responde 503 sin calcular"""
+
+    def setUp(self):
+        caches['throttle'].clear()
+
+    def test_busy_hashing_returns_503(self):
+        User.objects.create_user('ana', 'ana@example.org', 's3cret-pass')
+        with mock.patch.object(hashers, '_admitted', threading.BoundedSemaphore(1)) as admitted:
+            admitted.acquire()
+            response = APIClient().post('/api/auth/login/', {'username': 'ana', 'password': 's3cret-pass'},
+                                        format='json')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.data['detail'].code, 'auth_busy')
+
+    def test_waits_for_a_free_slot(self):
+        with mock.patch.object(hashers, '_running', threading.BoundedSemaphore(1)) as running:
+            running.acquire()
+            with self.settings(AUTH_HASHING_WAIT_SECONDS=0.01), self.assertRaises(hashers.HashingPoolBusy):
+                hashers.run_bounded(len, 'x')
+            running.release()
+            self.assertEqual(hashers.run_bounded(len, 'xy'), 2)
+
+
+class AuthLoggingTests(TestCase):
+    """Logs de autenticación: redactados, perezosos y escritos desde el hilo del listener"""
+
+    def test_login_log_does_not_contain_the_password(self):
+        with self.assertLogs('apps.authentication.views', 'DEBUG') as logs:
+            APIClient().post('/api/auth/login/', {'username': 'ana', 'password': 's3cret-pass'}, format='json')
+        output = '\n'.join(logs.output)
+        self.assertIn('"username": "ana"', output)
+        self.assertIn(REDACTED, output)
+        self.assertNotIn('s3cret-pass', output)
+
+
+class LogHelpersTests(SimpleTestCase):
+
+    def test_redact_is_recursive_and_does_not_modify_the_data(self):
+        data = {'email': 'a@example.org', 'nested': [{'new_password': 'x', 'Token': 'y'}]}
+        self.assertEqual(redact(data), {'email': 'a@example.org', 'nested': [{'new_password': REDACTED,
+                                                                               'Token': REDACTED}]})
+        self.assertEqual(data['nested'][0]['new_password'], 'x')
+
+    def test_debug_records_are_sampled(self):
+        record = logging.makeLogRecord({'levelno': logging.DEBUG})
+        self.assertFalse(DebugSampleFilter(rate=0.0).filter(record))
+        self.assertTrue(DebugSampleFilter(rate=1.0).filter(record))
+        self.assertTrue(DebugSampleFilter(rate=0.0).filter(logging.makeLogRecord({'levelno': logging.INFO})))
+
+    def test_background_handler_writes_json_lines(self):
+        stream = io.StringIO()
+        handler = BackgroundHandler(stream=stream)
+        logger = logging.getLogger('apps.authentication.tests.background')
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        try:
+            logger.info('Login successful for user: %s', 'ana', extra={'event': 'login.success'})
+        finally:
+            logger.removeHandler(handler)
+            handler.close()  # espera a que el listener vacíe la cola
+        entry = json.loads(stream.getvalue())
+        self.assertEqual((entry['message'], entry['event'], entry['level']),
+                         ('Login successful for user: ana', 'login.success', 'INFO'))
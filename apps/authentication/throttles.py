@@ -0,0 +1,73 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.throttling import SimpleRateThrottle
+
+# El read-modify-write del bucket no es atómico en LocMemCache
+_bucket_lock = threading.Lock()
+
+
+class TokenBucketThrottle(SimpleRateThrottle):
+    """
+    Token bucket guardado en una caché local del proceso. La tasa 'N/periodo'
+    se interpreta como capacidad N que se rellena de forma continua, así se
+    permiten ráfagas cortas sin el historial de timestamps de SimpleRateThrottle.
+    """
+    cache = caches[getattr(settings, 'AUTH_THROTTLE_CACHE', 'default')]
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+
+        now = time.monotonic()
+        refill_per_second = self.num_requests / self.duration
+        with _bucket_lock:
+            tokens, stamp = self.cache.get(self.key, (self.num_requests, now))
+            tokens = min(self.num_requests, tokens + (now - stamp) * refill_per_second)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self.cache.set(self.key, (tokens, now), self.duration)
+
+        self.wait_seconds = None if allowed else (1 - tokens) / refill_per_second
+        return allowed
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class AuthIPThrottle(TokenBucketThrottle):
+    """Límite por IP de origen"""
+    scope = 'auth_ip'
+
+    def get_cache_key(self, request, view):
+        return self.cache_format % {'scope': self.scope, 'ident': self.get_ident(request)}
+
+
+class _RequestFieldThrottle(TokenBucketThrottle):
+    """Límite por un campo del cuerpo (normalizado), sin importar la IP"""
+    field = None
+
+    def get_cache_key(self, request, view):
+        value = request.data.get(self.field) if hasattr(request.data, 'get') else None
+        if not value or not isinstance(value, str):
+            return None
+        return self.cache_format % {'scope': self.scope, 'ident': value.strip().lower()}
+
+
+class AuthUsernameThrottle(_RequestFieldThrottle):
+    """Límite por username, frena el ataque a una cuenta desde muchas IPs"""
+    scope = 'auth_username'
+    field = 'username'
+
+
+class AuthEmailThrottle(_RequestFieldThrottle):
+    """Límite por email, protege el envío de correos (SMTP)"""
+    scope = 'auth_email'
+    field = 'email'
@@ -1,9 +1,10 @@
 from rest_framework import status, permissions
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import api_view, permission_classes, throttle_classes
 from rest_framework.response import Response
 from rest_framework.authtoken.models import Token
 from django.contrib.auth import logout
 from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
 import logging
@@ -15,17 +16,22 @@ from .serializers import (
     PasswordResetSerializer, PasswordResetConfirmSerializer,
     EmailVerificationSerializer, ResendVerificationSerializer
 )
+from .hashers import HashingPoolBusy
+from .models import USER_EMAIL_UNIQUE_CONSTRAINT, is_unique_violation
+from .logs import Redacted
+from .throttles import AuthIPThrottle, AuthUsernameThrottle, AuthEmailThrottle
 
 logger = logging.getLogger(__name__)
 
 @api_view(['POST'])
 @permission_classes([permissions.AllowAny])
+@throttle_classes([AuthIPThrottle, AuthEmailThrottle])
 @csrf_exempt
 def register_view(request):
     """
     New user registration (email verification required)
     """
-    logger.debug(f"Register request data: {request.data}")
+    logger.debug("Register request data: %s", Redacted(request.data), extra={'event': 'register.request'})
     
     serializer = UserRegistrationSerializer(data=request.data)
     if serializer.is_valid():
@@ -44,21 +50,22 @@ def register_view(request):
             'requires_verification': True
         }
         
-        logger.debug(f"Register successful: {response_data}")
+        logger.debug("Register successful: %s", Redacted(response_data),
+                     extra={'event': 'register.success', 'user_id': user.id})
         return Response(response_data, status=status.HTTP_201_CREATED)
     
-    logger.debug(f"Register validation errors: {serializer.errors}")
+    logger.debug("Register validation errors: %s", Redacted(serializer.errors), extra={'event': 'register.invalid'})
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 @api_view(['POST'])
 @permission_classes([permissions.AllowAny])
+@throttle_classes([AuthIPThrottle, AuthUsernameThrottle])
 @csrf_exempt
 def login_view(request):
     """
     User login (requires verified email)
     """
-    logger.debug(f"Login request received")
-    logger.debug(f"Request data: {request.data}")
+    logger.debug("Login request data: %s", Redacted(request.data), extra={'event': 'login.request'})
     
     try:
         serializer = UserLoginSerializer(data=request.data)
@@ -80,14 +87,17 @@ def login_view(request):
                 'token': token.key
             }
             
-            logger.debug(f"Login successful for user: {user.username}")
+            logger.debug("Login successful for user: %s", user.username,
+                         extra={'event': 'login.success', 'user_id': user.id})
             return Response(response_data, status=status.HTTP_200_OK)
         
-        logger.debug(f"Login validation errors: {serializer.errors}")
+        logger.debug("Login validation errors: %s", Redacted(serializer.errors), extra={'event': 'login.invalid'})
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
         
+    except HashingPoolBusy:
+        raise
     except Exception as e:
-        logger.error(f"Login error: {str(e)}")
+        logger.error("Login error: %s", e, exc_info=True, extra={'event': 'login.error'})
         return Response({
             'error': 'Error interno del servidor',
             'detail': str(e)
@@ -95,6 +105,7 @@ def login_view(request):
 
 @api_view(['POST'])
 @permission_classes([permissions.AllowAny])
+@throttle_classes([AuthIPThrottle])
 def verify_email_view(request):
     """
     Verify email with token
@@ -109,6 +120,7 @@ def verify_email_view(request):
 
 @api_view(['POST'])
 @permission_classes([permissions.AllowAny])
+@throttle_classes([AuthIPThrottle, AuthEmailThrottle])
 def resend_verification_view(request):
     """
     Resend verification email
@@ -129,6 +141,7 @@ def resend_verification_view(request):
 
 @api_view(['POST'])
 @permission_classes([permissions.AllowAny])
+@throttle_classes([AuthIPThrottle, AuthEmailThrottle])
 def password_reset_request_view(request):
     """
     Request password reset
@@ -149,6 +162,7 @@ def password_reset_request_view(request):
 
 @api_view(['POST'])
 @permission_classes([permissions.AllowAny])
+@throttle_classes([AuthIPThrottle])
 def password_reset_confirm_view(request):
     """
     Confirm password reset
@@ -178,7 +192,7 @@ def logout_view(request):
         logout(request)
         return Response({'message': 'Logout successful'}, status=status.HTTP_200_OK)
     except Exception as e:
-        logger.error(f"Logout error: {str(e)}")
+        logger.error("Logout error: %s", e, exc_info=True, extra={'event': 'logout.error'})
         return Response({'error': 'Error logging out'}, status=status.HTTP_400_BAD_REQUEST)
 
 @api_view(['GET'])
@@ -203,7 +217,17 @@ def update_profile_view(request):
     user.first_name = data.get('first_name', user.first_name)
     user.last_name = data.get('last_name', user.last_name)
     user.email = data.get('email', user.email)
-    user.save()
+    # El índice UNIQUE de auth_user.email rechaza un email ya usado
+    try:
+        with transaction.atomic():
+            user.save()
+    except IntegrityError as exc:
+        if not is_unique_violation(exc, User, USER_EMAIL_UNIQUE_CONSTRAINT):
+            raise
+        user.refresh_from_db()
+        return Response({
+            'email': [UserRegistrationSerializer.duplicate_email_message]
+        }, status=status.HTTP_400_BAD_REQUEST)
     
     # Actualizar perfil
     profile = user.userprofile
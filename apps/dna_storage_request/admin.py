@@ -1,10 +1,87 @@
 from django.contrib import admin
-from .models import DnaAliquot, Metadata, Request, Requester, Tissue, Shipment
+from django.core.exceptions import PermissionDenied
+from django.http import FileResponse, Http404
+from django.shortcuts import get_object_or_404
+from django.urls import path, reverse
+from django.utils.html import format_html
+from . import profiling
+from .models import (
+    CodeBlock, CodeSequence, DnaAliquot, Job, Metadata, Request, Requester, RequestProfile, Taxon, Tissue,
+    Shipment, Upload,
+)
 
 admin.site.register(DnaAliquot)
-admin.site.register(Metadata)
 admin.site.register(Request)
 admin.site.register(Requester)
 admin.site.register(Tissue)
 admin.site.register(Shipment)
+admin.site.register(Upload)
+admin.site.register(Taxon)
 
+
+@admin.register(Metadata)
+class MetadataAdmin(admin.ModelAdmin):
+    # __str__ usa el nombre del taxón: un JOIN en vez de una consulta por fila
+    list_select_related = ('taxon',)
+
+
+@admin.register(CodeSequence)
+class CodeSequenceAdmin(admin.ModelAdmin):
+    list_display = ['name', 'next_value', 'updated_at']
+
+
+@admin.register(CodeBlock)
+class CodeBlockAdmin(admin.ModelAdmin):
+    list_display = ['sequence', 'start', 'end', 'used_up_to', 'unused', 'holder', 'reserved_at', 'released_at']
+    list_filter = ['sequence']
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ['kind', 'user', 'status', 'progress', 'total', 'attempts', 'worker', 'created_at', 'finished_at']
+    list_filter = ['kind', 'status']
+    readonly_fields = ['heartbeat_at', 'started_at', 'finished_at']
+
+
+@admin.register(RequestProfile)
+class RequestProfileAdmin(admin.ModelAdmin):
+    list_display = ['created_at', 'method', 'path', 'status_code', 'duration_ms', 'sql_count', 'sql_ms',
+                    'serializer_ms', 'user', 'trigger', 'download_link']
+    list_filter = ['trigger', 'method', 'status_code']
+    search_fields = ['path']
+    date_hierarchy = 'created_at'
+    readonly_fields = ['download_link']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def get_urls(self):
+        return [
+            path('<uuid:pk>/download/', self.admin_site.admin_view(self.download),
+                 name='dna_storage_request_requestprofile_download'),
+        ] + super().get_urls()
+
+    def download(self, request, pk):
+        """Volcado de cProfile (.prof) para snakeviz / pstats"""
+        profile = get_object_or_404(RequestProfile, pk=pk)
+        if not self.has_view_permission(request, profile):
+            raise PermissionDenied
+        try:
+            fh = open(profiling.profile_path(profile.pk), 'rb')
+        except FileNotFoundError:
+            raise Http404('El fichero del perfil ya no existe')
+        return FileResponse(fh, as_attachment=True, filename=f'{profile.pk.hex}.prof')
+
+    @admin.display(description='Perfil')
+    def download_link(self, obj):
+        url = reverse('admin:dna_storage_request_requestprofile_download', args=[obj.pk])
+        return format_html('<a href="{}">.prof</a>', url)
+
+    def delete_model(self, request, obj):
+        profiling.delete_profiles([obj.pk])
+
+    def delete_queryset(self, request, queryset):
+        profiling.delete_profiles(list(queryset.values_list('pk', flat=True)))
@@ -4,3 +4,13 @@ from django.apps import AppConfig
 class DnaStorageRequestConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.dna_storage_request'
+
+    def ready(self):
+        # Registrar las señales de contadores, auditoría, tombstones, eventos SSE,
+        # facetas, índices de autocompletado y claves de duplicados
+        from . import counters, audit, sync, events, facets, typeahead, duplicates  # noqa: F401
+        # Comprobaciones de configuración (manage.py check)
+        from . import checks  # noqa: F401
+        # Campos de los serializers por rol construidos antes de la primera petición
+        from .serializers import warm_field_cache
+        warm_field_cache()
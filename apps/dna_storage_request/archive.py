@@ -0,0 +1,181 @@
+# archive.py - Archivo de requests cerrados: sus filas pasan a las tablas Archive_*
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from . import facets, sync
+from .models import (
+    Request, Metadata, Shipment, Tissue, DnaAliquot, Upload,
+    ArchivedRequest, ArchivedMetadata, ArchivedShipment, ArchivedTissue, ArchivedDnaAliquot, ArchivedUpload,
+)
+
+# (modelo vivo, modelo de archivo, columna con el id del request), padres antes
+# que hijos: se copian en este orden y se borran en el inverso, porque las FKs
+# DO_NOTHING no borran en cascada y la base de datos rechaza huérfanos.
+TABLES = [
+    (Request, ArchivedRequest, 'id'),
+    (Metadata, ArchivedMetadata, 'request_id'),
+    (Shipment, ArchivedShipment, 'request_id'),
+    (Tissue, ArchivedTissue, 'request_id'),
+    (DnaAliquot, ArchivedDnaAliquot, 'request_id'),
+    (Upload, ArchivedUpload, 'request_id'),
+]
+
+ARCHIVE_MODELS = {live: archived for live, archived, _ in TABLES}
+
+# Hijos cuya actividad reciente impide archivar el request
+_CHILDREN = (Metadata, Shipment, Tissue, DnaAliquot)
+
+
+def closed_requests(before):
+    """
+    Requests cerrados (MTA firmado y todos sus shipments, al menos uno,
+    con accession_date) sin cambios propios ni de sus hijos desde `before`
+    y sin subidas a medias.
+    """
+    queryset = (
+        Request.objects.filter(mta_signed_date__isnull=False, updated_at__lt=before)
+        .filter(Exists(Shipment.objects.filter(request=OuterRef('pk'))))
+        .exclude(Exists(Shipment.objects.filter(request=OuterRef('pk'), accession_date__isnull=True)))
+        .exclude(Exists(Upload.objects.filter(request=OuterRef('pk'), status=Upload.STATUS_PENDING)))
+    )
+    for model in _CHILDREN:
+        queryset = queryset.exclude(Exists(model.objects.filter(request=OuterRef('pk'), updated_at__gte=before)))
+    # Metadata o shipments usados por tissues / aliquots de otro request: al
+    # borrarlos quedarían FKs huérfanas
+    for model in (Tissue, DnaAliquot):
+        for parent in ('metadata', 'shipment'):
+            queryset = queryset.exclude(Exists(
+                model.objects.filter(**{f'{parent}__request': OuterRef('pk')}).exclude(request=OuterRef('pk'))
+            ))
+    return queryset
+
+
+def _copy_rows(source, target, column, request_ids):
+    """INSERT ... SELECT de las filas de los requests (mismas columnas en las dos tablas)"""
+    qn = connection.ops.quote_name
+    columns = ', '.join(qn(field.column) for field in target._meta.concrete_fields)
+    placeholders = ', '.join(['%s'] * len(request_ids))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {qn(target._meta.db_table)} ({columns}) '
+            f'SELECT {columns} FROM {qn(source._meta.db_table)} WHERE {qn(column)} IN ({placeholders})',
+            request_ids,
+        )
+
+
+def _delete_rows(model, column, request_ids):
+    # DELETE directo, sin señales: archivar no es borrar (sin auditoría ni
+    # ajuste de contadores); los tombstones los escribe _move
+    qn = connection.ops.quote_name
+    placeholders = ', '.join(['%s'] * len(request_ids))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {qn(model._meta.db_table)} WHERE {qn(column)} IN ({placeholders})', request_ids
+        )
+
+
+def _move(request_ids, to_archive):
+    for live, archived, column in TABLES:
+        source, target = (live, archived) if to_archive else (archived, live)
+        _copy_rows(source, target, column, request_ids)
+    for live, archived, column in reversed(TABLES):
+        if live in sync.SYNCED_MODELS:
+            rows = live.objects.filter(**{f'{column}__in': request_ids})
+            if to_archive:
+                # Para ?updated_since= las filas archivadas desaparecen de la lista
+                sync.create_tombstones(rows)
+            else:
+                # Y al restaurarlas vuelven como modificadas ahora: su
+                # updated_at original es anterior a los cursores entregados
+                rows.update(updated_at=timezone.now())
+        _delete_rows(live if to_archive else archived, column, request_ids)
+    transaction.on_commit(lambda: facets.invalidate(*(live for live, _, _ in TABLES)))
+
+
+def archive_closed(before=None, batch_size=None, dry_run=False, on_chunk=None):
+    """
+    Mover a las tablas de archivo los requests cerrados antes de `before`
+    (por defecto hace ARCHIVE_AFTER_DAYS) con sus hijos, en una transacción
+    por lote de batch_size requests. on_chunk(archivados) tras cada lote.
+    Devuelve el número de requests archivados.
+    """
+    if before is None:
+        before = timezone.now() - timedelta(days=settings.ARCHIVE_AFTER_DAYS)
+    batch_size = batch_size or settings.ARCHIVE_BATCH_SIZE
+    candidates = closed_requests(before).order_by('pk').values_list('pk', flat=True)
+    archived = 0
+    last_pk = 0
+    while True:
+        pks = list(candidates.filter(pk__gt=last_pk)[:batch_size])
+        if not pks:
+            break
+        last_pk = pks[-1]
+        if dry_run:
+            archived += len(pks)
+        else:
+            with transaction.atomic():
+                # Se bloquean y se vuelve a comprobar que siguen cerrados: un
+                # alta de hijos concurrente espera al commit o lo bloquea antes
+                pks = list(closed_requests(before).filter(pk__in=pks).select_for_update().values_list('pk', flat=True))
+                if pks:
+                    _move(pks, to_archive=True)
+            archived += len(pks)
+        if on_chunk is not None:
+            on_chunk(archived)
+    return archived
+
+
+def restore(request_ids, batch_size=None):
+    """Devolver a las tablas vivas los requests archivados dados. Devuelve cuántos."""
+    batch_size = batch_size or settings.ARCHIVE_BATCH_SIZE
+    pending = sorted(set(request_ids))
+    restored = 0
+    for start in range(0, len(pending), batch_size):
+        with transaction.atomic():
+            pks = list(
+                ArchivedRequest.objects.filter(pk__in=pending[start:start + batch_size])
+                .select_for_update().values_list('pk', flat=True)
+            )
+            if pks:
+                _move(pks, to_archive=False)
+        restored += len(pks)
+    return restored
+
+
+class ArchiveChain:
+    """
+    Filas vivas seguidas de las archivadas (cada parte con su orden), con el
+    count() y el slicing que necesita el paginador
+    """
+    ordered = True
+
+    def __init__(self, live, archived):
+        self.live = live
+        self.archived = archived
+        self._live_count = None
+
+    def live_count(self):
+        if self._live_count is None:
+            self._live_count = self.live.count()
+        return self._live_count
+
+    def count(self):
+        return self.live_count() + self.archived.count()
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice) or index.step is not None:
+            raise TypeError('ArchiveChain solo admite slices sin paso')
+        start = index.start or 0
+        stop = index.stop if index.stop is not None else self.count()
+        split = self.live_count()
+        rows = list(self.live[start:min(stop, split)]) if start < split else []
+        if stop > split:
+            rows.extend(self.archived[max(start - split, 0):stop - split])
+        return rows
@@ -0,0 +1,180 @@
+# audit.py - Historial de cambios por campo de Request, Shipment, Tissue y DnaAliquot
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.utils import timezone
+
+from . import snapshots
+from .models import AuditLog, Request, Shipment, Tissue, DnaAliquot
+
+AUDITED_MODELS = (Request, Shipment, Tissue, DnaAliquot)
+# Campos que no aportan al historial (automáticos o derivados)
+IGNORED_FIELDS = {'id', 'created_at', 'updated_at', 'tissue_count', 'aliquot_count'}
+# Entradas acumuladas antes de volcar un lote aunque la petición no haya terminado
+FLUSH_THRESHOLD = 5000
+
+_current_batch = ContextVar('audit_batch', default=None)
+_audited_fields = {}
+
+
+class AuditBatch:
+    """Entradas pendientes de la petición (o del comando) en curso"""
+
+    def __init__(self, request=None):
+        self.request = request
+        self.entries = []
+
+    def add(self, entry):
+        self.entries.append(entry)
+        if len(self.entries) >= FLUSH_THRESHOLD:
+            self.flush()
+
+    def flush(self):
+        if not self.entries:
+            return
+        user = getattr(self.request, 'user', None)
+        user_id = user.pk if user is not None and user.is_authenticated else None
+        for entry in self.entries:
+            if entry.user_id is None:
+                entry.user_id = user_id
+        AuditLog.objects.bulk_create(self.entries, batch_size=500)
+        self.entries = []
+
+
+@contextmanager
+def buffered(request=None):
+    """
+    Acumular las entradas y escribirlas con un solo bulk_create al salir.
+    Anidado dentro de otro lote reutiliza el exterior.
+    """
+    if _current_batch.get() is not None:
+        yield _current_batch.get()
+        return
+    batch = AuditBatch(request)
+    token = _current_batch.set(batch)
+    try:
+        yield batch
+    finally:
+        _current_batch.reset(token)
+        batch.flush()
+
+
+class AuditMiddleware:
+    """
+    Un lote de auditoría por petición HTTP. Admite modo async para que las
+    vistas async (stream SSE) no se ejecuten en un hilo bajo ASGI.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with buffered(request):
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        if _current_batch.get() is not None:
+            return await self.get_response(request)
+        batch = AuditBatch(request)
+        token = _current_batch.set(batch)
+        try:
+            return await self.get_response(request)
+        finally:
+            _current_batch.reset(token)
+            if batch.entries:
+                await sync_to_async(batch.flush)()
+
+
+def _fields(model):
+    if model not in _audited_fields:
+        _audited_fields[model] = [
+            field.attname for field in model._meta.concrete_fields
+            if field.name not in IGNORED_FIELDS
+        ]
+    return _audited_fields[model]
+
+
+def snapshot(instance):
+    # Los campos diferidos (.only()/.defer()) no están en __dict__ y se omiten
+    values = instance.__dict__
+    return {name: values[name] for name in _fields(type(instance)) if name in values}
+
+
+def _append(entry):
+    batch = _current_batch.get()
+    if batch is None:
+        AuditLog.objects.bulk_create([entry])
+    else:
+        batch.add(entry)
+
+
+def record(model, object_id, action, changes, user=None):
+    """
+    Registrar un cambio. La entrada solo llega al lote cuando la transacción
+    se confirma: si hay rollback no queda rastro en el historial.
+    """
+    if not changes and action == AuditLog.ACTION_UPDATE:
+        return
+    entry = AuditLog(
+        model=model._meta.model_name,
+        object_id=object_id,
+        action=action,
+        user=user,
+        ts=timezone.now(),
+        changes=changes,
+    )
+    transaction.on_commit(lambda: _append(entry))
+
+
+def record_bulk_update(model, old_values, field, new_value):
+    """
+    Cubrir un queryset.update() (sin señales): old_values es [(pk, valor anterior)]
+    de las filas actualizadas con `field = new_value`.
+    """
+    for pk, old in old_values:
+        if old != new_value:
+            record(model, pk, AuditLog.ACTION_UPDATE, {field: [old, new_value]})
+
+
+def record_bulk_create(model, instances):
+    """Cubrir un bulk_create (sin señales): instances releídas de la base de datos, con pk"""
+    for instance in instances:
+        changes = {name: [None, value] for name, value in snapshot(instance).items() if value is not None}
+        record(model, instance.pk, AuditLog.ACTION_CREATE, changes)
+
+
+def _saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    current = snapshot(instance)
+    if created:
+        changes = {name: [None, value] for name, value in current.items() if value is not None}
+        record(sender, instance.pk, AuditLog.ACTION_CREATE, changes)
+    else:
+        # Valores leídos antes del UPDATE (snapshots), no copiados al cargar la instancia
+        previous = snapshots.stored_values(instance)
+        changes = {
+            name: [previous.get(name), value]
+            for name, value in current.items() if previous.get(name) != value
+        }
+        record(sender, instance.pk, AuditLog.ACTION_UPDATE, changes)
+
+
+def _deleted(sender, instance, **kwargs):
+    changes = {name: [value, None] for name, value in snapshot(instance).items() if value is not None}
+    record(sender, instance.pk, AuditLog.ACTION_DELETE, changes)
+
+
+for _model in AUDITED_MODELS:
+    snapshots.track(_model)
+    post_save.connect(_saved, sender=_model, dispatch_uid=f'audit_save_{_model.__name__}')
+    post_delete.connect(_deleted, sender=_model, dispatch_uid=f'audit_delete_{_model.__name__}')
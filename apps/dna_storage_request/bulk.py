@@ -0,0 +1,67 @@
+# bulk.py - Altas masivas con bulk_create (sin señales): códigos, contadores, auditoría y eventos
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import audit, codes, counters, events, facets
+from .models import AuditLog, DnaAliquot, Tissue
+
+
+def create_aliquots(request, shipment, items):
+    """
+    Crear un DnaAliquot por item ({'metadata_id', 'dna_aliquot_storage_location'}).
+    Los códigos se piden al allocator antes de abrir la transacción (salen del
+    bloque del proceso, sin tocar la base de datos) y el INSERT va en lotes.
+    Devuelve los aliquots creados, releídos por código.
+    """
+    qr_codes = codes.allocate('dna_aliquot_qr_code', len(items))
+    objs = [
+        DnaAliquot(
+            request=request,
+            shipment=shipment,
+            metadata_id=item['metadata_id'],
+            dna_aliquot_qr_code=code,
+            dna_aliquot_storage_location=item.get('dna_aliquot_storage_location'),
+        )
+        for item, code in zip(items, qr_codes)
+    ]
+    with transaction.atomic():
+        DnaAliquot.objects.bulk_create(objs, batch_size=500)
+        counters.adjust_sample_counts(DnaAliquot, counters.count_by_request(objs))
+        # MySQL no devuelve los ids de bulk_create: se releen por su código único
+        created = list(
+            DnaAliquot.objects.select_related('request', 'shipment', 'metadata__taxon')
+            .filter(dna_aliquot_qr_code__in=qr_codes).order_by('pk')
+        )
+        audit.record_bulk_create(DnaAliquot, created)
+        events.publish_bulk_update(DnaAliquot, [obj.pk for obj in created], action=AuditLog.ACTION_CREATE)
+    return created
+
+
+def assign_tissue_barcodes(queryset, chunk_size=500):
+    """
+    Dar un tissue_barcode del servidor a los tissues del queryset que no
+    tienen, por lotes de clave primaria. Devuelve cuántos se asignaron.
+    """
+    pending = queryset.filter(Q(tissue_barcode__isnull=True) | Q(tissue_barcode='')).order_by('pk')
+    assigned = 0
+    last_pk = 0
+    while True:
+        chunk = list(pending.filter(pk__gt=last_pk).select_related(None).only('pk', 'tissue_barcode')[:chunk_size])
+        if not chunk:
+            break
+        last_pk = chunk[-1].pk
+        now = timezone.now()
+        previous = [tissue.tissue_barcode for tissue in chunk]
+        for tissue, code in zip(chunk, codes.allocate('tissue_barcode', len(chunk))):
+            tissue.tissue_barcode, tissue.updated_at = code, now
+        with transaction.atomic():
+            Tissue.objects.bulk_update(chunk, ['tissue_barcode', 'updated_at'])
+            for tissue, old in zip(chunk, previous):
+                audit.record(Tissue, tissue.pk, AuditLog.ACTION_UPDATE,
+                             {'tissue_barcode': [old, tissue.tissue_barcode]})
+            events.publish_bulk_update(Tissue, [tissue.pk for tissue in chunk])
+        assigned += len(chunk)
+    if assigned:
+        facets.invalidate(Tissue)
+    return assigned
@@ -0,0 +1,30 @@
+# checks.py - Comprobaciones de configuración (python manage.py check)
+from django.conf import settings
+from django.core import checks
+
+# Backends cuyo contenido no ven los demás workers
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@checks.register(checks.Tags.caches)
+def check_replica_pin_cache(app_configs, **kwargs):
+    """
+    Con réplica, la marca "acaba de escribir" (routers.pin_user) la pone el
+    worker que atendió la escritura y la lee el que atiende la siguiente
+    lectura: si la caché es del proceso, el usuario puede leer de la réplica
+    datos anteriores a su propia escritura.
+    """
+    if not settings.DATABASE_REPLICA:
+        return []
+    backend = settings.CACHES.get(settings.REPLICA_PIN_CACHE, {}).get('BACKEND')
+    if backend not in PROCESS_LOCAL_CACHES:
+        return []
+    return [checks.Error(
+        f"CACHES['{settings.REPLICA_PIN_CACHE}'] (REPLICA_PIN_CACHE) usa {backend}, local a cada proceso.",
+        hint="Con DATABASE_REPLICA activa usa una caché compartida por los workers "
+             "(django.core.cache.backends.db.DatabaseCache tras createcachetable, Redis o Memcached).",
+        id='dna_storage_request.E001',
+    )]
@@ -0,0 +1,169 @@
+# codes.py - Asignación de códigos QR / barcode por bloques reservados
+import atexit
+import os
+import re
+import socket
+import threading
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import CodeBlock, CodeSequence, DnaAliquot, Tissue
+
+# secuencia -> (modelo, campo) donde se guardan los códigos
+CODE_FIELDS = {
+    'dna_aliquot_qr_code': (DnaAliquot, 'dna_aliquot_qr_code'),
+    'tissue_barcode': (Tissue, 'tissue_barcode'),
+}
+HOLDER = f'{socket.gethostname()}:{os.getpid()}'[:100]
+
+
+def _config(name):
+    return settings.CODE_SEQUENCES[name]
+
+
+def format_code(name, value):
+    config = _config(name)
+    return f"{config['prefix']}{value:0{config['width']}d}"
+
+
+def code_pattern(name):
+    config = _config(name)
+    return rf"^{re.escape(config['prefix'])}[0-9]{{{config['width']}}}$"
+
+
+def is_reserved_format(name, code):
+    """Los códigos con el formato del servidor no se aceptan del cliente"""
+    return bool(code) and re.match(code_pattern(name), code) is not None
+
+
+def _first_free_value(name):
+    """
+    Solo al crear la secuencia: por encima de cualquier código existente con
+    el mismo formato. Con ancho fijo el orden de texto es el numérico, así que
+    basta recorrer hacia atrás el índice UNIQUE del campo desde el prefijo
+    hasta el primer código con el formato (normalmente el primero).
+    """
+    model, field = CODE_FIELDS[name]
+    prefix = _config(name)['prefix']
+    candidates = (
+        model.objects.filter(**{f'{field}__startswith': prefix}).order_by(f'-{field}')
+        .values_list(field, flat=True).iterator(chunk_size=100)
+    )
+    for code in candidates:
+        if is_reserved_format(name, code):
+            return int(code[len(prefix):]) + 1
+    return 1
+
+
+def _locked_sequence(name):
+    # Lectura de la fila de la secuencia; el recorrido de códigos existentes
+    # solo se hace la primera vez, cuando la fila aún no existe
+    sequence = CodeSequence.objects.select_for_update().filter(name=name).first()
+    if sequence is None:
+        sequence, _ = CodeSequence.objects.get_or_create(
+            name=name, defaults={'next_value': _first_free_value(name)}
+        )
+        sequence = CodeSequence.objects.select_for_update().get(pk=sequence.pk)
+    return sequence
+
+
+def reserve_block(name, size):
+    """
+    Reservar [start, start + size) en una transacción con la fila de la
+    secuencia bloqueada (SELECT ... FOR UPDATE): dos workers nunca comparten rango.
+    """
+    with transaction.atomic():
+        sequence = _locked_sequence(name)
+        start = sequence.next_value
+        sequence.next_value = start + size
+        sequence.save(update_fields=['next_value', 'updated_at'])
+        return CodeBlock.objects.create(sequence=sequence, start=start, end=start + size, holder=HOLDER)
+
+
+def _close_block(block, used_up_to):
+    CodeBlock.objects.filter(pk=block.pk).update(used_up_to=used_up_to, released_at=timezone.now())
+
+
+class CodeAllocator:
+    """
+    Reparte en memoria los códigos del bloque reservado por este proceso; solo
+    va a la base de datos cuando el bloque se agota. Los códigos no chocan con
+    otros workers, así que los INSERT no contienden ni se reintentan.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.block = None
+        self.cursor = None
+        self._lock = threading.Lock()
+
+    def allocate(self, count):
+        if count <= 0:
+            return []
+        if connection.in_atomic_block:
+            return self._allocate_in_transaction(count)
+
+        block_size = _config(self.name)['block_size']
+        values = []
+        with self._lock:
+            while len(values) < count:
+                if self.block is None or self.cursor >= self.block.end:
+                    if self.block is not None:
+                        _close_block(self.block, self.block.end)
+                    self.block = reserve_block(self.name, max(block_size, count - len(values)))
+                    self.cursor = self.block.start
+                take = min(count - len(values), self.block.end - self.cursor)
+                values.extend(range(self.cursor, self.cursor + take))
+                self.cursor += take
+        return [format_code(self.name, value) for value in values]
+
+    def _allocate_in_transaction(self, count):
+        """
+        Dentro de una transacción del llamador la reserva se desharía con su
+        rollback, así que el bloque no se guarda para después: se usa para esta
+        llamada (reservado a la medida, sin sobrante).
+        """
+        block = reserve_block(self.name, count)
+        _close_block(block, block.end)
+        return [format_code(self.name, value) for value in range(block.start, block.end)]
+
+    def release(self):
+        """Anotar el resto del bloque como no usado (al terminar el proceso)"""
+        with self._lock:
+            if self.block is not None:
+                _close_block(self.block, self.cursor)
+                self.block = None
+
+
+_allocators = {}
+_allocators_lock = threading.Lock()
+
+
+def get_allocator(name):
+    if name not in _allocators:
+        with _allocators_lock:
+            if name not in _allocators:
+                _allocators[name] = CodeAllocator(name)
+    return _allocators[name]
+
+
+def allocate(name, count):
+    return get_allocator(name).allocate(count)
+
+
+def unused_ranges(name):
+    """[(start, end)] de códigos reservados que nunca se asignaron"""
+    blocks = CodeBlock.objects.filter(sequence__name=name, used_up_to__isnull=False).order_by('start')
+    return [(block.used_up_to, block.end) for block in blocks if block.used_up_to < block.end]
+
+
+@atexit.register
+def _release_all():
+    for allocator in list(_allocators.values()):
+        try:
+            allocator.release()
+        except Exception:
+            # Base de datos no disponible al salir: el bloque queda abierto (used_up_to nulo)
+            pass
@@ -0,0 +1,108 @@
+# counters.py - Mantener Request.tissue_count / aliquot_count de forma incremental
+from collections import Counter
+
+from django.db.models import Count, F
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import snapshots
+from .models import Request, Tissue, DnaAliquot
+
+# modelo hijo -> campo contador en Request
+COUNTER_FIELDS = {
+    Tissue: 'tissue_count',
+    DnaAliquot: 'aliquot_count',
+}
+
+
+def adjust_sample_counts(model, deltas):
+    """
+    Aplicar {request_id: delta} al contador de `model` con UPDATE ... SET
+    n = n + delta, un UPDATE por request distinto. Para los caminos bulk
+    (bulk_create, queryset.delete()) que no disparan señales.
+    """
+    field = COUNTER_FIELDS[model]
+    for request_id, delta in deltas.items():
+        if request_id is not None and delta:
+            # updated_at también: los clientes con ?updated_since= ven el nuevo conteo
+            Request.objects.filter(pk=request_id).update(
+                **{field: F(field) + delta, 'updated_at': timezone.now()}
+            )
+
+
+def count_by_request(objs):
+    """Counter {request_id: n} de una lista de Tissue/DnaAliquot"""
+    return Counter(obj.request_id for obj in objs)
+
+
+def recompute_sample_counts(request_ids):
+    """
+    Recalcular los contadores reales de los requests dados con dos consultas
+    agrupadas. Devuelve {request_id: (tissue_count, aliquot_count)}.
+    """
+    actual = {request_id: [0, 0] for request_id in request_ids}
+    for position, model in enumerate((Tissue, DnaAliquot)):
+        rows = (
+            model.objects.filter(request_id__in=request_ids)
+            .values('request_id').annotate(n=Count('pk')).values_list('request_id', 'n')
+        )
+        for request_id, n in rows:
+            actual[request_id][position] = n
+    return {request_id: tuple(counts) for request_id, counts in actual.items()}
+
+
+def fix_sample_counts(chunk_size=1000, dry_run=False, on_drift=None, on_chunk=None):
+    """
+    Recorrer los requests por lotes de clave primaria y corregir los contadores
+    desviados. on_drift(pk, antes, real) por cada desviación, on_chunk(revisados)
+    tras cada lote. Devuelve (revisados, desviados).
+    """
+    checked = drifted = 0
+    last_pk = 0
+    while True:
+        chunk = list(
+            Request.objects.filter(pk__gt=last_pk).order_by('pk')
+            .values_list('pk', 'tissue_count', 'aliquot_count')[:chunk_size]
+        )
+        if not chunk:
+            break
+        last_pk = chunk[-1][0]
+        actual = recompute_sample_counts([pk for pk, _, _ in chunk])
+
+        for pk, tissue_count, aliquot_count in chunk:
+            if actual[pk] == (tissue_count, aliquot_count):
+                continue
+            drifted += 1
+            if on_drift is not None:
+                on_drift(pk, (tissue_count, aliquot_count), actual[pk])
+            if not dry_run:
+                Request.objects.filter(pk=pk).update(
+                    tissue_count=actual[pk][0], aliquot_count=actual[pk][1]
+                )
+        checked += len(chunk)
+        if on_chunk is not None:
+            on_chunk(checked)
+    return checked, drifted
+
+
+# Señales: create, delete y cambio de request en save() individuales. El
+# request anterior se lee al guardar (snapshots), no al cargar cada instancia
+for _model in COUNTER_FIELDS:
+    snapshots.track(_model)
+
+
+@receiver(post_save, sender=Tissue)
+@receiver(post_save, sender=DnaAliquot)
+def count_saved_sample(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    previous = None if created else snapshots.stored_values(instance).get('request_id')
+    if previous != instance.request_id:
+        adjust_sample_counts(sender, {previous: -1, instance.request_id: 1})
+
+
+@receiver(post_delete, sender=Tissue)
+@receiver(post_delete, sender=DnaAliquot)
+def count_deleted_sample(sender, instance, **kwargs):
+    adjust_sample_counts(sender, {instance.request_id: -1})
@@ -0,0 +1,177 @@
+# duplicates.py - Detección de muestras duplicadas por claves hash normalizadas
+import hashlib
+import re
+from decimal import Decimal, InvalidOperation
+
+from django.db.models import Count, Q
+from django.db.models.signals import pre_save
+
+from .models import Metadata
+
+# Identificadores y campos con los que se combinan
+KEY_FIELDS = {
+    'sample_key': 'original_sample_id',
+    'collector_key': 'collector_sample_id',
+}
+# ~11 m: la misma recolección anotada con distinta precisión coincide
+COORDINATE_PLACES = Decimal('0.0001')
+_IGNORED_CHARACTERS = re.compile(r'[\s\-_./:#]+')
+# Claves por consulta IN al comparar un lote con la tabla
+LOOKUP_CHUNK = 1000
+
+
+def normalize_identifier(value):
+    """'AB-0012 ' y 'ab0012' son el mismo identificador"""
+    return _IGNORED_CHARACTERS.sub('', str(value or '').casefold())
+
+
+def _coordinate(value):
+    try:
+        return str(Decimal(str(value)).quantize(COORDINATE_PLACES))
+    except (InvalidOperation, ValueError):
+        return ''
+
+
+def duplicate_key(identifier, latitude, longitude, date):
+    """Hash de identificador normalizado + coordenadas + fecha ('' sin identificador)"""
+    identifier = normalize_identifier(identifier)
+    if not identifier:
+        return ''
+    date = date.isoformat() if hasattr(date, 'isoformat') else str(date or '')
+    raw = '|'.join((identifier, _coordinate(latitude), _coordinate(longitude), date))
+    return hashlib.blake2b(raw.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def keys_for(values):
+    """{campo clave: hash} de un dict con los campos de Metadata (o de una fila de manifest)"""
+    return {
+        key_field: duplicate_key(
+            values.get(identifier_field), values.get('decimal_latitude'),
+            values.get('decimal_longitude'), values.get('date_of_collection'),
+        )
+        for key_field, identifier_field in KEY_FIELDS.items()
+    }
+
+
+def assign_keys(instance):
+    for key_field, value in keys_for(instance.__dict__).items():
+        setattr(instance, key_field, value)
+
+
+def flag_duplicates(rows, user=None):
+    """
+    Marcar en una pasada las filas de un lote (dicts) que repiten una muestra,
+    dentro del propio lote o contra la tabla. Devuelve {índice: flags} solo
+    para las filas con duplicados. Sin `user` o con staff se listan todos los
+    ids existentes; si no, solo los del usuario y el resto se cuenta.
+    """
+    row_keys = [keys_for(row) for row in rows]
+    seen = {}
+    for index, keys in enumerate(row_keys):
+        for key in keys.values():
+            if key:
+                seen.setdefault(key, []).append(index)
+
+    existing = {}
+    all_keys = list(seen)
+    for start in range(0, len(all_keys), LOOKUP_CHUNK):
+        chunk = all_keys[start:start + LOOKUP_CHUNK]
+        matches = Metadata.objects.filter(
+            Q(sample_key__in=chunk) | Q(collector_key__in=chunk)
+        ).values_list('pk', 'sample_key', 'collector_key', 'request__requester__user_id')
+        for pk, sample_key, collector_key, owner_id in matches:
+            for key in {sample_key, collector_key}:
+                if key in seen:
+                    existing.setdefault(key, set()).add((pk, owner_id))
+
+    flags = {}
+    for index, keys in enumerate(row_keys):
+        in_batch, matched = set(), set()
+        for key in keys.values():
+            if not key:
+                continue
+            in_batch.update(other for other in seen[key] if other != index)
+            matched.update(existing.get(key, ()))
+        if not in_batch and not matched:
+            continue
+        visible = sorted(pk for pk, owner_id in matched
+                         if user is None or user.is_staff or owner_id == user.pk)
+        flags[index] = {
+            'in_batch': sorted(in_batch),
+            'existing': visible,
+            'existing_other_owners': len(matched) - len(visible),
+        }
+    return flags
+
+
+class _Clusters:
+    """Union-find sobre ids de Metadata (casi lineal en el número de miembros)"""
+
+    def __init__(self):
+        self.parent = {}
+
+    def find(self, item):
+        self.parent.setdefault(item, item)
+        root = item
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[item] != root:
+            self.parent[item], item = root, self.parent[item]
+        return root
+
+    def union(self, items):
+        items = iter(items)
+        first = self.find(next(items))
+        for item in items:
+            root = self.find(item)
+            if root != first:
+                self.parent[root] = first
+
+    def groups(self):
+        groups = {}
+        for item in self.parent:
+            groups.setdefault(self.find(item), []).append(item)
+        return [sorted(members) for members in groups.values()]
+
+
+def duplicate_clusters(queryset=None):
+    """
+    Grupos (listas de ids) de muestras duplicadas, los más grandes primero.
+    Las claves repetidas salen de un GROUP BY sobre los índices de hash (un
+    recorrido); solo se leen los miembros de esas claves y se unen en clusters:
+    dos filas que comparten cualquiera de las dos claves caen en el mismo.
+    """
+    queryset = Metadata.objects.all() if queryset is None else queryset
+    clusters = _Clusters()
+    for key_field in KEY_FIELDS:
+        repeated = (
+            queryset.exclude(**{key_field: ''}).order_by().values_list(key_field)
+            .annotate(n=Count('pk')).filter(n__gt=1).values_list(key_field, flat=True)
+        )
+        members = {}
+        rows = queryset.filter(**{f'{key_field}__in': repeated}).values_list('pk', key_field)
+        for pk, key in rows.iterator(chunk_size=2000):
+            members.setdefault(key, []).append(pk)
+        for pks in members.values():
+            clusters.union(pks)
+    return sorted(clusters.groups(), key=lambda members: (-len(members), members[0]))
+
+
+def describe_clusters(groups):
+    """Detalle de los miembros de una página de clusters"""
+    rows = Metadata.objects.filter(pk__in=[pk for members in groups for pk in members]).values(
+        'pk', 'request_id', 'original_sample_id', 'collector_sample_id', 'date_of_collection',
+        'decimal_latitude', 'decimal_longitude',
+    )
+    by_pk = {row.pop('pk'): row for row in rows}
+    return [
+        {'size': len(members), 'members': [{'id': pk, **by_pk[pk]} for pk in members]}
+        for members in groups
+    ]
+
+
+def _assign_keys(sender, instance, raw=False, **kwargs):
+    assign_keys(instance)
+
+
+pre_save.connect(_assign_keys, sender=Metadata, dispatch_uid='duplicates_keys_Metadata')
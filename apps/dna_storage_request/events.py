@@ -0,0 +1,101 @@
+# events.py - Registro de cambios de Shipment, Tissue y DnaAliquot para el stream SSE
+import weakref
+
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.utils import timezone
+
+from .models import AuditLog, ChangeEvent, Requester, Shipment, Tissue, DnaAliquot
+
+STREAMED_MODELS = (Shipment, Tissue, DnaAliquot)
+# Campos de estado incluidos en el evento (el cliente pide el detalle si lo necesita)
+PAYLOAD_FIELDS = {
+    Shipment: ('request_id', 'shipment_date', 'accession_date', 'tracking_number'),
+    Tissue: ('request_id', 'shipment_id', 'is_in_jacq', 'tissue_sample_storage_location'),
+    DnaAliquot: ('request_id', 'shipment_id', 'is_in_database', 'dna_aliquot_storage_location'),
+}
+
+# Callbacks del proceso (el broker SSE) avisados tras escribir eventos
+_listeners = []
+
+
+def add_listener(callback):
+    """
+    Se guarda una referencia débil: un broker (uno por event loop) deja de
+    recibir avisos y se libera cuando su loop desaparece.
+    """
+    ref = weakref.WeakMethod(callback) if hasattr(callback, '__self__') else weakref.ref(callback)
+    _listeners.append(ref)
+
+
+def _notify():
+    callbacks = [ref() for ref in _listeners]
+    _listeners[:] = [ref for ref, callback in zip(_listeners, callbacks) if callback is not None]
+    for callback in callbacks:
+        if callback is not None:
+            callback()
+
+
+def _payload(model, values):
+    return {field: values.get(field) for field in PAYLOAD_FIELDS[model]}
+
+
+def _write(events):
+    """Insertar tras el commit: el stream nunca anuncia un cambio que luego se deshace"""
+    def write():
+        ChangeEvent.objects.bulk_create(events, batch_size=500)
+        _notify()
+    transaction.on_commit(write)
+
+
+def publish_instance(model, instance, action):
+    owner_id = (
+        Requester.objects.filter(request__id=instance.request_id)
+        .values_list('user_id', flat=True).first()
+    )
+    _write([ChangeEvent(
+        model=model._meta.model_name,
+        object_id=instance.pk,
+        action=action,
+        owner_id=owner_id,
+        payload=_payload(model, instance.__dict__),
+        ts=timezone.now(),
+    )])
+
+
+def publish_bulk_update(model, pks, action=AuditLog.ACTION_UPDATE):
+    """
+    Eventos para un queryset.update() o un bulk_create (sin señales), con una
+    sola consulta de dueños
+    """
+    if not pks:
+        return
+    now = timezone.now()
+    rows = model.objects.filter(pk__in=pks).values(
+        'pk', 'request__requester__user_id', *PAYLOAD_FIELDS[model]
+    )
+    _write([
+        ChangeEvent(
+            model=model._meta.model_name,
+            object_id=row['pk'],
+            action=action,
+            owner_id=row['request__requester__user_id'],
+            payload=_payload(model, row),
+            ts=now,
+        )
+        for row in rows
+    ])
+
+
+def _saved(sender, instance, created, raw=False, **kwargs):
+    if not raw:
+        publish_instance(sender, instance, AuditLog.ACTION_CREATE if created else AuditLog.ACTION_UPDATE)
+
+
+def _deleted(sender, instance, **kwargs):
+    publish_instance(sender, instance, AuditLog.ACTION_DELETE)
+
+
+for _model in STREAMED_MODELS:
+    post_save.connect(_saved, sender=_model, dispatch_uid=f'events_save_{_model.__name__}')
+    post_delete.connect(_deleted, sender=_model, dispatch_uid=f'events_delete_{_model.__name__}')
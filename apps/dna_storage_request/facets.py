@@ -0,0 +1,158 @@
+# facets.py - Conteos por valor (?facets=) para los desplegables de filtros
+import hashlib
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Count
+from django.db.models.constants import LOOKUP_SEP
+from django.db.models.signals import post_save, post_delete
+
+from .models import Metadata, Taxon, Tissue
+
+FACETED_MODELS = (Metadata, Tissue)
+# Modelo escrito -> modelos cuyos conteos cambian (las facetas leen campos
+# relacionados: taxon__family en Metadata, metadata__taxon__scientific_name en Tissue)
+INVALIDATES = {
+    Metadata: (Metadata, Tissue),
+    Tissue: (Tissue,),
+    Taxon: (Metadata, Tissue),
+}
+# Parámetros que no cambian el queryset filtrado (paginación, orden, la propia petición)
+NON_FILTER_PARAMS = {'facets', 'page', 'limit', 'ordering', 'format'}
+
+
+def _cache():
+    return caches[settings.FACETS_CACHE]
+
+
+def _generation_cache():
+    # Compartida por los workers: una escritura en uno invalida los conteos de todos
+    return caches[settings.FACETS_GENERATION_CACHE]
+
+
+def _generation_key(model):
+    return f'facets:gen:{model._meta.label_lower}'
+
+
+def _generation(model):
+    """
+    Generación vigente del modelo. Es un timestamp y no un contador: si la
+    caché expulsa la clave, la nueva generación no coincide con ninguna anterior.
+    """
+    key = _generation_key(model)
+    generation = _generation_cache().get(key)
+    if generation is None:
+        _generation_cache().add(key, time.time_ns(), None)
+        generation = _generation_cache().get(key)
+    return generation
+
+
+def invalidate(*models):
+    """Descartar los conteos cacheados de los modelos y de los que dependen de ellos"""
+    generation = time.time_ns()
+    targets = {target for model in models for target in INVALIDATES.get(model, (model,))}
+    _generation_cache().set_many({_generation_key(target): generation for target in targets}, None)
+
+
+def filter_signature(query_params):
+    """Hash estable de los parámetros que afectan al queryset filtrado"""
+    items = sorted(
+        (key, sorted(query_params.getlist(key)))
+        for key in query_params if key not in NON_FILTER_PARAMS
+    )
+    return hashlib.sha1(repr(items).encode('utf-8')).hexdigest()
+
+
+def _split_path(model, path):
+    """
+    'taxon__family' -> ('taxon', Taxon, 'family'). Los campos de un modelo
+    relacionado se agrupan por la clave foránea (entera) y se traducen después.
+    """
+    *relations, attribute = path.split(LOOKUP_SEP)
+    if not relations:
+        return path, None, None
+    target = model
+    for name in relations:
+        target = target._meta.get_field(name).related_model
+    return LOOKUP_SEP.join(relations), target, attribute
+
+
+def count_values(queryset, path, limit):
+    """[{'value': v, 'count': n}] con los `limit` valores más frecuentes de `path`"""
+    group, target, attribute = _split_path(queryset.model, path)
+    grouped = queryset.order_by().values_list(group).annotate(n=Count('pk'))
+    if target is None:
+        rows = grouped.order_by('-n', group)[:limit]
+        return [{'value': value, 'count': n} for value, n in rows]
+
+    per_id = dict(grouped)
+    counts = Counter()
+    names = target.objects.filter(pk__in=[pk for pk in per_id if pk is not None]).values_list('pk', attribute)
+    for pk, name in names:
+        counts[name] += per_id[pk]
+    if None in per_id:
+        counts[None] += per_id[None]
+    return [{'value': value, 'count': n} for value, n in counts.most_common(limit)]
+
+
+def facet_counts(queryset, fields, facet_fields, scope, query_params):
+    """
+    Conteos de cada campo pedido sobre el queryset ya filtrado y acotado al
+    usuario. Cacheados por modelo, alcance, firma de filtros y campo.
+    """
+    model = queryset.model
+    prefix = f'facets:{model._meta.label_lower}:{_generation(model)}:{scope}:{filter_signature(query_params)}'
+    keys = {field: f'{prefix}:{field}' for field in fields}
+    cached = _cache().get_many(keys.values())
+
+    result, missing = {}, {}
+    for field, key in keys.items():
+        if key in cached:
+            result[field] = cached[key]
+        else:
+            result[field] = count_values(queryset, facet_fields[field], settings.FACETS_MAX_VALUES)
+            missing[key] = result[field]
+    if missing:
+        _cache().set_many(missing, settings.FACETS_CACHE_SECONDS)
+    return result
+
+
+class _PendingInvalidation:
+    """Modelos escritos en la transacción (o savepoint) en curso de una conexión"""
+
+    def __init__(self, connection):
+        self.connection = connection
+        # Un COMMIT, un ROLLBACK o el ROLLBACK de un savepoint sustituyen la
+        # lista run_on_commit: con otra lista o en otro savepoint se empieza otra
+        self.queue = connection.run_on_commit
+        self.savepoints = list(connection.savepoint_ids)
+        self.models = set()
+
+    def is_current(self):
+        return self.queue is self.connection.run_on_commit and self.savepoints == self.connection.savepoint_ids
+
+    def run(self):
+        if getattr(self.connection, '_facets_pending', None) is self:
+            self.connection._facets_pending = None
+        invalidate(*self.models)
+
+
+def _changed(sender, using, **kwargs):
+    # Tras el COMMIT: un conteo calculado antes se guarda con la generación
+    # anterior. Una sola invalidación por transacción aunque se escriban muchas filas
+    connection = transaction.get_connection(using)
+    pending = getattr(connection, '_facets_pending', None)
+    if pending is not None and pending.is_current():
+        pending.models.add(sender)
+        return
+    pending = connection._facets_pending = _PendingInvalidation(connection)
+    pending.models.add(sender)
+    transaction.on_commit(pending.run, using=using)
+
+
+for _model in INVALIDATES:
+    post_save.connect(_changed, sender=_model, dispatch_uid=f'facets_save_{_model.__name__}')
+    post_delete.connect(_changed, sender=_model, dispatch_uid=f'facets_delete_{_model.__name__}')
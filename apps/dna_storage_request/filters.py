@@ -0,0 +1,56 @@
+# filters.py - Filtros y ordenación con nombres públicos distintos de las rutas del ORM
+import django_filters
+from django_filters.constants import EMPTY_VALUES
+from rest_framework import filters
+
+from .models import ArchivedMetadata, Metadata, Taxon
+
+
+class TaxonNameFilter(django_filters.CharFilter):
+    """
+    Filtro exacto por un nombre del taxón. El nombre se resuelve en la tabla
+    Taxonomy (pequeña) y Metadata se filtra por taxon_id, un entero indexado.
+    """
+
+    def __init__(self, *args, taxon_path='taxon', **kwargs):
+        self.taxon_path = taxon_path
+        super().__init__(*args, **kwargs)
+
+    def filter(self, qs, value):
+        if value in EMPTY_VALUES:
+            return qs
+        taxon_ids = Taxon.objects.filter(**{self.field_name: value}).values('pk')
+        return qs.filter(**{f'{self.taxon_path}__in': taxon_ids})
+
+
+class MetadataFilter(django_filters.FilterSet):
+    taxon_group = TaxonNameFilter()
+    family = TaxonNameFilter()
+    genus = TaxonNameFilter()
+
+    class Meta:
+        model = Metadata
+        fields = ['request', 'taxon', 'taxon_group', 'family', 'genus', 'collected_by']
+
+
+class ArchivedMetadataFilter(MetadataFilter):
+    """Los mismos filtros sobre Archive_metadata (?include_archived=1)"""
+
+    class Meta(MetadataFilter.Meta):
+        model = ArchivedMetadata
+
+
+class AliasOrderingFilter(filters.OrderingFilter):
+    """
+    OrderingFilter que acepta los nombres públicos de ordering_fields y los
+    traduce con view.ordering_aliases (p. ej. scientific_name -> taxon__scientific_name).
+    """
+
+    def remove_invalid_fields(self, queryset, fields, view, request):
+        aliases = getattr(view, 'ordering_aliases', {})
+        valid = super().remove_invalid_fields(queryset, fields, view, request)
+        ordering = []
+        for term in valid:
+            prefix = '-' if term.startswith('-') else ''
+            ordering.append(prefix + aliases.get(term.lstrip('-'), term.lstrip('-')))
+        return ordering
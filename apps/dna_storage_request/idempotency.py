@@ -0,0 +1,148 @@
+# idempotency.py - Cabecera Idempotency-Key: la respuesta de un POST/PATCH se guarda y se repite
+import hashlib
+import json
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+METHODS = ('POST', 'PATCH')
+MAX_KEY_LENGTH = IdempotencyKey._meta.get_field('key').max_length
+# Cabeceras que no se guardan: las pone de nuevo el stack en cada respuesta
+_SKIPPED_HEADERS = {'vary', 'allow', 'set-cookie'}
+
+
+class IdempotencyKeyInProgress(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'Hay una petición en curso con esta Idempotency-Key, reinténtalo en unos segundos.'
+    default_code = 'idempotency_in_progress'
+
+
+class IdempotencyKeyMismatch(APIException):
+    status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+    default_detail = 'Esta Idempotency-Key ya se usó con otra petición (método, ruta o cuerpo distintos).'
+    default_code = 'idempotency_mismatch'
+
+
+def fingerprint(request):
+    """
+    Huella de método, ruta y cuerpo. Solo se lee el cuerpo JSON (acotado
+    por DATA_UPLOAD_MAX_MEMORY_SIZE); de los multipart y los chunks de
+    subida, que se procesan en streaming, cuentan tipo y longitud.
+    """
+    digest = hashlib.sha256()
+    for part in (request.method, request.get_full_path(), request.content_type or '',
+                 request.META.get('CONTENT_LENGTH') or ''):
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    if (request.content_type or '').startswith('application/json'):
+        digest.update(request.body)
+    return digest.hexdigest()
+
+
+def _claim(user, key, request, request_fingerprint):
+    try:
+        with transaction.atomic():
+            return IdempotencyKey.objects.create(
+                user=user, key=key, method=request.method, path=request.path[:500],
+                fingerprint=request_fingerprint,
+            )
+    except IntegrityError:
+        return None
+
+
+def _replay(record):
+    body = record.response_body
+    response = HttpResponse(bytes(body) if body is not None else b'', status=record.status_code)
+    for header, value in record.response_headers.items():
+        response[header] = value
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def begin(request, key):
+    """
+    Reservar la clave para esta petición (devuelve (registro, None)) o
+    devolver (None, respuesta guardada). Si otra petición con la clave sigue
+    en curso se espera hasta IDEMPOTENCY_WAIT_SECONDS a que termine; después,
+    IdempotencyKeyInProgress. Las claves caducadas o abandonadas (en curso más
+    de IDEMPOTENCY_LOCK_SECONDS) se reservan de nuevo.
+    """
+    if not key or len(key) > MAX_KEY_LENGTH or not key.isprintable():
+        raise ValidationError({HEADER: [f'Debe tener entre 1 y {MAX_KEY_LENGTH} caracteres imprimibles.']})
+    request_fingerprint = fingerprint(request)
+    user = request.user
+    deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT_SECONDS
+    while True:
+        record = _claim(user, key, request, request_fingerprint)
+        if record is not None:
+            return record, None
+
+        record = IdempotencyKey.objects.filter(user=user, key=key).defer('response_body').first()
+        if record is None:
+            # La primera terminó con error y liberó la clave
+            continue
+        now = timezone.now()
+        expired = record.created_at < now - timedelta(hours=settings.IDEMPOTENCY_TTL_HOURS)
+        abandoned = (record.status_code is None
+                     and record.created_at < now - timedelta(seconds=settings.IDEMPOTENCY_LOCK_SECONDS))
+        if expired or abandoned:
+            IdempotencyKey.objects.filter(pk=record.pk, created_at=record.created_at).delete()
+            continue
+        if record.fingerprint != request_fingerprint:
+            raise IdempotencyKeyMismatch()
+        if record.status_code is not None:
+            record.refresh_from_db(fields=['response_body'])
+            return None, _replay(record)
+        if time.monotonic() >= deadline:
+            raise IdempotencyKeyInProgress()
+        time.sleep(settings.IDEMPOTENCY_POLL_SECONDS)
+
+
+def finish(record, response):
+    """
+    Guardar la respuesta de la petición que reservó la clave. Los errores 5xx
+    y las respuestas en streaming no se guardan: se libera la clave y el
+    reintento se ejecuta de nuevo.
+    """
+    if response.streaming or response.status_code >= 500:
+        release(record)
+        return
+    if not getattr(response, 'is_rendered', True):
+        response.render()
+    content = response.content
+    headers = {header: value for header, value in response.items() if header.lower() not in _SKIPPED_HEADERS}
+    if len(content) > settings.IDEMPOTENCY_MAX_RESPONSE_BYTES:
+        # Demasiado grande para guardarla: la repetición lleva el estado y un aviso
+        headers = {'Content-Type': 'application/json'}
+        content = json.dumps(
+            {'detail': 'La petición ya se procesó; su respuesta no se guardó por su tamaño.'}
+        ).encode()
+    IdempotencyKey.objects.filter(pk=record.pk).update(
+        status_code=response.status_code, response_headers=headers, response_body=content,
+    )
+
+
+def release(record):
+    IdempotencyKey.objects.filter(pk=record.pk, status_code__isnull=True).delete()
+
+
+def purge_expired(hours=None, batch_size=5000):
+    """Borrar por lotes las claves de hace más de IDEMPOTENCY_TTL_HOURS. Devuelve cuántas."""
+    hours = settings.IDEMPOTENCY_TTL_HOURS if hours is None else hours
+    old = IdempotencyKey.objects.filter(created_at__lt=timezone.now() - timedelta(hours=hours))
+    total = 0
+    while True:
+        pks = list(old.values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return total
+        IdempotencyKey.objects.filter(pk__in=pks).delete()
+        total += len(pks)
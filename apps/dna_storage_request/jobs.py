@@ -0,0 +1,329 @@
+# jobs.py - Cola de trabajos largos en la base de datos (sin broker), ejecutados por run_jobs
+import csv
+import json
+import logging
+import os
+import shutil
+import socket
+import time
+import uuid
+from datetime import timedelta
+from functools import partial
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.text import get_valid_filename
+
+from . import archive, counters, routers
+from .models import Job, Metadata, Request, Taxon
+from .reconciliation import REGISTRIES, reconcile
+from .uploads import BLOCK_SIZE
+
+logger = logging.getLogger(__name__)
+
+HOLDER = f'{socket.gethostname()}:{os.getpid()}'[:100]
+# Candidatos leídos por intento de reclamar (varios workers compiten por los primeros)
+CLAIM_BATCH = 10
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def job_dir(job_id):
+    return Path(settings.JOB_ROOT) / job_id.hex
+
+
+def input_path(job):
+    return job_dir(job.pk) / 'input'
+
+
+def result_path(job):
+    return job_dir(job.pk) / 'result'
+
+
+def enqueue(user, kind, params=None, input_file=None):
+    """
+    Crear el job. El fichero de entrada se copia antes del commit, así ningún
+    worker reclama el job sin tenerlo; si la transacción falla se borra. Si
+    se deshace la transacción de un llamador, prune_finished borra el
+    directorio que queda sin job.
+    """
+    job = Job(user=user, kind=kind, params=params or {})
+    try:
+        with transaction.atomic():
+            job.save(force_insert=True)
+            if input_file is not None:
+                path = input_path(job)
+                path.parent.mkdir(parents=True, exist_ok=True)
+                with open(path, 'wb') as fh:
+                    for block in input_file.chunks(BLOCK_SIZE):
+                        fh.write(block)
+    except BaseException:
+        shutil.rmtree(job_dir(job.pk), ignore_errors=True)
+        raise
+    return job
+
+
+def cancel(job):
+    """Cancelar un job en cola o en ejecución (el handler se entera en su siguiente progreso)"""
+    now = timezone.now()
+    return Job.objects.filter(
+        pk=job.pk, status__in=(Job.STATUS_QUEUED, Job.STATUS_RUNNING)
+    ).update(status=Job.STATUS_CANCELLED, finished_at=now, updated_at=now)
+
+
+class JobProgress:
+    """
+    Progreso de un job en ejecución. Escribe como mucho cada
+    JOB_PROGRESS_SECONDS; si el UPDATE no encuentra el job en running es que
+    se canceló y el handler se interrumpe con JobCancelled.
+    """
+
+    def __init__(self, job):
+        self.job = job
+        self._written_at = 0.0
+
+    def update(self, done, total=None, message=None):
+        job = self.job
+        job.progress = done
+        if total is not None:
+            job.total = total
+        if message is not None:
+            job.message = message[:255]
+        now = time.monotonic()
+        if now - self._written_at < settings.JOB_PROGRESS_SECONDS:
+            return
+        self._written_at = now
+        updated = Job.objects.filter(pk=job.pk, status=Job.STATUS_RUNNING).update(
+            progress=job.progress, total=job.total, message=job.message,
+            heartbeat_at=timezone.now(), updated_at=timezone.now(),
+        )
+        if not updated:
+            raise JobCancelled()
+
+    def open_result(self, filename, binary=False):
+        """Fichero de resultado del job; filename es el nombre de descarga"""
+        path = result_path(self.job)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.job.result_filename = get_valid_filename(filename) or 'result'
+        if binary:
+            return open(path, 'wb')
+        return open(path, 'w', encoding='utf-8', newline='')
+
+
+def claim_next():
+    """
+    Pasar a running el job en cola más antiguo con un UPDATE condicional: si
+    otro worker lo reclamó antes, el UPDATE no afecta a ninguna fila y se
+    prueba con el siguiente. Devuelve el id o None.
+    """
+    candidates = list(
+        Job.objects.filter(status=Job.STATUS_QUEUED).order_by('created_at')
+        .values_list('pk', flat=True)[:CLAIM_BATCH]
+    )
+    for pk in candidates:
+        now = timezone.now()
+        claimed = Job.objects.filter(pk=pk, status=Job.STATUS_QUEUED).update(
+            status=Job.STATUS_RUNNING, worker=HOLDER, attempts=F('attempts') + 1,
+            started_at=now, heartbeat_at=now, updated_at=now,
+        )
+        if claimed:
+            return pk
+    return None
+
+
+def heartbeat(job_ids):
+    """El worker marca sus jobs como vivos aunque el handler no informe progreso"""
+    if job_ids:
+        Job.objects.filter(pk__in=job_ids, status=Job.STATUS_RUNNING).update(heartbeat_at=timezone.now())
+
+
+def requeue_stale():
+    """
+    Jobs en running sin latido desde hace JOB_STALE_SECONDS (worker caído):
+    vuelven a la cola hasta JOB_MAX_ATTEMPTS intentos; después, fallidos.
+    """
+    now = timezone.now()
+    stale = Job.objects.filter(
+        status=Job.STATUS_RUNNING, heartbeat_at__lt=now - timedelta(seconds=settings.JOB_STALE_SECONDS)
+    )
+    requeued = stale.filter(attempts__lt=settings.JOB_MAX_ATTEMPTS).update(
+        status=Job.STATUS_QUEUED, worker='', updated_at=now
+    )
+    failed = stale.update(
+        status=Job.STATUS_FAILED, error='El worker se detuvo sin terminar el job',
+        finished_at=now, updated_at=now,
+    )
+    return requeued, failed
+
+
+def prune_finished():
+    """Borrar los jobs terminados hace más de JOB_RETENTION_DAYS y sus ficheros"""
+    limit = timezone.now() - timedelta(days=settings.JOB_RETENTION_DAYS)
+    old = Job.objects.filter(status__in=Job.FINISHED_STATUSES, finished_at__lt=limit)
+    pks = list(old.values_list('pk', flat=True))
+    for pk in pks:
+        shutil.rmtree(job_dir(pk), ignore_errors=True)
+    Job.objects.filter(pk__in=pks).delete()
+    _prune_orphan_dirs()
+    return len(pks)
+
+
+def _prune_orphan_dirs():
+    # Directorios de jobs cuyo INSERT se deshizo con la transacción del
+    # llamador. Solo los de hace más de JOB_STALE_SECONDS: uno reciente puede
+    # ser de un enqueue que aún no ha hecho commit.
+    root = Path(settings.JOB_ROOT)
+    if not root.is_dir():
+        return
+    cutoff = time.time() - settings.JOB_STALE_SECONDS
+    candidates = {}
+    for path in root.iterdir():
+        try:
+            if path.is_dir() and path.stat().st_mtime < cutoff:
+                candidates[uuid.UUID(hex=path.name)] = path
+        except ValueError:
+            continue
+    existing = set(Job.objects.filter(pk__in=list(candidates)).values_list('pk', flat=True))
+    for pk, path in candidates.items():
+        if pk not in existing:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def _finish(job, status, **fields):
+    # Condicional: un job cancelado mientras corría se queda cancelado
+    now = timezone.now()
+    return Job.objects.filter(pk=job.pk, status=Job.STATUS_RUNNING).update(
+        status=status, finished_at=now, heartbeat_at=now, updated_at=now, **fields
+    )
+
+
+def run_job(job_id):
+    """Ejecutar un job ya reclamado. Se llama en un hilo o proceso del pool de run_jobs."""
+    try:
+        job = Job.objects.select_related('user').get(pk=job_id)
+        progress = JobProgress(job)
+        try:
+            summary = JOB_KINDS[job.kind]['handler'](job, progress)
+        except JobCancelled:
+            result_path(job).unlink(missing_ok=True)
+            return
+        except Exception as exc:
+            logger.exception('Job %s (%s) falló', job.pk, job.kind)
+            _finish(job, Job.STATUS_FAILED, error=f'{type(exc).__name__}: {exc}')
+            return
+        finished = _finish(
+            job, Job.STATUS_SUCCEEDED, result=summary, result_filename=job.result_filename,
+            progress=job.progress, total=job.total, message=job.message,
+        )
+        if not finished:
+            result_path(job).unlink(missing_ok=True)
+    finally:
+        # Cada hilo del pool abre su propia conexión: cerrarla al terminar
+        connection.close()
+
+
+# Tipos de job: handler(job, progress) -> resumen (JSON) guardado en job.result
+
+def _metadata_export_columns():
+    """{columna del CSV: campo para values_list}, con los nombres del taxón planos"""
+    columns = {}
+    for field in Metadata._meta.concrete_fields:
+        if field.name == 'taxon':
+            columns.update({name: f'taxon__{name}' for name in Taxon.NAME_FIELDS})
+        elif field.editable or field.primary_key:
+            columns[field.attname] = field.attname
+    return columns
+
+
+def export_metadata(job, progress, chunk_size=2000):
+    """CSV de los metadata visibles para el usuario del job (params: request opcional)"""
+    queryset = Metadata.objects.all()
+    if not job.user.is_staff:
+        queryset = queryset.filter(request__requester__user=job.user)
+    if job.params.get('request'):
+        queryset = queryset.filter(request_id=int(job.params['request']))
+    columns = _metadata_export_columns()
+    done = 0
+    last_pk = 0
+    rows = queryset.order_by('pk').values_list(*columns.values())
+    # Lecturas a la réplica si la hay (salvo que el usuario acabe de escribir)
+    with routers.use_replica(job.user), \
+            progress.open_result(f"metadata-{timezone.localdate():%Y%m%d}.csv") as fh:
+        progress.update(0, total=queryset.count())
+        writer = csv.writer(fh)
+        writer.writerow(columns)
+        while True:
+            chunk = list(rows.filter(pk__gt=last_pk)[:chunk_size])
+            if not chunk:
+                break
+            last_pk = chunk[-1][0]
+            writer.writerows(chunk)
+            done += len(chunk)
+            progress.update(done)
+    return {'rows': done}
+
+
+def validate_manifest_file(job, progress):
+    """Informe de validación del manifest de entrada (params: delimiter)"""
+    # Import diferido: manifest importa serializers
+    from .manifest import validate_manifest
+
+    with open(input_path(job), encoding='utf-8-sig', newline='') as lines:
+        report = validate_manifest(lines, delimiter=job.params.get('delimiter', ','))
+    with progress.open_result('manifest-report.json') as fh:
+        json.dump(report, fh)
+    progress.update(report['rows'], total=report['rows'])
+    return {key: report[key] for key in ('rows', 'valid_rows', 'truncated')}
+
+
+def reconcile_export(registry, job, progress):
+    """Reconciliación con el export de entrada (params: column, delimiter, has_header, dry_run)"""
+    model, code_field, _ = REGISTRIES[registry]
+    params = job.params
+    progress.update(0, total=model.objects.filter(**{f'{code_field}__isnull': False}).count())
+    with open(input_path(job), encoding='utf-8', newline='') as lines:
+        return reconcile(
+            registry, lines,
+            column=int(params.get('column', 0)),
+            delimiter=params.get('delimiter', ','),
+            has_header=bool(params.get('has_header')),
+            dry_run=bool(params.get('dry_run')),
+            on_chunk=progress.update,
+        )
+
+
+def rebuild_sample_counts(job, progress):
+    """Recalcular tissue_count / aliquot_count de todos los requests (params: dry_run)"""
+    progress.update(0, total=Request.objects.count())
+    checked, drifted = counters.fix_sample_counts(
+        dry_run=bool(job.params.get('dry_run')), on_chunk=progress.update
+    )
+    return {'checked': checked, 'drifted': drifted}
+
+
+def archive_closed_requests(job, progress):
+    """Archivar los requests cerrados (params: days, dry_run)"""
+    days = int(job.params.get('days', settings.ARCHIVE_AFTER_DAYS))
+    archived = archive.archive_closed(
+        before=timezone.now() - timedelta(days=days),
+        dry_run=bool(job.params.get('dry_run')), on_chunk=progress.update,
+    )
+    return {'archived': archived}
+
+
+# kind -> handler, si es solo para admin y si necesita fichero de entrada
+JOB_KINDS = {
+    'export-metadata': {'handler': export_metadata, 'staff_only': False, 'input_file': False},
+    'validate-manifest': {'handler': validate_manifest_file, 'staff_only': False, 'input_file': True},
+    'reconcile-jacq': {'handler': partial(reconcile_export, 'jacq'), 'staff_only': True, 'input_file': True},
+    'reconcile-dna-database': {
+        'handler': partial(reconcile_export, 'dna-database'), 'staff_only': True, 'input_file': True,
+    },
+    'rebuild-sample-counts': {'handler': rebuild_sample_counts, 'staff_only': True, 'input_file': False},
+    'archive-closed-requests': {'handler': archive_closed_requests, 'staff_only': True, 'input_file': False},
+}
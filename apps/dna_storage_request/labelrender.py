@@ -0,0 +1,214 @@
+# labelrender.py - Códigos de barras (Code 128), QR y hojas PDF de etiquetas
+#
+# Sin imports de Django: render_symbol se ejecuta en el pool de procesos de labels.py.
+# Todo se dibuja como rectángulos vectoriales en PDF (nítido a cualquier resolución).
+import zlib
+
+import segno
+
+MM = 72 / 25.4
+
+# Code 128: anchos barra/espacio de los valores 0-106 (106 = stop)
+CODE128_PATTERNS = (
+    '212222', '222122', '222221', '121223', '121322', '131222', '122213', '122312', '132212', '221213',
+    '221312', '231212', '112232', '122132', '122231', '113222', '123122', '123221', '223211', '221132',
+    '221231', '213212', '223112', '312131', '311222', '321122', '321221', '312212', '322112', '322211',
+    '212123', '212321', '232121', '111323', '131123', '131321', '112313', '132113', '132311', '211313',
+    '231113', '231311', '112133', '112331', '132131', '113123', '113321', '133121', '313121', '211331',
+    '231131', '213113', '213311', '213131', '311123', '311321', '331121', '312113', '312311', '332111',
+    '314111', '221411', '431111', '111224', '111422', '121124', '121421', '141122', '141221', '112214',
+    '112412', '122114', '122411', '142112', '142211', '241211', '221114', '413111', '241112', '134111',
+    '111242', '121142', '121241', '114212', '124112', '124211', '411212', '421112', '421211', '212141',
+    '214121', '412121', '111143', '111341', '131141', '114113', '114311', '411113', '411311', '113141',
+    '114131', '311141', '411131', '211412', '211214', '211232', '2331112',
+)
+CODE128_START_B = 104
+CODE128_START_C = 105
+CODE128_STOP = 106
+QUIET_ZONE_MODULES = 10
+
+
+def code128_widths(text):
+    """
+    Anchos (en módulos) de barras y espacios alternos, empezando por barra.
+    Los códigos solo numéricos de longitud par usan el juego C (dos dígitos por símbolo).
+    """
+    if text.isdigit() and text.isascii() and len(text) % 2 == 0:
+        values = [CODE128_START_C] + [int(text[i:i + 2]) for i in range(0, len(text), 2)]
+    else:
+        values = [CODE128_START_B]
+        for char in text:
+            code = ord(char)
+            if not 32 <= code <= 127:
+                raise ValueError(f'Carácter no codificable en Code 128-B: {char!r}')
+            values.append(code - 32)
+    checksum = (values[0] + sum(position * value for position, value in enumerate(values[1:], 1))) % 103
+    values += [checksum, CODE128_STOP]
+    return [int(width) for value in values for width in CODE128_PATTERNS[value]]
+
+
+def _rect(x, y, width, height):
+    return f'{x:.3f} {y:.3f} {width:.3f} {height:.3f} re\n'
+
+
+def _barcode_ops(text, width, height):
+    widths = code128_widths(text)
+    module = width / (sum(widths) + 2 * QUIET_ZONE_MODULES)
+    x = QUIET_ZONE_MODULES * module
+    ops = []
+    for index, modules in enumerate(widths):
+        if index % 2 == 0:
+            ops.append(_rect(x, 0, modules * module, height))
+        x += modules * module
+    return ops
+
+
+def _qr_ops(text, size):
+    matrix = segno.make_qr(text, error='m').matrix
+    module = size / (len(matrix) + 4)
+    ops = []
+    for row_index, row in enumerate(matrix):
+        y = size - (row_index + 3) * module
+        start = None
+        # Módulos oscuros contiguos de una fila como un solo rectángulo
+        for column, dark in enumerate(list(row) + [0]):
+            if dark and start is None:
+                start = column
+            elif not dark and start is not None:
+                ops.append(_rect((start + 2) * module, y, (column - start) * module, module))
+                start = None
+    return ops
+
+
+def render_symbol(job):
+    """
+    (kind, code, width, height) -> operadores PDF del símbolo en una caja de
+    width x height puntos con origen abajo a la izquierda. kind es 'barcode' o 'qr'.
+    """
+    kind, code, width, height = job
+    try:
+        if kind == 'qr':
+            ops = _qr_ops(code, min(width, height))
+        else:
+            ops = _barcode_ops(code, width, height)
+    except ValueError:
+        # Código no representable: la etiqueta sale solo con el texto
+        return b''
+    return ('0 0 0 rg\n' + ''.join(ops) + 'f\n').encode('ascii')
+
+
+def _pdf_text(value):
+    escaped = value.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+    return escaped.encode('latin-1', 'replace')
+
+
+class LabelSheet:
+    """
+    Hoja A4 con una rejilla de etiquetas. pages() genera el PDF por trozos
+    (una página cada vez) para enviarlo en streaming sin tenerlo entero en memoria.
+    """
+    PAGE_WIDTH = 210 * MM
+    PAGE_HEIGHT = 297 * MM
+    CAPTION_SIZE = 6
+
+    def __init__(self, columns, rows, label_width_mm, label_height_mm, margin_mm):
+        self.columns = columns
+        self.rows = rows
+        self.label_width = label_width_mm * MM
+        self.label_height = label_height_mm * MM
+        self.margin = margin_mm * MM
+        self.gap_x = (self.PAGE_WIDTH - 2 * self.margin - columns * self.label_width) / max(columns - 1, 1)
+        self.gap_y = (self.PAGE_HEIGHT - 2 * self.margin - rows * self.label_height) / max(rows - 1, 1)
+
+    @property
+    def per_page(self):
+        return self.columns * self.rows
+
+    def symbol_box(self, kind):
+        """Tamaño (ancho, alto) en puntos reservado al símbolo dentro de la etiqueta"""
+        padding = 2 * MM
+        height = self.label_height - 2 * padding - self.CAPTION_SIZE * 2.4
+        if kind == 'qr':
+            height = self.label_height - 2 * padding
+            return height, height
+        return self.label_width - 2 * padding, height
+
+    def _label_ops(self, index, kind, symbol, captions):
+        column, row = index % self.columns, index // self.columns
+        x = self.margin + column * (self.label_width + self.gap_x)
+        y = self.PAGE_HEIGHT - self.margin - (row + 1) * self.label_height - row * self.gap_y
+        padding = 2 * MM
+        symbol_width, symbol_height = self.symbol_box(kind)
+        if kind == 'qr':
+            symbol_origin = (x + padding, y + padding)
+            text_x, text_y = x + 2 * padding + symbol_width, y + self.label_height - padding - self.CAPTION_SIZE
+        else:
+            symbol_origin = (x + padding, y + self.label_height - padding - symbol_height)
+            text_x, text_y = x + padding, y + padding + self.CAPTION_SIZE * 1.2
+        parts = [f'q 1 0 0 1 {symbol_origin[0]:.3f} {symbol_origin[1]:.3f} cm\n'.encode('ascii'), symbol, b'Q\n']
+        for line, caption in enumerate(captions):
+            parts += [
+                f'BT /F1 {self.CAPTION_SIZE} Tf {text_x:.3f} {text_y - line * self.CAPTION_SIZE * 1.2:.3f} Td ('.encode('ascii'),
+                _pdf_text(caption),
+                b') Tj ET\n',
+            ]
+        return b''.join(parts)
+
+    def pages(self, labels):
+        """
+        labels: iterable de (kind, symbol, captions). Genera los bytes del PDF.
+        Objetos fijos: 1 catálogo, 2 árbol de páginas, 3 fuente; el resto, por página.
+        """
+        offsets = {}
+        position = 0
+        page_ids = []
+
+        def emit(number, body):
+            nonlocal position
+            offsets[number] = position
+            chunk = f'{number} 0 obj\n'.encode('ascii') + body + b'\nendobj\n'
+            position += len(chunk)
+            return chunk
+
+        header = b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n'
+        position += len(header)
+        yield header
+
+        next_id = 4
+        page = []
+        for label in labels:
+            page.append(label)
+            if len(page) == self.per_page:
+                chunk, next_id = self._page(page, next_id, page_ids, emit)
+                yield chunk
+                page = []
+        if page or not page_ids:
+            chunk, next_id = self._page(page, next_id, page_ids, emit)
+            yield chunk
+
+        kids = ' '.join(f'{page_id} 0 R' for page_id in page_ids)
+        tail = [
+            emit(1, b'<< /Type /Catalog /Pages 2 0 R >>'),
+            emit(2, f'<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>'.encode('ascii')),
+            emit(3, b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>'),
+        ]
+        xref_position = position
+        xref = [f'xref\n0 {next_id}\n'.encode('ascii'), b'0000000000 65535 f \n']
+        xref += [f'{offsets[number]:010d} 00000 n \n'.encode('ascii') for number in range(1, next_id)]
+        trailer = f'trailer\n<< /Size {next_id} /Root 1 0 R >>\nstartxref\n{xref_position}\n%%EOF\n'
+        yield b''.join(tail) + b''.join(xref) + trailer.encode('ascii')
+
+    def _page(self, labels, next_id, page_ids, emit):
+        content = zlib.compress(b''.join(
+            self._label_ops(index, kind, symbol, captions)
+            for index, (kind, symbol, captions) in enumerate(labels)
+        ))
+        content_id, page_id = next_id, next_id + 1
+        page_ids.append(page_id)
+        chunk = emit(content_id, f'<< /Length {len(content)} /Filter /FlateDecode >>\nstream\n'.encode('ascii')
+                     + content + b'\nendstream')
+        chunk += emit(page_id, (
+            f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {self.PAGE_WIDTH:.2f} {self.PAGE_HEIGHT:.2f}] '
+            f'/Resources << /Font << /F1 3 0 R >> >> /Contents {content_id} 0 R >>'
+        ).encode('ascii'))
+        return chunk, next_id + 2
@@ -0,0 +1,76 @@
+# labels.py - Hojas de etiquetas por lotes: caché por código y render en un pool de procesos
+import hashlib
+from itertools import islice
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Q
+
+from .labelrender import LabelSheet, render_symbol
+from .pools import get_process_pool
+from .models import Tissue, DnaAliquot
+
+# modelo -> (símbolo, campo con el código)
+LABEL_KINDS = {
+    Tissue: ('barcode', 'tissue_barcode'),
+    DnaAliquot: ('qr', 'dna_aliquot_qr_code'),
+}
+CAPTION_LENGTH = 32
+
+
+def get_sheet():
+    return LabelSheet(**settings.LABEL_SHEET)
+
+
+def _cache_key(job):
+    return 'labels:' + hashlib.sha1(repr(job).encode('utf-8')).hexdigest()
+
+
+def render_symbols(jobs):
+    """
+    {job: operadores PDF} para un lote de (kind, code, width, height). Lo que
+    está en caché no se vuelve a dibujar; el resto va al pool si el lote es grande.
+    """
+    cache = caches[settings.LABEL_CACHE]
+    keys = {job: _cache_key(job) for job in jobs}
+    cached = cache.get_many(keys.values())
+    symbols = {job: cached[key] for job, key in keys.items() if key in cached}
+
+    missing = [job for job in keys if job not in symbols]
+    if len(missing) >= settings.LABEL_POOL_THRESHOLD:
+        chunksize = max(1, len(missing) // (4 * settings.LABEL_RENDER_WORKERS))
+        pool = get_process_pool('labels', settings.LABEL_RENDER_WORKERS)
+        rendered = list(pool.map(render_symbol, missing, chunksize=chunksize))
+    else:
+        rendered = [render_symbol(job) for job in missing]
+    if missing:
+        new = dict(zip(missing, rendered))
+        cache.set_many({keys[job]: symbol for job, symbol in new.items()}, settings.LABEL_CACHE_SECONDS)
+        symbols.update(new)
+    return symbols
+
+
+def labelled(queryset):
+    """Filas del queryset que tienen código (las demás no generan etiqueta)"""
+    _, field = LABEL_KINDS[queryset.model]
+    return queryset.exclude(Q(**{f'{field}__isnull': True}) | Q(**{field: ''}))
+
+
+def iter_labels(queryset, sheet):
+    """
+    (kind, símbolo, textos) por fila, por lotes de LABEL_BATCH_SIZE: la hoja
+    empieza a enviarse antes de dibujar todo el pedido.
+    """
+    kind, field = LABEL_KINDS[queryset.model]
+    width, height = sheet.symbol_box(kind)
+    rows = labelled(queryset).order_by('pk').values_list(
+        field, 'metadata__original_sample_id', 'metadata__taxon__scientific_name'
+    ).iterator(chunk_size=settings.LABEL_BATCH_SIZE)
+    while True:
+        batch = list(islice(rows, settings.LABEL_BATCH_SIZE))
+        if not batch:
+            break
+        symbols = render_symbols({(kind, code, width, height) for code, _, _ in batch})
+        for code, sample_id, scientific_name in batch:
+            captions = [code, sample_id or '', (scientific_name or '')[:CAPTION_LENGTH]]
+            yield kind, symbols[(kind, code, width, height)], captions
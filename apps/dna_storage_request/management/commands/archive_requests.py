@@ -0,0 +1,30 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from apps.dna_storage_request.archive import archive_closed
+
+
+class Command(BaseCommand):
+    help = (
+        "Mueve a las tablas Archive_* los requests cerrados (MTA firmado y "
+        "shipments recibidos) sin cambios recientes, con sus metadata, "
+        "shipments, tissues, aliquots y subidas, en una transacción por lote."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.ARCHIVE_AFTER_DAYS,
+                            help='Días sin cambios para archivar un request cerrado')
+        parser.add_argument('--batch-size', type=int, default=settings.ARCHIVE_BATCH_SIZE,
+                            help='Requests movidos por transacción')
+        parser.add_argument('--dry-run', action='store_true', help='Solo contar, sin mover')
+
+    def handle(self, *args, days, batch_size, dry_run, **options):
+        archived = archive_closed(
+            before=timezone.now() - timedelta(days=days), batch_size=batch_size, dry_run=dry_run,
+            on_chunk=lambda done: self.stdout.write(f"... {done}"),
+        )
+        action = 'archivables' if dry_run else 'archivados'
+        self.stdout.write(f"Requests {action}: {archived}")
@@ -0,0 +1,74 @@
+import timeit
+from datetime import date, datetime, timezone as dt_timezone
+from decimal import Decimal
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from apps.dna_storage_request.models import DnaAliquot, Metadata, Request, Requester, Shipment, Taxon, Tissue
+from apps.dna_storage_request.serializers import (
+    DnaAliquotSerializer, RequestSerializer, ShipmentSerializer, TissueSerializer,
+)
+
+
+def _sample_objects():
+    """Instancias en memoria (sin guardar) con las relaciones ya cargadas: no hay consultas"""
+    now = datetime(2024, 1, 10, 12, 0, tzinfo=dt_timezone.utc)
+    requester = Requester(pk=1, first_name='Ana', last_name='Pérez', contact_person_email='ana@example.org',
+                          requester_institution='BGBM', institution_location='Berlin')
+    request = Request(pk=1, requester=requester, request_date=date(2024, 1, 10), tissue_count=1,
+                      aliquot_count=1, created_at=now, updated_at=now)
+    shipment = Shipment(pk=1, request=request, shipment_date=date(2024, 2, 1), tracking_number='TRK-1',
+                        created_at=now, updated_at=now)
+    taxon = Taxon(pk=1, taxon_group='Plantae', family='Asteraceae', genus='Bellis',
+                  scientific_name='Bellis perennis', interspecific_epithet='perennis')
+    metadata = Metadata(pk=1, request=request, taxon=taxon, original_sample_id='B 10 0123456',
+                        date_of_collection=date(2023, 5, 17), decimal_latitude=Decimal('52.4554'),
+                        decimal_longitude=Decimal('13.305'), elevation=50, created_at=now, updated_at=now)
+    tissue = Tissue(pk=1, request=request, shipment=shipment, metadata=metadata, tissue_barcode='TB0000000001',
+                    created_at=now, updated_at=now)
+    aliquot = DnaAliquot(pk=1, request=request, shipment=shipment, metadata=metadata,
+                         dna_aliquot_qr_code='DQ0000000001', created_at=now, updated_at=now)
+    return [
+        ('request', RequestSerializer, request),
+        ('shipment', ShipmentSerializer, shipment),
+        ('tissue', TissueSerializer, tissue),
+        ('dna-aliquot', DnaAliquotSerializer, aliquot),
+    ]
+
+
+class Command(BaseCommand):
+    help = (
+        "Mide el coste por petición de los serializers por rol (construcción, "
+        "detalle y lista) sin y con la caché de campos (SERIALIZER_FIELD_CACHE)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=settings.REST_FRAMEWORK['PAGE_SIZE'],
+                            help='Filas de la lista (default: PAGE_SIZE)')
+        parser.add_argument('--number', type=int, default=500, help='Repeticiones por medida')
+
+    def handle(self, *args, rows, number, **options):
+        def measure(func):
+            # Mejor de 3 tandas, en microsegundos por llamada
+            return min(timeit.repeat(func, number=number, repeat=3)) / number * 1e6
+
+        self.stdout.write(f"{'serializer':<12} {'rol':<6} {'construcción':>20} {'detalle':>20} "
+                          f"{f'lista ({rows})':>22}")
+        for name, serializer_class, instance in _sample_objects():
+            for role, is_staff in (('user', False), ('admin', True)):
+                context = {'request': SimpleNamespace(user=SimpleNamespace(is_staff=is_staff))}
+                paths = [
+                    lambda: serializer_class(instance, context=context).fields,
+                    lambda: serializer_class(instance, context=context).data,
+                    lambda: serializer_class([instance] * rows, many=True, context=context).data,
+                ]
+                with override_settings(SERIALIZER_FIELD_CACHE=False):
+                    before = [measure(path) for path in paths]
+                after = [measure(path) for path in paths]
+                cells = ' '.join(
+                    f"{f'{old:.0f} -> {new:.0f} µs':>20}" for old, new in zip(before, after)
+                )
+                self.stdout.write(f"{name:<12} {role:<6} {cells}")
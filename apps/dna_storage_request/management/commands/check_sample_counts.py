@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from apps.dna_storage_request.counters import fix_sample_counts
+
+
+class Command(BaseCommand):
+    help = (
+        "Recalcula por lotes Request.tissue_count y aliquot_count a partir de "
+        "las filas reales de Tissue y DnaAliquot y corrige las desviaciones."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Requests revisados por lote (default: 1000)')
+        parser.add_argument('--dry-run', action='store_true', help='Solo informar, sin corregir')
+
+    def handle(self, *args, chunk_size, dry_run, **options):
+        def report(pk, counted, actual):
+            self.stdout.write(
+                f"Request #{pk}: tissues {counted[0]} -> {actual[0]}, "
+                f"aliquots {counted[1]} -> {actual[1]}"
+            )
+
+        checked, drifted = fix_sample_counts(chunk_size=chunk_size, dry_run=dry_run, on_drift=report)
+        action = 'detectadas' if dry_run else 'corregidas'
+        self.stdout.write(f"Requests revisados: {checked}, desviaciones {action}: {drifted}")
@@ -0,0 +1,27 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from apps.dna_storage_request.models import ChangeEvent
+
+
+class Command(BaseCommand):
+    help = "Elimina por lotes los eventos del stream SSE más antiguos que la retención."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=settings.CHANGE_EVENT_RETENTION_HOURS,
+                            help='Horas de eventos a conservar')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, hours, batch_size, **options):
+        old = ChangeEvent.objects.filter(ts__lt=timezone.now() - timedelta(hours=hours))
+        total = 0
+        while True:
+            pks = list(old.values_list('pk', flat=True)[:batch_size])
+            if not pks:
+                break
+            ChangeEvent.objects.filter(pk__in=pks).delete()
+            total += len(pks)
+        self.stdout.write(f"Eventos eliminados: {total}")
@@ -0,0 +1,17 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from apps.dna_storage_request.idempotency import purge_expired
+
+
+class Command(BaseCommand):
+    help = "Elimina por lotes las Idempotency-Keys guardadas más antiguas que su TTL."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=settings.IDEMPOTENCY_TTL_HOURS,
+                            help='Horas de claves a conservar')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, hours, batch_size, **options):
+        total = purge_expired(hours=hours, batch_size=batch_size)
+        self.stdout.write(f"Claves eliminadas: {total}")
@@ -0,0 +1,31 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from apps.dna_storage_request.reconciliation import REGISTRIES, reconcile
+
+
+class Command(BaseCommand):
+    help = (
+        "Reconcilia Tissue.is_in_jacq (jacq) o DnaAliquot.is_in_database "
+        "(dna-database) con un fichero exportado del registro externo."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('registry', choices=sorted(REGISTRIES))
+        parser.add_argument('export_file', help='CSV o texto con un código por fila')
+        parser.add_argument('--column', type=int, default=0, help='Columna con el código (default: 0)')
+        parser.add_argument('--delimiter', default=',')
+        parser.add_argument('--has-header', action='store_true', help='Ignorar la primera fila')
+        parser.add_argument('--chunk-size', type=int, default=5000,
+                            help='Filas de nuestra tabla comparadas por lote (default: 5000)')
+        parser.add_argument('--dry-run', action='store_true', help='Solo informar, sin actualizar')
+
+    def handle(self, *args, registry, export_file, column, delimiter, has_header,
+               chunk_size, dry_run, **options):
+        with open(export_file, newline='', encoding='utf-8') as lines:
+            report = reconcile(
+                registry, lines, column=column, delimiter=delimiter,
+                has_header=has_header, chunk_size=chunk_size, dry_run=dry_run,
+            )
+        self.stdout.write(json.dumps(report, indent=2))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.dna_storage_request.archive import restore
+from apps.dna_storage_request.models import ArchivedRequest
+
+
+class Command(BaseCommand):
+    help = "Devuelve a las tablas vivas requests archivados, con todas sus filas hijas."
+
+    def add_arguments(self, parser):
+        parser.add_argument('request_ids', nargs='*', type=int, help='Ids de los requests archivados')
+        parser.add_argument('--requester', type=int, help='Todos los requests archivados de este requester')
+
+    def handle(self, *args, request_ids, requester, **options):
+        if requester is not None:
+            request_ids += ArchivedRequest.objects.filter(requester_id=requester).values_list('pk', flat=True)
+        if not request_ids:
+            raise CommandError('Indica ids de requests o --requester')
+        restored = restore(request_ids)
+        missing = len(set(request_ids)) - restored
+        self.stdout.write(f"Requests restaurados: {restored}")
+        if missing:
+            self.stdout.write(f"No estaban archivados: {missing}")
@@ -0,0 +1,95 @@
+import multiprocessing
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+# Sin imports de modelos a nivel de módulo: con --processes cada proceso del pool
+# importa este módulo (para _run_in_process) antes de haber llamado a django.setup().
+
+PRUNE_INTERVAL_SECONDS = 3600
+
+
+def _setup_process():
+    import django
+    django.setup()
+
+
+def _run_in_process(job_id):
+    from apps.dna_storage_request.jobs import run_job
+    run_job(job_id)
+
+
+class Command(BaseCommand):
+    help = (
+        "Worker de la cola de jobs: reclama los jobs en cola de la base de datos "
+        "y los ejecuta en un pool de hilos (o de procesos con --processes)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=settings.JOB_WORKERS,
+                            help='Jobs ejecutados a la vez')
+        parser.add_argument('--processes', action='store_true',
+                            help='Pool de procesos en vez de hilos (jobs con mucha CPU)')
+        parser.add_argument('--poll', type=float, default=settings.JOB_POLL_SECONDS,
+                            help='Segundos entre consultas a la cola cuando está vacía')
+        parser.add_argument('--once', action='store_true',
+                            help='Terminar cuando la cola quede vacía')
+
+    def handle(self, *args, workers, processes, poll, once, **options):
+        from apps.dna_storage_request import idempotency, jobs
+
+        if processes:
+            executor = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                initializer=_setup_process,
+            )
+            run = _run_in_process
+        else:
+            executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job')
+            run = jobs.run_job
+
+        self.stdout.write(f"Worker {jobs.HOLDER}: {workers} {'procesos' if processes else 'hilos'}")
+        running = {}
+        checked_at = pruned_at = float('-inf')
+        try:
+            while True:
+                # Jobs de workers caídos: se revisan dos veces por JOB_STALE_SECONDS
+                if time.monotonic() - checked_at > settings.JOB_STALE_SECONDS / 2:
+                    requeued, failed = jobs.requeue_stale()
+                    if requeued or failed:
+                        self.stdout.write(f"Jobs sin worker: {requeued} reencolados, {failed} fallidos")
+                    checked_at = time.monotonic()
+                if time.monotonic() - pruned_at > PRUNE_INTERVAL_SECONDS:
+                    pruned = jobs.prune_finished()
+                    if pruned:
+                        self.stdout.write(f"Jobs antiguos borrados: {pruned}")
+                    purged = idempotency.purge_expired()
+                    if purged:
+                        self.stdout.write(f"Idempotency-Keys caducadas borradas: {purged}")
+                    pruned_at = time.monotonic()
+
+                for future in [future for future in running if future.done()]:
+                    job_id = running.pop(future)
+                    if future.exception() is not None:
+                        self.stderr.write(f"Job {job_id}: {future.exception()}")
+                jobs.heartbeat(list(running.values()))
+
+                while len(running) < workers:
+                    job_id = jobs.claim_next()
+                    if job_id is None:
+                        break
+                    self.stdout.write(f"Job {job_id} en ejecución")
+                    running[executor.submit(run, job_id)] = job_id
+
+                if not running:
+                    if once:
+                        break
+                    time.sleep(poll)
+                else:
+                    wait(running, timeout=poll, return_when=FIRST_COMPLETED)
+        except KeyboardInterrupt:
+            self.stdout.write("Parando: se esperan los jobs en ejecución")
+        finally:
+            executor.shutdown(wait=True)
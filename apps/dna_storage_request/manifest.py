@@ -0,0 +1,183 @@
+# manifest.py - Validación de manifests (CSV) por columnas, repartida en un pool de procesos
+import csv
+from functools import partial
+from itertools import chain
+
+from django.conf import settings
+from django.core import validators as django_validators
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import timezone
+from rest_framework import fields, validators as drf_validators
+from rest_framework.settings import api_settings
+from rest_framework.utils import humanize_datetime
+
+from .manifest_checks import validate_chunk
+from .pools import get_process_pool
+from .serializers import MetadataSerializer
+
+# El request del manifest se elige al subirlo, no va en cada fila
+SKIPPED_FIELDS = ('request',)
+
+
+class ManifestError(Exception):
+    pass
+
+
+def _validator_specs(field):
+    """(tipo, límite, mensaje) por validador del campo, en su orden"""
+    specs = []
+    for validator in field.validators:
+        if isinstance(validator, django_validators.MaxLengthValidator):
+            specs.append(('max_length', validator.limit_value, str(validator.message)))
+        elif isinstance(validator, django_validators.MinLengthValidator):
+            specs.append(('min_length', validator.limit_value, str(validator.message)))
+        elif isinstance(validator, django_validators.MaxValueValidator):
+            specs.append(('max_value', validator.limit_value, str(validator.message)))
+        elif isinstance(validator, django_validators.MinValueValidator):
+            specs.append(('min_value', validator.limit_value, str(validator.message)))
+        elif isinstance(validator, django_validators.ProhibitNullCharactersValidator):
+            specs.append(('null_characters', None, str(validator.message)))
+        elif isinstance(validator, drf_validators.ProhibitSurrogateCharactersValidator):
+            specs.append(('surrogates', None, str(validator.message)))
+        else:
+            raise ImproperlyConfigured(
+                f'{field.field_name}: validador sin equivalente en manifest_checks ({type(validator).__name__})'
+            )
+    return specs
+
+
+def _column_spec(name, field):
+    spec = {
+        'name': name,
+        'required': field.required,
+        'allow_null': field.allow_null,
+        'messages': {key: str(message) for key, message in field.error_messages.items()},
+        'validators': _validator_specs(field),
+    }
+    if isinstance(field, fields.DecimalField):
+        spec.update(kind='decimal', max_string_length=field.MAX_STRING_LENGTH, max_digits=field.max_digits,
+                    decimal_places=field.decimal_places, max_whole_digits=field.max_whole_digits,
+                    rounding=field.rounding)
+    elif isinstance(field, fields.IntegerField):
+        spec.update(kind='integer', max_string_length=field.MAX_STRING_LENGTH)
+    elif isinstance(field, fields.DateField):
+        input_formats = getattr(field, 'input_formats', api_settings.DATE_INPUT_FORMATS)
+        spec['kind'] = 'date'
+        spec['input_formats'] = list(input_formats)
+        spec['messages']['invalid'] = spec['messages']['invalid'].format(
+            format=humanize_datetime.date_formats(input_formats)
+        )
+    elif isinstance(field, fields.CharField):
+        spec.update(kind='char', allow_blank=field.allow_blank, trim_whitespace=field.trim_whitespace)
+    else:
+        raise ImproperlyConfigured(f'{name}: tipo de campo sin comprobación de manifest ({type(field).__name__})')
+    return spec
+
+
+def build_schema():
+    """
+    Esquema serializable (se envía a los procesos del pool) con los campos
+    escribibles de MetadataSerializer: tipos, límites y mensajes ya traducidos.
+    """
+    columns = [
+        _column_spec(name, field)
+        for name, field in MetadataSerializer().fields.items()
+        if not field.read_only and name not in SKIPPED_FIELDS
+    ]
+    return {'today': timezone.localdate(), 'columns': columns}
+
+
+def normalize_header(name):
+    """'Decimal Latitude' / 'decimal-latitude' -> 'decimal_latitude'"""
+    return '_'.join(name.strip().casefold().replace('-', ' ').split())
+
+
+def row_payload(header, row):
+    """
+    La fila como la enviaría la interfaz a la API: las celdas vacías o solo
+    con espacios no se envían. Es lo que compara el test de paridad.
+    """
+    return {name: cell for name, cell in zip(header, row) if name and cell.strip()}
+
+
+def _read_chunks(reader, positions, chunk_rows):
+    """Chunks columnares {'rows', 'columns'}; las filas totalmente vacías se saltan"""
+    row_number = -1
+    while True:
+        rows = []
+        columns = {name: [] for name in positions}
+        for row in reader:
+            row_number += 1
+            if row_number >= settings.MANIFEST_MAX_ROWS:
+                raise ManifestError(f'El manifest supera el máximo de {settings.MANIFEST_MAX_ROWS} filas')
+            if not any(cell.strip() for cell in row):
+                continue
+            rows.append(row_number)
+            for name, index in positions.items():
+                cell = row[index] if index < len(row) else ''
+                columns[name].append(cell if cell.strip() else None)
+            if len(rows) == chunk_rows:
+                break
+        if not rows:
+            return
+        yield {'rows': rows, 'columns': columns}
+
+
+def validate_manifest(lines, delimiter=','):
+    """
+    Validar un manifest CSV (cabecera con los nombres de campo de Metadata)
+    sin crear nada. Cada columna se comprueba de una pasada por chunk y, si
+    hay más de un chunk, los chunks se reparten en el pool de procesos.
+
+    Devuelve la matriz de errores: 'errors' son [fila, índice de columna,
+    mensajes] (fila 0 = primera fila tras la cabecera) sobre 'columns'.
+    """
+    schema = build_schema()
+    reader = csv.reader(lines, delimiter=delimiter)
+    header = [normalize_header(name) for name in next(reader, [])]
+    if not header:
+        raise ManifestError('El manifest está vacío')
+
+    columns = [spec['name'] for spec in schema['columns']]
+    positions = {}
+    ignored = []
+    for index, name in enumerate(header):
+        if name in columns and name not in positions:
+            positions[name] = index
+        elif name:
+            ignored.append(name)
+    missing = {
+        spec['name']: [spec['messages']['required']]
+        for spec in schema['columns'] if spec['required'] and spec['name'] not in positions
+    }
+
+    chunks = _read_chunks(reader, positions, settings.MANIFEST_CHUNK_ROWS)
+    first, second = next(chunks, None), next(chunks, None)
+    if second is None:
+        results = [validate_chunk(schema, first)] if first else []
+    else:
+        pool = get_process_pool('manifest', settings.MANIFEST_WORKERS)
+        results = pool.map(partial(validate_chunk, schema), chain([first, second], chunks))
+
+    column_index = {name: index for index, name in enumerate(columns)}
+    error_counts = dict.fromkeys(columns, 0)
+    errors = []
+    invalid_rows = set()
+    total = 0
+    for rows, chunk_errors in results:
+        total += rows
+        for row, name, messages in chunk_errors:
+            invalid_rows.add(row)
+            error_counts[name] += 1
+            if len(errors) < settings.MANIFEST_MAX_ERRORS:
+                errors.append([row, column_index[name], messages])
+    return {
+        'columns': columns,
+        'missing_columns': missing,
+        'ignored_columns': ignored,
+        'errors': errors,
+        'error_counts': {name: count for name, count in error_counts.items() if count},
+        'truncated': sum(error_counts.values()) > len(errors),
+        'rows': total,
+        'valid_rows': 0 if missing else total - len(invalid_rows),
+    }
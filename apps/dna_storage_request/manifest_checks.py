@@ -0,0 +1,215 @@
+# manifest_checks.py - Comprobaciones por columnas de las filas de un manifest
+#
+# Sin modelos ni settings: validate_chunk se ejecuta en el pool de procesos de manifest.py.
+# Tipos, límites y mensajes llegan en el esquema que manifest.build_schema saca de
+# MetadataSerializer, así los errores son los mismos que daría la API fila a fila.
+import re
+from datetime import datetime
+from decimal import Decimal, DecimalException, getcontext
+
+from django.utils.dateparse import parse_date
+
+LATITUDE_RANGE = (-90, 90)
+LONGITUDE_RANGE = (-180, 180)
+# Metros: por debajo de la costa del Mar Muerto / por encima del Everest
+ELEVATION_RANGE = (-500, 9000)
+PERMIT_FLAGS = (0, 1)
+
+_INFINITIES = (Decimal('Inf'), Decimal('-Inf'))
+# IntegerField.re_decimal: '12.0' se acepta como entero, '12.5' no
+_RE_DECIMAL = re.compile(r'\.0*\s*$')
+
+
+def _range_error(label, bounds, value):
+    low, high = bounds
+    if not low <= value <= high:
+        return f"{label} debe estar entre {low} y {high}."
+    return None
+
+
+def _check_latitude(value, today):
+    return _range_error('La latitud', LATITUDE_RANGE, value)
+
+
+def _check_longitude(value, today):
+    return _range_error('La longitud', LONGITUDE_RANGE, value)
+
+
+def _check_elevation(value, today):
+    return _range_error('La elevación', ELEVATION_RANGE, value)
+
+
+def _check_collection_date(value, today):
+    if value > today:
+        return "La fecha de colecta no puede ser posterior a hoy."
+    return None
+
+
+def _check_permit_flag(value, today):
+    if value not in PERMIT_FLAGS:
+        return "Debe ser 0 (no) o 1 (sí)."
+    return None
+
+
+# campo -> regla de dominio sobre el valor ya convertido (también en MetadataSerializer)
+DOMAIN_RULES = {
+    'decimal_latitude': _check_latitude,
+    'decimal_longitude': _check_longitude,
+    'elevation': _check_elevation,
+    'date_of_collection': _check_collection_date,
+    'sampling_permits_required': _check_permit_flag,
+    'nagoya_permits_required': _check_permit_flag,
+}
+
+
+def domain_error(field, value, today):
+    """Mensaje de la regla de dominio del campo, o None si el valor es válido"""
+    rule = DOMAIN_RULES.get(field)
+    if rule is None or value is None:
+        return None
+    return rule(value, today)
+
+
+def _run_validators(spec, value):
+    # Mismo orden y acumulación que Field.run_validators
+    messages = []
+    for kind, limit, message in spec['validators']:
+        if kind == 'max_length' and len(value) > limit:
+            messages.append(message)
+        elif kind == 'min_length' and len(value) < limit:
+            messages.append(message)
+        elif kind == 'max_value' and value > limit:
+            messages.append(message)
+        elif kind == 'min_value' and value < limit:
+            messages.append(message)
+        elif kind == 'null_characters' and '\x00' in value:
+            messages.append(message)
+        elif kind == 'surrogates':
+            surrogate = next((ch for ch in value if 0xD800 <= ord(ch) <= 0xDFFF), None)
+            if surrogate is not None:
+                messages.append(message.format(code_point=ord(surrogate)))
+    return messages
+
+
+def _convert_char(spec, cell):
+    if cell == '' or (spec['trim_whitespace'] and cell.strip() == ''):
+        return '', ([] if spec['allow_blank'] else [spec['messages']['blank']])
+    value = cell.strip() if spec['trim_whitespace'] else cell
+    return value, _run_validators(spec, value)
+
+
+def _convert_integer(spec, cell):
+    if len(cell) > spec['max_string_length']:
+        return None, [spec['messages']['max_string_length']]
+    try:
+        value = int(_RE_DECIMAL.sub('', cell))
+    except ValueError:
+        return None, [spec['messages']['invalid']]
+    return value, _run_validators(spec, value)
+
+
+def _convert_decimal(spec, cell):
+    messages = spec['messages']
+    data = cell.strip()
+    if data == '' and spec['allow_null']:
+        return None, []
+    if len(data) > spec['max_string_length']:
+        return None, [messages['max_string_length']]
+    try:
+        value = Decimal(data)
+    except DecimalException:
+        return None, [messages['invalid']]
+    if value.is_nan() or value in _INFINITIES:
+        return None, [messages['invalid']]
+
+    _, digits, exponent = value.as_tuple()
+    if exponent >= 0:
+        total_digits = whole_digits = len(digits) + exponent
+        decimal_places = 0
+    elif len(digits) > -exponent:
+        total_digits, decimal_places = len(digits), -exponent
+        whole_digits = total_digits - decimal_places
+    else:
+        total_digits = decimal_places = -exponent
+        whole_digits = 0
+    max_digits, places, max_whole = spec['max_digits'], spec['decimal_places'], spec['max_whole_digits']
+    if max_digits is not None and total_digits > max_digits:
+        return None, [messages['max_digits'].format(max_digits=max_digits)]
+    if places is not None and decimal_places > places:
+        return None, [messages['max_decimal_places'].format(max_decimal_places=places)]
+    if max_whole is not None and whole_digits > max_whole:
+        return None, [messages['max_whole_digits'].format(max_whole_digits=max_whole)]
+
+    if places is not None:
+        context = getcontext().copy()
+        if max_digits is not None:
+            context.prec = max_digits
+        value = value.quantize(Decimal('.1') ** places, rounding=spec['rounding'], context=context)
+    return value, _run_validators(spec, value)
+
+
+def _convert_date(spec, cell):
+    for input_format in spec['input_formats']:
+        try:
+            if input_format.lower() == 'iso-8601':
+                parsed = parse_date(cell)
+            else:
+                parsed = datetime.strptime(cell, input_format).date()
+        except (ValueError, TypeError):
+            continue
+        if parsed is not None:
+            return parsed, _run_validators(spec, parsed)
+    return None, [spec['messages']['invalid']]
+
+
+CONVERTERS = {
+    'char': _convert_char,
+    'integer': _convert_integer,
+    'decimal': _convert_decimal,
+    'date': _convert_date,
+}
+
+
+def check_column(spec, cells, today):
+    """
+    Errores de una columna entera: [(posición, [mensajes])]. Las celdas None
+    son celdas vacías (el campo no se envía): solo fallan si es obligatorio.
+    La regla de dominio se aplica, como validate_<campo>, si la conversión pasa.
+    """
+    convert = CONVERTERS[spec['kind']]
+    rule = DOMAIN_RULES.get(spec['name'])
+    required = [spec['messages']['required']] if spec['required'] else None
+    errors = []
+    for position, cell in enumerate(cells):
+        if cell is None:
+            if required:
+                errors.append((position, required))
+            continue
+        value, messages = convert(spec, cell)
+        if not messages and rule is not None and value is not None:
+            message = rule(value, today)
+            if message:
+                messages = [message]
+        if messages:
+            errors.append((position, messages))
+    return errors
+
+
+def validate_chunk(schema, chunk):
+    """
+    chunk: {'rows': [número de fila], 'columns': {campo: [celda o None]}}.
+    Devuelve (filas comprobadas, [(número de fila, campo, [mensajes])] ordenado por fila).
+    """
+    rows = chunk['rows']
+    errors = []
+    for spec in schema['columns']:
+        cells = chunk['columns'].get(spec['name'])
+        if cells is None:
+            # Columna ausente del manifest: se informa una vez en manifest.py
+            continue
+        errors.extend(
+            (rows[position], spec['name'], messages)
+            for position, messages in check_column(spec, cells, schema['today'])
+        )
+    errors.sort(key=lambda error: error[0])
+    return len(rows), errors
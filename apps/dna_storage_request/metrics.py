@@ -0,0 +1,353 @@
+# metrics.py - Métricas de las peticiones (latencia, consultas, tamaño, errores) en texto de Prometheus
+import atexit
+import fcntl
+import ipaddress
+import json
+import os
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from contextlib import ExitStack
+from functools import cache
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from rest_framework.decorators import api_view, permission_classes, renderer_classes
+from rest_framework.permissions import BasePermission
+from rest_framework.renderers import BaseRenderer
+from rest_framework.response import Response
+
+PREFIX = 'bgbm_'
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# nombre -> (tipo, ayuda, buckets). Los contadores no llevan buckets.
+METRICS = {
+    'http_requests_total': (
+        'counter', 'Peticiones por ruta, acción, método y código de estado', None,
+    ),
+    'http_request_duration_seconds': (
+        'histogram', 'Latencia de las peticiones en segundos',
+        (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+    ),
+    'http_request_queries': (
+        'histogram', 'Consultas SQL por petición', (0, 1, 2, 5, 10, 20, 50, 100, 200, 500),
+    ),
+    'http_response_size_bytes': (
+        'histogram', 'Tamaño del cuerpo de la respuesta en bytes',
+        (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304),
+    ),
+}
+
+# Fichero con lo acumulado por los workers que ya terminaron
+_DEAD = '_dead.json'
+
+
+class Registry:
+    """
+    Valores del proceso: {(métrica, etiquetas): valor}. En los histogramas el
+    valor es [cuenta por bucket..., suma, total]. Cada METRICS_FLUSH_SECONDS se
+    vuelcan a METRICS_ROOT/<pid>-<token>.json, donde /metrics suma los de
+    todos los workers.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        # También tras un fork: el hijo no hereda los valores ni el fichero del padre
+        self._pid = os.getpid()
+        self._token = uuid.uuid4().hex[:8]
+        self._values = {}
+        self._flushed_at = time.monotonic()
+
+    def _check_fork(self):
+        if self._pid != os.getpid():
+            self._reset()
+
+    def inc(self, name, labels, amount=1):
+        with self._lock:
+            self._check_fork()
+            key = (name, labels)
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def observe(self, name, labels, value):
+        buckets = METRICS[name][2]
+        with self._lock:
+            self._check_fork()
+            key = (name, labels)
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [0] * len(buckets) + [0, 0]
+            index = bisect_left(buckets, value)
+            if index < len(buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def path(self):
+        return Path(settings.METRICS_ROOT) / f'{self._pid}-{self._token}.json'
+
+    def flush(self, force=False):
+        with self._lock:
+            self._check_fork()
+            if not force and time.monotonic() - self._flushed_at < settings.METRICS_FLUSH_SECONDS:
+                return
+            self._flushed_at = time.monotonic()
+            if self._values:
+                _write_atomic(self.path(), _dump(self._values))
+
+    def clear(self):
+        with self._lock:
+            self._values = {}
+
+
+registry = Registry()
+
+
+@atexit.register
+def _flush_at_exit():
+    try:
+        registry.flush(force=True)
+    except Exception:
+        pass
+
+
+def _dump(values):
+    return [[name, [list(pair) for pair in labels], value] for (name, labels), value in values.items()]
+
+
+def _load(path):
+    try:
+        with open(path, encoding='utf-8') as fh:
+            rows = json.load(fh)
+    except (FileNotFoundError, ValueError):
+        return {}
+    return {(name, tuple(tuple(pair) for pair in labels)): value for name, labels, value in rows}
+
+
+def _write_atomic(path, data):
+    # os.replace: quien lee nunca ve un fichero a medio escribir
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f'.{path.name}.tmp')
+    with open(tmp, 'w', encoding='utf-8') as fh:
+        json.dump(data, fh)
+    os.replace(tmp, path)
+
+
+def _merge(into, values):
+    for key, value in values.items():
+        current = into.get(key)
+        if current is None:
+            into[key] = list(value) if isinstance(value, list) else value
+        elif isinstance(current, list):
+            into[key] = [a + b for a, b in zip(current, value)]
+        else:
+            into[key] = current + value
+    return into
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _worker_files(root):
+    for path in root.glob('*-*.json'):
+        try:
+            yield int(path.name.split('-', 1)[0]), path
+        except ValueError:
+            continue
+
+
+def compact(root=None):
+    """
+    Sumar a _dead.json los ficheros de los workers que ya no existen y
+    borrarlos: los contadores no bajan y el directorio no crece con cada
+    reinicio de workers.
+    """
+    root = Path(root or settings.METRICS_ROOT)
+    dead = [path for pid, path in _worker_files(root) if not _alive(pid)]
+    if not dead:
+        return 0
+    with open(root / f'{_DEAD}.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        dead = [path for path in dead if path.exists()]
+        values = _load(root / _DEAD)
+        for path in dead:
+            _merge(values, _load(path))
+        _write_atomic(root / _DEAD, _dump(values))
+        for path in dead:
+            path.unlink(missing_ok=True)
+    return len(dead)
+
+
+def collect():
+    """Valores de todos los workers (vivos y terminados) sumados"""
+    registry.flush(force=True)
+    root = Path(settings.METRICS_ROOT)
+    if not root.exists():
+        return {}
+    compact(root)
+    values = _load(root / _DEAD)
+    for _, path in _worker_files(root):
+        _merge(values, _load(path))
+    return values
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def render(values):
+    """Formato de texto de exposición de Prometheus (0.0.4)"""
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        series = sorted((labels, value) for (metric, labels), value in values.items() if metric == name)
+        full_name = PREFIX + name
+        lines.append(f'# HELP {full_name} {help_text}')
+        lines.append(f'# TYPE {full_name} {kind}')
+        for labels, value in series:
+            if kind == 'counter':
+                lines.append(f'{full_name}{_format_labels(labels)} {value!r}')
+                continue
+            cumulative = 0
+            for bound, count in zip(buckets, value):
+                cumulative += count
+                lines.append(f'{full_name}_bucket{_format_labels(labels + (("le", repr(float(bound))),))} {cumulative}')
+            lines.append(f'{full_name}_bucket{_format_labels(labels + (("le", "+Inf"),))} {value[-1]}')
+            lines.append(f'{full_name}_sum{_format_labels(labels)} {float(value[-2])!r}')
+            lines.append(f'{full_name}_count{_format_labels(labels)} {value[-1]}')
+    return '\n'.join(lines) + '\n'
+
+
+@cache
+def _router_prefixes():
+    # Import diferido: urls importa las vistas
+    from .urls import router
+
+    return {viewset: prefix for prefix, viewset, _ in router.registry}
+
+
+def route_labels(request):
+    """
+    (ruta, acción): el prefijo con que el ViewSet está registrado en el router
+    de urls.py y su acción (list, retrieve, labels...). Las demás vistas usan
+    su nombre de URL; lo que no resuelve ninguna URL va a 'unmatched', así el
+    número de series no depende de las rutas que pidan los clientes.
+    """
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched', ''
+    prefix = _router_prefixes().get(getattr(match.func, 'cls', None))
+    if prefix is None:
+        return match.view_name, ''
+    actions = getattr(match.func, 'actions', None) or {}
+    return prefix, actions.get(request.method.lower(), '')
+
+
+class QueryCounter:
+    """execute_wrapper que solo cuenta las consultas"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def record(request, response, seconds, queries=None):
+    route, action = route_labels(request)
+    method = request.method
+    registry.inc('http_requests_total', (
+        ('route', route), ('action', action), ('method', method), ('status', str(response.status_code)),
+    ))
+    labels = (('route', route), ('action', action), ('method', method))
+    registry.observe('http_request_duration_seconds', labels, seconds)
+    if queries is not None:
+        registry.observe('http_request_queries', labels[:2], queries)
+    if not response.streaming:
+        registry.observe('http_response_size_bytes', labels[:2], len(response.content))
+    registry.flush()
+
+
+class MetricsMiddleware:
+    """
+    Mide cada petición: latencia hasta que la vista devuelve la respuesta,
+    consultas SQL, tamaño del cuerpo (no en streaming) y código de estado.
+    En las vistas async (stream SSE) no se cuentan las consultas.
+    Con METRICS_ENABLED = False no se instala.
+
+    Solo síncrono: con ASGI Django lo ejecuta en el hilo de las vistas
+    síncronas, donde se cuentan sus consultas.
+    """
+    sync_capable = True
+    async_capable = False
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        counter = QueryCounter()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(counter))
+            response = self.get_response(request)
+        record(request, response, time.perf_counter() - start, counter.count)
+        return response
+
+
+class IsStaffOrLocalhost(BasePermission):
+    """
+    Staff, o una petición directa desde la propia máquina. Detrás de un proxy
+    local todas las peticiones llegan desde 127.0.0.1: si traen
+    X-Forwarded-For no cuentan como locales.
+    """
+
+    def has_permission(self, request, view):
+        if request.user and request.user.is_staff:
+            return True
+        if not settings.METRICS_ALLOW_LOCALHOST or 'HTTP_X_FORWARDED_FOR' in request.META:
+            return False
+        try:
+            return ipaddress.ip_address(request.META.get('REMOTE_ADDR', '')).is_loopback
+        except ValueError:
+            return False
+
+
+class PrometheusRenderer(BaseRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # Los errores (401/403) llegan como dict
+        if not isinstance(data, str):
+            data = json.dumps(data)
+        return data.encode(self.charset)
+
+
+@api_view(['GET'])
+@permission_classes([IsStaffOrLocalhost])
+@renderer_classes([PrometheusRenderer])
+def metrics_view(request):
+    """Métricas de todos los workers para Prometheus"""
+    return Response(render(collect()), content_type=CONTENT_TYPE)
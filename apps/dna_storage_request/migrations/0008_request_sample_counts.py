@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:43
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def fill_sample_counts(apps, schema_editor):
+    # Inicializar los contadores por lotes con consultas agrupadas
+    Request = apps.get_model('dna_storage_request', 'Request')
+    Tissue = apps.get_model('dna_storage_request', 'Tissue')
+    DnaAliquot = apps.get_model('dna_storage_request', 'DnaAliquot')
+    for model, field in ((Tissue, 'tissue_count'), (DnaAliquot, 'aliquot_count')):
+        counts = (
+            model.objects.values('request_id').annotate(n=Count('pk'))
+            .order_by('request_id').values_list('request_id', 'n')
+        )
+        for request_id, n in counts.iterator(chunk_size=1000):
+            Request.objects.filter(pk=request_id).update(**{field: n})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dna_storage_request', '0007_upload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='request',
+            name='aliquot_count',
+            field=models.IntegerField(db_index=True, default=0),
+        ),
+        migrations.AddField(
+            model_name='request',
+            name='tissue_count',
+            field=models.IntegerField(db_index=True, default=0),
+        ),
+        migrations.RunPython(fill_sample_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:44
+
+import django.core.serializers.json
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dna_storage_request', '0008_request_sample_counts'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuditLog',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=20)),
+                ('object_id', models.BigIntegerField()),
+                ('action', models.CharField(choices=[('c', 'Create'), ('u', 'Update'), ('d', 'Delete')], max_length=1)),
+                ('ts', models.DateTimeField()),
+                ('changes', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder, help_text='{campo: [antes, después]}')),
+                ('user', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'Audit_log',
+                'managed': True,
+                'indexes': [models.Index(fields=['model', 'object_id', 'ts'], name='audit_log_object_ts_idx')],
+            },
+        ),
+    ]
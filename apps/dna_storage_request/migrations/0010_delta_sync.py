@@ -0,0 +1,62 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:45
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dna_storage_request', '0009_audit_log'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=20)),
+                ('object_id', models.BigIntegerField()),
+                ('deleted_at', models.DateTimeField()),
+            ],
+            options={
+                'db_table': 'Tombstone',
+                'managed': True,
+            },
+        ),
+        migrations.AddIndex(
+            model_name='dnaaliquot',
+            index=models.Index(fields=['updated_at', 'id'], name='dna_aliquot_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='metadata',
+            index=models.Index(fields=['updated_at', 'id'], name='metadata_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='request',
+            index=models.Index(fields=['updated_at', 'id'], name='request_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='requester',
+            index=models.Index(fields=['updated_at', 'id'], name='requester_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='shipment',
+            index=models.Index(fields=['updated_at', 'id'], name='shipment_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tissue',
+            index=models.Index(fields=['updated_at', 'id'], name='tissue_updated_idx'),
+        ),
+        migrations.AddField(
+            model_name='tombstone',
+            name='owner',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='tombstone',
+            index=models.Index(fields=['model', 'deleted_at', 'id'], name='tombstone_model_deleted_idx'),
+        ),
+    ]
@@ -0,0 +1,103 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+NAME_FIELDS = ('taxon_group', 'family', 'genus', 'scientific_name', 'interspecific_epithet')
+BATCH_SIZE = 5000
+
+
+def link_taxa(apps, schema_editor):
+    """
+    Crear un Taxon por combinación distinta de nombres y enlazar Metadata,
+    por lotes de clave primaria. get_or_create deja la comparación a la base de
+    datos, así que respeta la colación de la columna (MySQL no distingue mayúsculas).
+    """
+    Metadata = apps.get_model('dna_storage_request', 'Metadata')
+    Taxon = apps.get_model('dna_storage_request', 'Taxon')
+    taxa = {}
+    last_pk = 0
+    while True:
+        chunk = list(
+            Metadata.objects.filter(pk__gt=last_pk).order_by('pk')
+            .values_list('pk', *NAME_FIELDS)[:BATCH_SIZE]
+        )
+        if not chunk:
+            break
+        last_pk = chunk[-1][0]
+
+        pks_by_taxon = {}
+        for pk, *names in chunk:
+            names = tuple(names)
+            if names not in taxa:
+                taxa[names] = Taxon.objects.get_or_create(**dict(zip(NAME_FIELDS, names)))[0].pk
+            pks_by_taxon.setdefault(taxa[names], []).append(pk)
+        for taxon_id, pks in pks_by_taxon.items():
+            Metadata.objects.filter(pk__in=pks).update(taxon_id=taxon_id)
+
+
+def unlink_taxa(apps, schema_editor):
+    Metadata = apps.get_model('dna_storage_request', 'Metadata')
+    Taxon = apps.get_model('dna_storage_request', 'Taxon')
+    for taxon in Taxon.objects.order_by('pk').iterator(chunk_size=1000):
+        Metadata.objects.filter(taxon_id=taxon.pk).update(
+            **{field: getattr(taxon, field) for field in NAME_FIELDS}
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dna_storage_request', '0011_change_event'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Taxon',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('taxon_group', models.CharField(db_index=True, max_length=12)),
+                ('family', models.CharField(db_index=True, max_length=50)),
+                ('genus', models.CharField(db_index=True, max_length=45)),
+                ('scientific_name', models.CharField(db_index=True, max_length=100)),
+                ('interspecific_epithet', models.CharField(max_length=50)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'Taxonomy',
+                'managed': True,
+                'constraints': [models.UniqueConstraint(fields=('taxon_group', 'family', 'genus', 'scientific_name', 'interspecific_epithet'), name='taxonomy_names_uniq')],
+            },
+        ),
+        migrations.AddField(
+            model_name='metadata',
+            name='taxon',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='metadata', to='dna_storage_request.taxon'),
+        ),
+        migrations.RunPython(link_taxa, unlink_taxa),
+        migrations.AlterField(
+            model_name='metadata',
+            name='taxon',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='metadata', to='dna_storage_request.taxon'),
+        ),
+        migrations.RemoveField(
+            model_name='metadata',
+            name='taxon_group',
+        ),
+        migrations.RemoveField(
+            model_name='metadata',
+            name='family',
+        ),
+        migrations.RemoveField(
+            model_name='metadata',
+            name='genus',
+        ),
+        migrations.RemoveField(
+            model_name='metadata',
+            name='scientific_name',
+        ),
+        migrations.RemoveField(
+            model_name='metadata',
+            name='interspecific_epithet',
+        ),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:20
+
+import hashlib
+import re
+from decimal import Decimal, InvalidOperation
+
+from django.db import migrations, models
+
+BATCH_SIZE = 2000
+# Copia de duplicates.duplicate_key al escribir la migración
+_IGNORED_CHARACTERS = re.compile(r'[\s\-_./:#]+')
+
+
+def _coordinate(value):
+    try:
+        return str(Decimal(str(value)).quantize(Decimal('0.0001')))
+    except (InvalidOperation, ValueError):
+        return ''
+
+
+def _key(identifier, latitude, longitude, date):
+    identifier = _IGNORED_CHARACTERS.sub('', str(identifier or '').casefold())
+    if not identifier:
+        return ''
+    date = date.isoformat() if date else ''
+    raw = '|'.join((identifier, _coordinate(latitude), _coordinate(longitude), date))
+    return hashlib.blake2b(raw.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def fill_duplicate_keys(apps, schema_editor):
+    Metadata = apps.get_model('dna_storage_request', 'Metadata')
+    fields = ('original_sample_id', 'collector_sample_id', 'decimal_latitude',
+              'decimal_longitude', 'date_of_collection')
+    last_pk = 0
+    while True:
+        chunk = list(Metadata.objects.filter(pk__gt=last_pk).order_by('pk').only('pk', *fields)[:BATCH_SIZE])
+        if not chunk:
+            break
+        last_pk = chunk[-1].pk
+        for row in chunk:
+            row.sample_key = _key(row.original_sample_id, row.decimal_latitude,
+                                  row.decimal_longitude, row.date_of_collection)
+            row.collector_key = _key(row.collector_sample_id, row.decimal_latitude,
+                                     row.decimal_longitude, row.date_of_collection)
+        Metadata.objects.bulk_update(chunk, ['sample_key', 'collector_key'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dna_storage_request', '0012_taxonomy'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='metadata',
+            name='collector_key',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=32),
+        ),
+        migrations.AddField(
+            model_name='metadata',
+            name='sample_key',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=32),
+        ),
+        migrations.RunPython(fill_duplicate_keys, migrations.RunPython.noop),
+    ]
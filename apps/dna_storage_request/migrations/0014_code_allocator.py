@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dna_storage_request', '0013_metadata_duplicate_keys'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CodeSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=45, unique=True)),
+                ('next_value', models.BigIntegerField(default=1)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'Code_sequence',
+                'managed': True,
+            },
+        ),
+        migrations.CreateModel(
+            name='CodeBlock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start', models.BigIntegerField()),
+                ('end', models.BigIntegerField()),
+                ('used_up_to', models.BigIntegerField(blank=True, null=True)),
+                ('holder', models.CharField(max_length=100)),
+                ('reserved_at', models.DateTimeField(auto_now_add=True)),
+                ('released_at', models.DateTimeField(blank=True, null=True)),
+                ('sequence', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='blocks', to='dna_storage_request.codesequence')),
+            ],
+            options={
+                'db_table': 'Code_block',
+                'managed': True,
+                'indexes': [models.Index(fields=['sequence', 'start'], name='code_block_sequence_idx')],
+            },
+        ),
+    ]
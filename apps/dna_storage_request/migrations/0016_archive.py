@@ -0,0 +1,149 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:20
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dna_storage_request', '0015_job'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedRequest',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('request_date', models.DateField()),
+                ('tissue_sample_quantity', models.IntegerField(blank=True, null=True)),
+                ('aliquot_sample_quantity', models.IntegerField(blank=True, null=True)),
+                ('tissue_count', models.IntegerField(db_index=True, default=0)),
+                ('aliquot_count', models.IntegerField(db_index=True, default=0)),
+                ('has_manifest_file', models.IntegerField(blank=True, null=True)),
+                ('manifest_storage_path', models.CharField(blank=True, max_length=400, null=True)),
+                ('b_mta_sent_date', models.DateField(blank=True, null=True)),
+                ('mta_signed_date', models.DateField(blank=True, null=True)),
+                ('mta_storage_path', models.CharField(blank=True, max_length=200, null=True)),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('requester', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='dna_storage_request.requester')),
+            ],
+            options={
+                'db_table': 'Archive_request',
+                'managed': True,
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedMetadata',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('original_sample_id', models.CharField(max_length=100)),
+                ('collector_sample_id', models.CharField(max_length=100)),
+                ('collected_by', models.CharField(max_length=50)),
+                ('collector_affiliation', models.CharField(max_length=50)),
+                ('date_of_collection', models.DateField()),
+                ('collection_location', models.CharField(max_length=100)),
+                ('decimal_latitude', models.DecimalField(decimal_places=8, max_digits=10)),
+                ('decimal_longitude', models.DecimalField(decimal_places=8, max_digits=11)),
+                ('habitat', models.TextField()),
+                ('elevation', models.IntegerField()),
+                ('identified_by', models.CharField(max_length=50)),
+                ('voucher_id', models.CharField(max_length=50)),
+                ('voucher_link', models.TextField(blank=True, null=True)),
+                ('voucher_institution', models.CharField(max_length=100)),
+                ('sampling_permits_required', models.IntegerField(blank=True, null=True)),
+                ('sampling_permits_filename', models.CharField(blank=True, max_length=100, null=True)),
+                ('nagoya_permits_required', models.IntegerField(blank=True, null=True)),
+                ('nagoya_permits_filename', models.CharField(blank=True, max_length=100, null=True)),
+                ('sample_key', models.CharField(blank=True, db_index=True, default='', editable=False, max_length=32)),
+                ('collector_key', models.CharField(blank=True, db_index=True, default='', editable=False, max_length=32)),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('taxon', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='+', to='dna_storage_request.taxon')),
+                ('request', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='dna_storage_request.archivedrequest')),
+            ],
+            options={
+                'db_table': 'Archive_metadata',
+                'managed': True,
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedShipment',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('shipment_date', models.DateField(blank=True, null=True)),
+                ('accession_date', models.DateField(blank=True, null=True)),
+                ('is_collection_b_labeled', models.IntegerField(blank=True, null=True)),
+                ('tracking_number', models.CharField(blank=True, max_length=45, null=True)),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('request', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='dna_storage_request.archivedrequest')),
+            ],
+            options={
+                'db_table': 'Archive_shipment',
+                'managed': True,
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedDnaAliquot',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('dna_aliquot_qr_code', models.CharField(max_length=15, unique=True)),
+                ('is_in_database', models.IntegerField(blank=True, null=True)),
+                ('dna_aliquot_storage_location', models.CharField(blank=True, max_length=45, null=True)),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('metadata', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='dna_storage_request.archivedmetadata')),
+                ('request', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='dna_storage_request.archivedrequest')),
+                ('shipment', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='dna_storage_request.archivedshipment')),
+            ],
+            options={
+                'db_table': 'Archive_DNA_aliquot',
+                'managed': True,
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedTissue',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('tissue_barcode', models.CharField(blank=True, max_length=15, null=True, unique=True)),
+                ('is_in_jacq', models.IntegerField(blank=True, null=True)),
+                ('tissue_sample_storage_location', models.CharField(blank=True, max_length=45, null=True)),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('metadata', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='dna_storage_request.archivedmetadata')),
+                ('request', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='dna_storage_request.archivedrequest')),
+                ('shipment', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='dna_storage_request.archivedshipment')),
+            ],
+            options={
+                'db_table': 'Archive_tissue',
+                'managed': True,
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedUpload',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('target', models.CharField(choices=[('manifest', 'Manifest'), ('mta', 'MTA'), ('sampling_permits', 'Sampling permits'), ('nagoya_permits', 'Nagoya permits')], max_length=20)),
+                ('filename', models.CharField(max_length=255)),
+                ('size', models.PositiveBigIntegerField()),
+                ('checksum', models.CharField(help_text='SHA-256 (hex) del fichero completo', max_length=64)),
+                ('offset', models.PositiveBigIntegerField(default=0)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('complete', 'Complete'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('storage_path', models.CharField(blank=True, max_length=400, null=True)),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('metadata', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='dna_storage_request.archivedmetadata')),
+                ('request', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='dna_storage_request.archivedrequest')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'Archive_upload',
+                'managed': True,
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:45
+
+import django.core.serializers.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dna_storage_request', '0018_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tombstone',
+            name='fields',
+            field=models.JSONField(blank=True, encoder=django.core.serializers.json.DjangoJSONEncoder, null=True),
+        ),
+    ]
@@ -1,12 +1,16 @@
 # models.py - Actualizado con shipment opcional
 from django.db import models
 from django.contrib.auth.models import User
+from django.core.serializers.json import DjangoJSONEncoder
 from django.core.validators import EmailValidator
-from django.core.exceptions import ValidationError
+import uuid
 
 class Requester(models.Model):
-    # Relación 1:1 con User - un usuario puede tener solo un requester
+    # Relación 1:1 con User - un usuario puede tener solo un requester.
+    # La unicidad la garantiza el índice UNIQUE de user_id (ver RequesterViewSet.perform_create)
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='requester_profile')
+    # Nombre de ese índice en MySQL/MariaDB (el de la columna)
+    USER_UNIQUE_INDEX = 'user_id'
     
     first_name = models.CharField(max_length=100, help_text="Nombre del requester")
     last_name = models.CharField(max_length=100, help_text="Apellido del requester")
@@ -29,23 +33,10 @@ class Requester(models.Model):
     class Meta:
         managed = True
         db_table = 'Requester'
-        
-    def clean(self):
-        """Validación personalizada"""
-        super().clean()
-        
-        # Validar que el usuario no tenga ya otro requester
-        if self.user_id:
-            existing = Requester.objects.filter(user=self.user).exclude(pk=self.pk)
-            if existing.exists():
-                raise ValidationError(
-                    "Este usuario ya tiene un perfil de requester creado."
-                )
-    
-    def save(self, *args, **kwargs):
-        """Override save para ejecutar validaciones"""
-        self.clean()
-        super().save(*args, **kwargs)
+        # Sincronización incremental (?updated_since=), orden estable por (updated_at, id)
+        indexes = [
+            models.Index(fields=['updated_at', 'id'], name='requester_updated_idx'),
+        ]
         
     def __str__(self):
         return f"{self.first_name} {self.last_name} ({self.user.username})"
@@ -55,6 +46,9 @@ class Request(models.Model):
     request_date = models.DateField()
     tissue_sample_quantity = models.IntegerField(blank=True, null=True)
     aliquot_sample_quantity = models.IntegerField(blank=True, null=True)
+    # Conteos reales de Tissue/DnaAliquot, mantenidos con F() (ver counters.py)
+    tissue_count = models.IntegerField(default=0, db_index=True)
+    aliquot_count = models.IntegerField(default=0, db_index=True)
     has_manifest_file = models.IntegerField(blank=True, null=True)
     manifest_storage_path = models.CharField(max_length=400, blank=True, null=True)
     b_mta_sent_date = models.DateField(blank=True, null=True)
@@ -67,18 +61,42 @@ class Request(models.Model):
         managed = True
         db_table = 'Request'
         db_table_comment = '\t'
+        indexes = [
+            models.Index(fields=['updated_at', 'id'], name='request_updated_idx'),
+        ]
 
     def __str__(self):
         return f"Request #{self.id} - {self.requester}"
 
+class Taxon(models.Model):
+    # Taxonomía normalizada: cada combinación de nombres se guarda una vez y
+    # Metadata la referencia por id
+    NAME_FIELDS = ('taxon_group', 'family', 'genus', 'scientific_name', 'interspecific_epithet')
+
+    taxon_group = models.CharField(max_length=12, db_index=True)
+    family = models.CharField(max_length=50, db_index=True)
+    genus = models.CharField(max_length=45, db_index=True)
+    scientific_name = models.CharField(max_length=100, db_index=True)
+    interspecific_epithet = models.CharField(max_length=50)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        managed = True
+        db_table = 'Taxonomy'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['taxon_group', 'family', 'genus', 'scientific_name', 'interspecific_epithet'],
+                name='taxonomy_names_uniq',
+            ),
+        ]
+
+    def __str__(self):
+        return self.scientific_name
+
 class Metadata(models.Model):
     request = models.ForeignKey('Request', models.DO_NOTHING)
     original_sample_id = models.CharField(max_length=100)
-    taxon_group = models.CharField(max_length=12)
-    family = models.CharField(max_length=50)
-    genus = models.CharField(max_length=45)
-    scientific_name = models.CharField(max_length=100)
-    interspecific_epithet = models.CharField(max_length=50)
+    taxon = models.ForeignKey(Taxon, models.PROTECT, related_name='metadata')
     collector_sample_id = models.CharField(max_length=100)
     collected_by = models.CharField(max_length=50)
     collector_affiliation = models.CharField(max_length=50)
@@ -96,16 +114,29 @@ class Metadata(models.Model):
     sampling_permits_filename = models.CharField(max_length=100, blank=True, null=True)
     nagoya_permits_required = models.IntegerField(blank=True, null=True)
     nagoya_permits_filename = models.CharField(max_length=100, blank=True, null=True)
+    # Hash de identificador normalizado + coordenadas + fecha (ver duplicates.py)
+    sample_key = models.CharField(max_length=32, blank=True, default='', editable=False, db_index=True)
+    collector_key = models.CharField(max_length=32, blank=True, default='', editable=False, db_index=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         managed = True
         db_table = 'Metadata'
+        indexes = [
+            models.Index(fields=['updated_at', 'id'], name='metadata_updated_idx'),
+        ]
 
     def __str__(self):
         return f"{self.scientific_name} - {self.original_sample_id}"
 
+    # Nombres del taxón con el acceso de antes (metadata.scientific_name)
+    taxon_group = property(lambda self: self.taxon.taxon_group)
+    family = property(lambda self: self.taxon.family)
+    genus = property(lambda self: self.taxon.genus)
+    scientific_name = property(lambda self: self.taxon.scientific_name)
+    interspecific_epithet = property(lambda self: self.taxon.interspecific_epithet)
+
 class Shipment(models.Model):
     request = models.ForeignKey(Request, models.DO_NOTHING)
     shipment_date = models.DateField(blank=True, null=True)
@@ -118,6 +149,9 @@ class Shipment(models.Model):
     class Meta:
         managed = True
         db_table = 'Shipment'
+        indexes = [
+            models.Index(fields=['updated_at', 'id'], name='shipment_updated_idx'),
+        ]
 
     def __str__(self):
         return f"Shipment #{self.id} - Request {self.request.id}"
@@ -136,6 +170,9 @@ class Tissue(models.Model):
     class Meta:
         managed = True
         db_table = 'Tissue'
+        indexes = [
+            models.Index(fields=['updated_at', 'id'], name='tissue_updated_idx'),
+        ]
 
     def __str__(self):
         return f"Tissue {self.tissue_barcode or f'#{self.id}'}"
@@ -153,6 +190,349 @@ class DnaAliquot(models.Model):
     class Meta:
         managed = True
         db_table = 'DNA_aliquot'
+        indexes = [
+            models.Index(fields=['updated_at', 'id'], name='dna_aliquot_updated_idx'),
+        ]
+
+    def __str__(self):
+        return f"DNA Aliquot {self.dna_aliquot_qr_code}"
+
+class Upload(models.Model):
+    """
+    Subida por partes (reanudable) de un fichero asociado a un Request o a un
+    Metadata. Al completarse se rellena el campo de ruta correspondiente.
+    """
+    TARGET_MANIFEST = 'manifest'
+    TARGET_MTA = 'mta'
+    TARGET_SAMPLING_PERMITS = 'sampling_permits'
+    TARGET_NAGOYA_PERMITS = 'nagoya_permits'
+    TARGET_CHOICES = [
+        (TARGET_MANIFEST, 'Manifest'),
+        (TARGET_MTA, 'MTA'),
+        (TARGET_SAMPLING_PERMITS, 'Sampling permits'),
+        (TARGET_NAGOYA_PERMITS, 'Nagoya permits'),
+    ]
+    # target -> (modelo destino, campo donde se guarda la ruta)
+    TARGET_FIELDS = {
+        TARGET_MANIFEST: ('request', 'manifest_storage_path'),
+        TARGET_MTA: ('request', 'mta_storage_path'),
+        TARGET_SAMPLING_PERMITS: ('metadata', 'sampling_permits_filename'),
+        TARGET_NAGOYA_PERMITS: ('metadata', 'nagoya_permits_filename'),
+    }
+
+    STATUS_PENDING = 'pending'
+    STATUS_COMPLETE = 'complete'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_COMPLETE, 'Complete'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='uploads')
+    request = models.ForeignKey(Request, models.DO_NOTHING)
+    metadata = models.ForeignKey(Metadata, models.DO_NOTHING, null=True, blank=True)  # Solo para permisos
+    target = models.CharField(max_length=20, choices=TARGET_CHOICES)
+    filename = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()
+    checksum = models.CharField(max_length=64, help_text="SHA-256 (hex) del fichero completo")
+    offset = models.PositiveBigIntegerField(default=0)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    storage_path = models.CharField(max_length=400, blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        managed = True
+        db_table = 'Upload'
+
+    def __str__(self):
+        return f"Upload {self.filename} ({self.offset}/{self.size})"
+
+
+class AuditLog(models.Model):
+    """
+    Registro de cambios por campo (solo inserciones). Se escribe por lotes
+    con bulk_create al confirmar la transacción (ver audit.py).
+    """
+    ACTION_CREATE = 'c'
+    ACTION_UPDATE = 'u'
+    ACTION_DELETE = 'd'
+    ACTION_CHOICES = [
+        (ACTION_CREATE, 'Create'),
+        (ACTION_UPDATE, 'Update'),
+        (ACTION_DELETE, 'Delete'),
+    ]
+
+    model = models.CharField(max_length=20)  # _meta.model_name
+    object_id = models.BigIntegerField()
+    action = models.CharField(max_length=1, choices=ACTION_CHOICES)
+    # Sin FK real: el historial se conserva aunque se borre el usuario
+    user = models.ForeignKey(User, models.DO_NOTHING, null=True, blank=True,
+                             db_constraint=False, related_name='+')
+    ts = models.DateTimeField()
+    changes = models.JSONField(encoder=DjangoJSONEncoder, help_text="{campo: [antes, después]}")
+
+    class Meta:
+        managed = True
+        db_table = 'Audit_log'
+        indexes = [
+            models.Index(fields=['model', 'object_id', 'ts'], name='audit_log_object_ts_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.model} #{self.object_id} {self.action} @ {self.ts:%Y-%m-%d %H:%M:%S}"
+
+
+class Tombstone(models.Model):
+    """
+    Marca de borrado para la sincronización incremental: los clientes que
+    mantienen una copia local eliminan estos ids.
+    """
+    model = models.CharField(max_length=20)  # _meta.model_name
+    object_id = models.BigIntegerField()
+    # Usuario dueño del objeto borrado (para filtrar por alcance)
+    owner = models.ForeignKey(User, models.DO_NOTHING, null=True, blank=True,
+                              db_constraint=False, related_name='+')
+    deleted_at = models.DateTimeField()
+    # Campos del objeto al borrarse, para aplicar los filtros del viewset
+    fields = models.JSONField(encoder=DjangoJSONEncoder, null=True, blank=True)
+
+    class Meta:
+        managed = True
+        db_table = 'Tombstone'
+        indexes = [
+            models.Index(fields=['model', 'deleted_at', 'id'], name='tombstone_model_deleted_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.model} #{self.object_id} borrado {self.deleted_at:%Y-%m-%d %H:%M}"
+
+
+class ChangeEvent(models.Model):
+    """
+    Registro local de cambios que alimenta el stream SSE. Cada worker lo lee
+    por id creciente, así los eventos llegan a todos los procesos sin broker.
+    """
+    model = models.CharField(max_length=20)  # _meta.model_name
+    object_id = models.BigIntegerField()
+    action = models.CharField(max_length=1, choices=AuditLog.ACTION_CHOICES)
+    owner = models.ForeignKey(User, models.DO_NOTHING, null=True, blank=True,
+                              db_constraint=False, related_name='+')
+    payload = models.JSONField(encoder=DjangoJSONEncoder, default=dict)
+    ts = models.DateTimeField(db_index=True)
+
+    class Meta:
+        managed = True
+        db_table = 'Change_event'
 
     def __str__(self):
-        return f"DNA Aliquot {self.dna_aliquot_qr_code}"
\ No newline at end of file
+        return f"{self.model} #{self.object_id} {self.action} @ {self.ts:%Y-%m-%d %H:%M:%S}"
+
+
+class CodeSequence(models.Model):
+    """
+    Contador de códigos asignados por el servidor para un campo
+    (dna_aliquot_qr_code, tissue_barcode). Los workers reservan bloques de él.
+    """
+    name = models.CharField(max_length=45, unique=True)
+    next_value = models.BigIntegerField(default=1)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        managed = True
+        db_table = 'Code_sequence'
+
+    def __str__(self):
+        return f"{self.name} (siguiente {self.next_value})"
+
+
+class CodeBlock(models.Model):
+    """
+    Rango [start, end) reservado por un worker. Al liberarlo se anota hasta
+    dónde se usó: [used_up_to, end) son códigos que nunca se asignaron.
+    """
+    sequence = models.ForeignKey(CodeSequence, models.CASCADE, related_name='blocks')
+    start = models.BigIntegerField()
+    end = models.BigIntegerField()
+    used_up_to = models.BigIntegerField(null=True, blank=True)  # null: el worker lo sigue usando
+    holder = models.CharField(max_length=100)  # host:pid
+    reserved_at = models.DateTimeField(auto_now_add=True)
+    released_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        managed = True
+        db_table = 'Code_block'
+        indexes = [
+            models.Index(fields=['sequence', 'start'], name='code_block_sequence_idx'),
+        ]
+
+    @property
+    def unused(self):
+        if self.used_up_to is None:
+            return None
+        return self.end - self.used_up_to
+
+    def __str__(self):
+        return f"{self.sequence.name} [{self.start}, {self.end})"
+
+
+class Job(models.Model):
+    """
+    Trabajo largo (exports, reconciliaciones, recálculos) encolado en la base
+    de datos y ejecutado por el comando run_jobs, fuera de la petición HTTP.
+    El resultado, si es un fichero, se guarda en JOB_ROOT.
+    """
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_SUCCEEDED = 'succeeded'
+    STATUS_FAILED = 'failed'
+    STATUS_CANCELLED = 'cancelled'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_SUCCEEDED, 'Succeeded'),
+        (STATUS_FAILED, 'Failed'),
+        (STATUS_CANCELLED, 'Cancelled'),
+    ]
+    FINISHED_STATUSES = (STATUS_SUCCEEDED, STATUS_FAILED, STATUS_CANCELLED)
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='jobs')
+    kind = models.CharField(max_length=50)  # clave de jobs.JOB_KINDS
+    params = models.JSONField(encoder=DjangoJSONEncoder, default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    progress = models.PositiveBigIntegerField(default=0)
+    total = models.PositiveBigIntegerField(null=True, blank=True)
+    message = models.CharField(max_length=255, blank=True, default='')
+    result = models.JSONField(encoder=DjangoJSONEncoder, null=True, blank=True)  # resumen
+    result_filename = models.CharField(max_length=255, blank=True, null=True)
+    error = models.TextField(blank=True, default='')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    worker = models.CharField(max_length=100, blank=True, default='')  # host:pid
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        managed = True
+        db_table = 'Job'
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='job_status_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"Job {self.kind} ({self.status})"
+
+
+class RequestProfile(models.Model):
+    """
+    Perfil de una petición capturado por ProfilerMiddleware (ver profiling.py):
+    tiempos y resumen aquí, el volcado de cProfile (.prof) en PROFILE_ROOT.
+    """
+    TRIGGER_REQUESTED = 'requested'
+    TRIGGER_SAMPLED = 'sampled'
+    TRIGGER_CHOICES = [
+        (TRIGGER_REQUESTED, 'Requested'),
+        (TRIGGER_SAMPLED, 'Sampled'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    method = models.CharField(max_length=10)
+    path = models.CharField(max_length=500)
+    query_string = models.TextField(blank=True, default='')
+    status_code = models.PositiveSmallIntegerField()
+    # Sin FK real: el perfil se conserva aunque se borre el usuario
+    user = models.ForeignKey(User, models.DO_NOTHING, null=True, blank=True,
+                             db_constraint=False, related_name='+')
+    trigger = models.CharField(max_length=10, choices=TRIGGER_CHOICES)
+    duration_ms = models.FloatField()
+    sql_count = models.PositiveIntegerField()
+    sql_ms = models.FloatField()
+    serializer_ms = models.FloatField()
+    slow_queries = models.JSONField(default=list, help_text="[[ms, sql], ...] de las consultas más lentas")
+    summary = models.TextField(help_text="Funciones con más tiempo acumulado")
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        managed = True
+        db_table = 'Request_profile'
+
+    def __str__(self):
+        return f"{self.method} {self.path} ({self.duration_ms:.0f} ms)"
+
+
+class IdempotencyKey(models.Model):
+    """
+    POST/PATCH con cabecera Idempotency-Key (ver idempotency.py): la primera
+    petición reserva la clave del usuario y al terminar guarda su respuesta,
+    que se repite a las demás con la misma clave hasta IDEMPOTENCY_TTL_HOURS.
+    Sin status_code, la primera sigue en curso.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    key = models.CharField(max_length=255)
+    method = models.CharField(max_length=10)
+    path = models.CharField(max_length=500)
+    fingerprint = models.CharField(max_length=64, help_text="sha256 de método, ruta y cuerpo")
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_headers = models.JSONField(default=dict, blank=True)
+    response_body = models.BinaryField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        managed = True
+        db_table = 'Idempotency_key'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='idempotency_user_key_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.method} {self.path} ({self.key})"
+
+
+# Archivo de requests cerrados (ver archive.py): tablas con las mismas columnas
+# que las vivas, para mover filas con INSERT ... SELECT y devolverlas igual.
+
+def _archive_model(model, name, db_table, **related):
+    """
+    Copia de `model` para su tabla de archivo. Los ids se conservan (sin
+    autoincremento), las fechas no se recalculan (sin auto_now) y las FKs de
+    `related` apuntan a las otras tablas de archivo. Sin accesores inversos
+    para no mezclar filas archivadas con las vivas.
+    """
+    attrs = {'__module__': __name__, '__qualname__': name}
+    for field in model._meta.concrete_fields:
+        if field.primary_key and isinstance(field, models.AutoField):
+            attrs[field.name] = models.BigIntegerField(primary_key=True)
+        elif field.is_relation:
+            attrs[field.name] = models.ForeignKey(
+                related.get(field.name, field.remote_field.model), field.remote_field.on_delete,
+                null=field.null, blank=field.blank, related_name='+',
+            )
+        else:
+            _, _, args, kwargs = field.deconstruct()
+            kwargs.pop('auto_now', None)
+            kwargs.pop('auto_now_add', None)
+            attrs[field.name] = type(field)(*args, **kwargs)
+    attrs['Meta'] = type('Meta', (), {'managed': True, 'db_table': db_table})
+    attrs['__str__'] = lambda self: f"{model.__name__} #{self.pk} (archivado)"
+    return type(name, (models.Model,), attrs)
+
+
+ArchivedRequest = _archive_model(Request, 'ArchivedRequest', 'Archive_request')
+ArchivedMetadata = _archive_model(Metadata, 'ArchivedMetadata', 'Archive_metadata', request=ArchivedRequest)
+ArchivedShipment = _archive_model(Shipment, 'ArchivedShipment', 'Archive_shipment', request=ArchivedRequest)
+ArchivedTissue = _archive_model(
+    Tissue, 'ArchivedTissue', 'Archive_tissue',
+    request=ArchivedRequest, shipment=ArchivedShipment, metadata=ArchivedMetadata,
+)
+ArchivedDnaAliquot = _archive_model(
+    DnaAliquot, 'ArchivedDnaAliquot', 'Archive_DNA_aliquot',
+    request=ArchivedRequest, shipment=ArchivedShipment, metadata=ArchivedMetadata,
+)
+ArchivedUpload = _archive_model(
+    Upload, 'ArchivedUpload', 'Archive_upload', request=ArchivedRequest, metadata=ArchivedMetadata,
+)
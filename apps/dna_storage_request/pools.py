@@ -0,0 +1,23 @@
+# pools.py - Pools de procesos del proceso web (render de etiquetas, validación de manifests)
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_process_pool(name, max_workers):
+    """
+    Pool con nombre, creado al primer uso y reutilizado. spawn para no heredar
+    hilos ni conexiones a la base de datos del worker: las funciones que se
+    envían al pool viven en módulos sin modelos (labelrender, manifest_checks).
+    """
+    if name not in _pools:
+        with _pools_lock:
+            if name not in _pools:
+                _pools[name] = ProcessPoolExecutor(
+                    max_workers=max_workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                )
+    return _pools[name]
@@ -0,0 +1,163 @@
+# profiling.py - Perfiles de peticiones (cProfile + tiempo SQL) bajo demanda del staff o por muestreo
+import cProfile
+import heapq
+import io
+import os
+import pstats
+import random
+import time
+from contextlib import ExitStack
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from .models import RequestProfile
+
+# Consultas más lentas guardadas por perfil
+SLOWEST_QUERIES = 10
+SUMMARY_LINES = 40
+
+_DRF_SERIALIZERS = os.path.join('rest_framework', 'serializers.py')
+
+
+def profile_path(profile_id):
+    return Path(settings.PROFILE_ROOT) / f'{profile_id.hex}.prof'
+
+
+class QueryTimer:
+    """execute_wrapper que suma el tiempo de las consultas SQL y guarda las más lentas"""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self._slowest = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.count += 1
+            self.seconds += elapsed
+            heapq.heappush(self._slowest, (elapsed, self.count, sql))
+            if len(self._slowest) > SLOWEST_QUERIES:
+                heapq.heappop(self._slowest)
+
+    def slowest(self):
+        return [[round(elapsed * 1000, 3), sql[:2000]] for elapsed, _, sql in sorted(self._slowest, reverse=True)]
+
+
+def serializer_seconds(stats):
+    """
+    Tiempo en los serializers de DRF: el acumulado de la llamada más externa
+    a to_representation (lectura) y a is_valid (escritura)
+    """
+    outermost = {'to_representation': 0.0, 'is_valid': 0.0}
+    for (filename, _, function), (_, _, _, cumulative, _) in stats.stats.items():
+        if function in outermost and filename.endswith(_DRF_SERIALIZERS):
+            outermost[function] = max(outermost[function], cumulative)
+    return sum(outermost.values())
+
+
+def save_profile(request, response, profiler, timer, seconds, trigger):
+    profile = RequestProfile(
+        method=request.method,
+        path=request.path[:500],
+        query_string=request.META.get('QUERY_STRING', ''),
+        status_code=response.status_code,
+        user=request.user if request.user.is_authenticated else None,
+        trigger=trigger,
+        duration_ms=seconds * 1000,
+        sql_count=timer.count,
+        sql_ms=timer.seconds * 1000,
+        slow_queries=timer.slowest(),
+    )
+    path = profile_path(profile.pk)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    profiler.dump_stats(path)
+
+    summary = io.StringIO()
+    stats = pstats.Stats(profiler, stream=summary)
+    profile.serializer_ms = serializer_seconds(stats) * 1000
+    stats.sort_stats('cumulative').print_stats(SUMMARY_LINES)
+    profile.summary = summary.getvalue()
+    profile.save()
+    prune_profiles()
+    return profile
+
+
+def delete_profiles(pks):
+    for pk in pks:
+        profile_path(pk).unlink(missing_ok=True)
+    RequestProfile.objects.filter(pk__in=pks).delete()
+
+
+def prune_profiles():
+    """Conservar solo los PROFILER_MAX_PROFILES perfiles más recientes"""
+    stale = list(
+        RequestProfile.objects.order_by('-created_at').values_list('pk', flat=True)[settings.PROFILER_MAX_PROFILES:]
+    )
+    if stale:
+        delete_profiles(stale)
+
+
+class ProfilerMiddleware:
+    """
+    Perfila la petición si la pide el staff (cabecera PROFILER_HEADER: 1 o
+    ?PROFILER_QUERY_PARAM=1) o si sale en el muestreo (PROFILER_SAMPLE_RATE).
+    Con PROFILER_ENABLED = False no se instala: sin coste alguno.
+
+    El usuario de token lo autentica DRF dentro de la vista, así que el
+    permiso se comprueba al terminar: los perfiles pedidos por quien no es
+    staff se descartan. Las respuestas en streaming solo se perfilan hasta
+    que la vista devuelve la respuesta; las vistas async (stream SSE), no.
+
+    Solo síncrono: con ASGI Django lo ejecuta en el hilo de las vistas
+    síncronas, que es el que mide cProfile.
+    """
+    sync_capable = True
+    async_capable = False
+
+    def __init__(self, get_response):
+        if not settings.PROFILER_ENABLED:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def _trigger(self, request):
+        if (request.headers.get(settings.PROFILER_HEADER) == '1'
+                or request.GET.get(settings.PROFILER_QUERY_PARAM) == '1'):
+            # Con sesión ya se sabe si es staff; con token, al terminar
+            if request.user.is_authenticated and not request.user.is_staff:
+                return None
+            return RequestProfile.TRIGGER_REQUESTED
+        if random.random() < settings.PROFILER_SAMPLE_RATE:
+            return RequestProfile.TRIGGER_SAMPLED
+        return None
+
+    def __call__(self, request):
+        trigger = self._trigger(request)
+        if trigger is None:
+            return self.get_response(request)
+
+        profiler = cProfile.Profile()
+        timer = QueryTimer()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(timer))
+            profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.disable()
+        seconds = time.perf_counter() - start
+
+        if trigger == RequestProfile.TRIGGER_REQUESTED and not request.user.is_staff:
+            return response
+        profile = save_profile(request, response, profiler, timer, seconds, trigger)
+        if request.user.is_staff:
+            response['X-Profile-Id'] = str(profile.pk)
+        return response
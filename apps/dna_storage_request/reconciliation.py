@@ -0,0 +1,177 @@
+# reconciliation.py - Sincronizar is_in_jacq / is_in_database con exports externos
+import csv
+import hashlib
+import heapq
+from array import array
+from bisect import bisect_left
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import audit, events, facets
+from .models import Tissue, DnaAliquot
+
+# registry -> (modelo, campo con el código, flag a mantener)
+REGISTRIES = {
+    'jacq': (Tissue, 'tissue_barcode', 'is_in_jacq'),
+    'dna-database': (DnaAliquot, 'dna_aliquot_qr_code', 'is_in_database'),
+}
+
+# Códigos por run ordenado: limita el pico de memoria al ordenar
+RUN_SIZE = 1_000_000
+# Ejemplos de códigos incluidos en el informe
+SAMPLE_SIZE = 20
+
+
+def normalize_code(value):
+    return value.strip().upper()
+
+
+def code_hash(code):
+    """Hash de 64 bits del código normalizado (8 bytes por código en memoria)"""
+    return int.from_bytes(hashlib.blake2b(code.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+class RegistryCodeSet:
+    """
+    Conjunto de hashes de códigos del export, guardado como runs ordenados de
+    array('Q'). Cada run se ordena por separado, así el pico de memoria es el de
+    un run y no el del export completo; la búsqueda es un bisect por run.
+    """
+
+    def __init__(self):
+        self.runs = []
+        self.matched = []
+        self.total = 0
+
+    @classmethod
+    def from_codes(cls, codes, run_size=RUN_SIZE):
+        code_set = cls()
+        pending = array('Q')
+        for code in codes:
+            pending.append(code_hash(code))
+            if len(pending) >= run_size:
+                code_set._add_run(pending)
+                pending = array('Q')
+        if pending:
+            code_set._add_run(pending)
+        return code_set
+
+    def _add_run(self, values):
+        run = array('Q')
+        previous = None
+        for value in sorted(values):
+            if value != previous:
+                run.append(value)
+                previous = value
+        self.runs.append(run)
+        self.matched.append(bytearray(len(run)))
+        self.total += len(values)
+
+    def contains(self, value, mark=True):
+        found = False
+        for run, matched in zip(self.runs, self.matched):
+            index = bisect_left(run, value)
+            if index < len(run) and run[index] == value:
+                found = True
+                if mark:
+                    matched[index] = 1
+        return found
+
+    def unmatched_count(self):
+        """Hashes únicos del export que no corresponden a ninguna fila nuestra"""
+        def tagged(run_index):
+            run, matched = self.runs[run_index], self.matched[run_index]
+            return ((run[i], matched[i]) for i in range(len(run)))
+
+        count = 0
+        current, current_matched = None, False
+        for value, matched in heapq.merge(*(tagged(i) for i in range(len(self.runs)))):
+            if value != current:
+                if current is not None and not current_matched:
+                    count += 1
+                current, current_matched = value, False
+            current_matched = current_matched or bool(matched)
+        if current is not None and not current_matched:
+            count += 1
+        return count
+
+
+def read_export_codes(lines, column=0, delimiter=',', has_header=False):
+    """Leer en streaming los códigos de un export CSV/texto (una fila por código)"""
+    reader = csv.reader(lines, delimiter=delimiter)
+    if has_header:
+        next(reader, None)
+    for row in reader:
+        if len(row) > column:
+            code = normalize_code(row[column])
+            if code:
+                yield code
+
+
+def reconcile(registry, lines, column=0, delimiter=',', has_header=False,
+              chunk_size=5000, dry_run=False, on_chunk=None):
+    """
+    Comparar el export con nuestra tabla por chunks de clave primaria y
+    aplicar el flag con un UPDATE por chunk y sentido. Devuelve el informe.
+    on_chunk(filas revisadas) se llama tras cada chunk (progreso de los jobs).
+    """
+    model, code_field, flag_field = REGISTRIES[registry]
+    codes = RegistryCodeSet.from_codes(
+        read_export_codes(lines, column=column, delimiter=delimiter, has_header=has_header)
+    )
+
+    report = {
+        'registry': registry,
+        'export_codes': codes.total,
+        'checked': 0,
+        'added': 0,
+        'removed': 0,
+        'added_sample': [],
+        'removed_sample': [],
+        'dry_run': dry_run,
+    }
+    rows = model.objects.filter(**{f'{code_field}__isnull': False}).order_by('pk')
+    last_pk = 0
+    while True:
+        chunk = list(
+            rows.filter(pk__gt=last_pk).values_list('pk', code_field, flag_field)[:chunk_size]
+        )
+        if not chunk:
+            break
+        last_pk = chunk[-1][0]
+
+        to_add, to_remove = [], []
+        for pk, code, flag in chunk:
+            normalized = normalize_code(code)
+            if not normalized:
+                continue
+            present = codes.contains(code_hash(normalized))
+            if present and flag != 1:
+                to_add.append((pk, code, flag))
+            elif not present and flag == 1:
+                to_remove.append((pk, code, flag))
+
+        report['checked'] += len(chunk)
+        report['added'] += len(to_add)
+        report['removed'] += len(to_remove)
+        report['added_sample'].extend(code for _, code, _ in to_add[:SAMPLE_SIZE - len(report['added_sample'])])
+        report['removed_sample'].extend(code for _, code, _ in to_remove[:SAMPLE_SIZE - len(report['removed_sample'])])
+
+        if not dry_run and (to_add or to_remove):
+            now = timezone.now()
+            with audit.buffered(), transaction.atomic():
+                for changed, value in ((to_add, 1), (to_remove, 0)):
+                    if not changed:
+                        continue
+                    model.objects.filter(pk__in=[pk for pk, _, _ in changed]).update(
+                        **{flag_field: value, 'updated_at': now}
+                    )
+                    audit.record_bulk_update(model, [(pk, flag) for pk, _, flag in changed], flag_field, value)
+                    events.publish_bulk_update(model, [pk for pk, _, _ in changed])
+            facets.invalidate(model)
+        if on_chunk is not None:
+            on_chunk(report['checked'])
+
+    report['unknown_in_export'] = codes.unmatched_count()
+    return report
@@ -0,0 +1,151 @@
+# routers.py - Lecturas a la réplica (DATABASE_REPLICA) con lectura de las propias escrituras
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+from .models import AuditLog, ChangeEvent
+
+# Registros con ts que dejan las escrituras de la API (auditoría y stream)
+WRITE_LOGS = (AuditLog, ChangeEvent)
+
+# Alias de lectura del contexto actual (None: el router no decide y se lee de default)
+_read_alias = contextvars.ContextVar('replica_read_alias', default=None)
+
+_lag_lock = threading.Lock()
+_lag_state = {'checked_at': float('-inf'), 'usable': False}
+
+
+def replica_alias():
+    return settings.DATABASE_REPLICA
+
+
+def _pin_key(user_id):
+    return f'replica-pin:{user_id}'
+
+
+def pin_user(user):
+    """Tras una escritura del usuario, sus lecturas van a la primaria durante REPLICA_STICKY_SECONDS"""
+    if replica_alias() and user.is_authenticated:
+        caches[settings.REPLICA_PIN_CACHE].set(_pin_key(user.pk), 1, settings.REPLICA_STICKY_SECONDS)
+
+
+def is_pinned(user):
+    return user.is_authenticated and caches[settings.REPLICA_PIN_CACHE].get(_pin_key(user.pk)) is not None
+
+
+def _latest_write(alias):
+    stamps = [
+        model.objects.using(alias).order_by('-id').values_list('ts', flat=True).first()
+        for model in WRITE_LOGS
+    ]
+    return max((ts for ts in stamps if ts is not None), default=None)
+
+
+def replica_lag(alias):
+    """
+    Segundos que la réplica va por detrás, estimados con el último registro de
+    WRITE_LOGS en cada base de datos (las escrituras de Request, Shipment,
+    Tissue y DnaAliquot dejan uno).
+    """
+    primary = _latest_write(DEFAULT_DB_ALIAS)
+    if primary is None:
+        return 0.0
+    replica = _latest_write(alias)
+    if replica is None:
+        return float('inf')
+    return max(0.0, (primary - replica).total_seconds())
+
+
+def replica_usable():
+    """
+    La réplica se usa si responde y su retraso no pasa de REPLICA_MAX_LAG_SECONDS.
+    Se comprueba como mucho cada REPLICA_CHECK_SECONDS por proceso.
+    """
+    now = time.monotonic()
+    if now - _lag_state['checked_at'] < settings.REPLICA_CHECK_SECONDS:
+        return _lag_state['usable']
+    with _lag_lock:
+        if now - _lag_state['checked_at'] >= settings.REPLICA_CHECK_SECONDS:
+            try:
+                usable = replica_lag(replica_alias()) <= settings.REPLICA_MAX_LAG_SECONDS
+            except DatabaseError:
+                usable = False
+            _lag_state.update(checked_at=now, usable=usable)
+    return _lag_state['usable']
+
+
+def start_replica_reads(user=None):
+    """
+    Enviar a la réplica las lecturas que siguen (hasta stop_replica_reads con
+    el token devuelto), salvo que el usuario acabe de escribir o la réplica
+    vaya retrasada: entonces siguen en la primaria.
+    """
+    alias = replica_alias()
+    if not alias or (user is not None and is_pinned(user)) or not replica_usable():
+        alias = None
+    return _read_alias.set(alias)
+
+
+def stop_replica_reads(token):
+    _read_alias.reset(token)
+
+
+def current_read_alias():
+    return _read_alias.get()
+
+
+def iterate_with_read_alias(iterable, alias):
+    """
+    Recorrer iterable leyendo de alias en cada paso. El cuerpo de un
+    StreamingHttpResponse se genera después de finalize_response, fuera del
+    contexto de la vista, y sus consultas irían a la primaria.
+    """
+    iterator = iter(iterable)
+    while True:
+        token = _read_alias.set(alias)
+        try:
+            chunk = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            _read_alias.reset(token)
+        yield chunk
+
+
+@contextmanager
+def use_replica(user=None):
+    token = start_replica_reads(user)
+    try:
+        yield
+    finally:
+        stop_replica_reads(token)
+
+
+class ReplicaRouter:
+    """
+    Las lecturas dentro de use_replica() van a la réplica; las escrituras, las
+    lecturas fuera de ese contexto o dentro de una transacción de la primaria
+    y las migraciones, a default.
+    """
+
+    def db_for_read(self, model, **hints):
+        alias = _read_alias.get()
+        if alias is None or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        # DatabaseCache: las marcas y generaciones se leen donde se escriben
+        if model._meta.app_label == 'django_cache':
+            return None
+        return alias
+
+    def db_for_write(self, model, **hints):
+        # Aunque la instancia se leyera de la réplica, se guarda en la primaria
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Réplica y primaria tienen los mismos datos
+        return True
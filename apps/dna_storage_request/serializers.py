@@ -1,7 +1,17 @@
+import copy
+import re
+from django.conf import settings
+from django.utils import timezone
 from rest_framework import serializers
-from .models import Requester, Request, Metadata, Shipment, Tissue, DnaAliquot
+from rest_framework.relations import ManyRelatedField
+from . import bulk, codes, jobs
+from .manifest_checks import domain_error
+from .models import Requester, Request, Metadata, Taxon, Shipment, Tissue, DnaAliquot, Upload, AuditLog, Job
 
 class RequesterSerializer(serializers.ModelSerializer):
+    # Mensaje cuando el usuario ya tiene requester (lo detecta el índice UNIQUE de user_id)
+    duplicate_error_message = "Ya tienes un perfil de requester creado. Solo puedes tener uno."
+
     full_name = serializers.SerializerMethodField()
     username = serializers.CharField(source='user.username', read_only=True)
     
@@ -15,17 +25,6 @@ class RequesterSerializer(serializers.ModelSerializer):
     def get_full_name(self, obj):
         return f"{obj.first_name} {obj.last_name}"
     
-    def validate(self, data):
-        """Validación adicional"""
-        # Si estamos creando (no hay instance) verificar que el usuario no tenga requester
-        if not self.instance and self.context.get('request'):
-            user = self.context['request'].user
-            if Requester.objects.filter(user=user).exists():
-                raise serializers.ValidationError(
-                    "Ya tienes un perfil de requester creado. Solo puedes tener uno."
-                )
-        return data
-    
     def create(self, validated_data):
         # El user se asigna automáticamente en perform_create de la view
         return super().create(validated_data)
@@ -42,8 +41,56 @@ class RequesterSerializer(serializers.ModelSerializer):
             
         return data
 
+# clase de serializer -> campos sin enlazar, construidos una vez (ver CachedFieldsMixin)
+_FIELD_PROTOTYPES = {}
+# Campos con hijos enlazados a ellos: se copian en profundidad
+_NESTED_FIELDS = (serializers.BaseSerializer, ManyRelatedField, serializers.ListField, serializers.DictField)
+
+class CachedFieldsMixin:
+    """
+    Los campos de estos ModelSerializer solo dependen de la clase, no del
+    contexto: se construyen una vez por clase (usuario y admin son clases
+    distintas, una entrada por rol) y cada instancia recibe copias que
+    bind() enlaza a ella, sin volver a recorrer el modelo.
+    """
+    def get_fields(self):
+        if not settings.SERIALIZER_FIELD_CACHE:
+            return super().get_fields()
+        prototypes = _FIELD_PROTOTYPES.get(type(self))
+        if prototypes is None:
+            prototypes = _FIELD_PROTOTYPES.setdefault(type(self), super().get_fields())
+        return {
+            name: copy.deepcopy(field) if isinstance(field, _NESTED_FIELDS) else copy.copy(field)
+            for name, field in prototypes.items()
+        }
+
+class SameRequestParentsMixin:
+    """
+    Tissues y aliquots: metadata y shipment tienen que ser del mismo request
+    (como en DnaAliquotBulkSerializer). Si no, archivar el otro request
+    dejaría la FK apuntando a una fila borrada.
+    """
+    PARENT_ERRORS = {
+        'metadata': "El metadata no pertenece a este request",
+        'shipment': "El envío no pertenece a este request",
+    }
+
+    def validate(self, data):
+        data = super().validate(data)
+        if not {'request', *self.PARENT_ERRORS} & data.keys():
+            return data
+        request_obj = data['request'] if 'request' in data else self.instance.request
+        errors = {}
+        for name, message in self.PARENT_ERRORS.items():
+            parent = data[name] if name in data else getattr(self.instance, name, None)
+            if parent is not None and parent.request_id != request_obj.pk:
+                errors[name] = [message]
+        if errors:
+            raise serializers.ValidationError(errors)
+        return data
+
 # Serializer base para Request (campos comunes)
-class BaseRequestSerializer(serializers.ModelSerializer):
+class BaseRequestSerializer(CachedFieldsMixin, serializers.ModelSerializer):
     requester_name = serializers.CharField(source='requester.first_name', read_only=True)
     requester_institution = serializers.CharField(source='requester.requester_institution', read_only=True)
     requester_full_name = serializers.SerializerMethodField()
@@ -59,18 +106,19 @@ class RequestUserSerializer(BaseRequestSerializer):
         model = Request
         fields = [
             'id', 'requester', 'request_date', 'tissue_sample_quantity', 
-            'aliquot_sample_quantity', 'has_manifest_file',
+            'aliquot_sample_quantity', 'tissue_count', 'aliquot_count', 'has_manifest_file',
             'created_at', 'updated_at', 'requester_name', 'requester_institution', 
             'requester_full_name'
         ]
-        read_only_fields = ['id', 'created_at', 'updated_at', 'requester_name', 
-                           'requester_institution', 'requester_full_name']
+        read_only_fields = ['id', 'tissue_count', 'aliquot_count', 'created_at', 'updated_at',
+                           'requester_name', 'requester_institution', 'requester_full_name']
 
 # Serializer para admin (con todos los campos)
 class RequestAdminSerializer(BaseRequestSerializer):
     class Meta:
         model = Request
         fields = '__all__'
+        read_only_fields = ['tissue_count', 'aliquot_count']
 
 # Serializer principal que decide cuál usar
 class RequestSerializer(serializers.ModelSerializer):
@@ -87,13 +135,59 @@ class RequestSerializer(serializers.ModelSerializer):
 
 class MetadataSerializer(serializers.ModelSerializer):
     request_id = serializers.CharField(source='request.id', read_only=True)
+    # Los nombres del taxón se guardan en Taxonomy; la API los sigue exponiendo planos
+    taxon_group = serializers.CharField(source='taxon.taxon_group', max_length=12)
+    family = serializers.CharField(source='taxon.family', max_length=50)
+    genus = serializers.CharField(source='taxon.genus', max_length=45)
+    scientific_name = serializers.CharField(source='taxon.scientific_name', max_length=100)
+    interspecific_epithet = serializers.CharField(source='taxon.interspecific_epithet', max_length=50)
     
     class Meta:
         model = Metadata
-        fields = '__all__'
+        exclude = ['taxon', 'sample_key', 'collector_key']
+
+    # Reglas de dominio compartidas con la validación de manifests (manifest_checks.py)
+    def _check_domain(self, field, value):
+        message = domain_error(field, value, timezone.localdate())
+        if message:
+            raise serializers.ValidationError(message)
+        return value
+
+    def validate_decimal_latitude(self, value):
+        return self._check_domain('decimal_latitude', value)
+
+    def validate_decimal_longitude(self, value):
+        return self._check_domain('decimal_longitude', value)
+
+    def validate_elevation(self, value):
+        return self._check_domain('elevation', value)
+
+    def validate_date_of_collection(self, value):
+        return self._check_domain('date_of_collection', value)
+
+    def validate_sampling_permits_required(self, value):
+        return self._check_domain('sampling_permits_required', value)
+
+    def validate_nagoya_permits_required(self, value):
+        return self._check_domain('nagoya_permits_required', value)
+
+    def _resolve_taxon(self, names, instance=None):
+        if instance is not None:
+            # PATCH parcial: completar con los nombres actuales
+            names = {**{field: getattr(instance.taxon, field) for field in Taxon.NAME_FIELDS}, **names}
+        return Taxon.objects.get_or_create(**names)[0]
+
+    def create(self, validated_data):
+        validated_data['taxon'] = self._resolve_taxon(validated_data.pop('taxon'))
+        return super().create(validated_data)
+
+    def update(self, instance, validated_data):
+        if 'taxon' in validated_data:
+            validated_data['taxon'] = self._resolve_taxon(validated_data.pop('taxon'), instance)
+        return super().update(instance, validated_data)
 
 # SHIPMENTS: Separar campos para admin vs usuario
-class BaseShipmentSerializer(serializers.ModelSerializer):
+class BaseShipmentSerializer(CachedFieldsMixin, serializers.ModelSerializer):
     request_id = serializers.CharField(source='request.id', read_only=True)
 
 class ShipmentUserSerializer(BaseShipmentSerializer):
@@ -123,11 +217,16 @@ class ShipmentSerializer(serializers.ModelSerializer):
             return ShipmentUserSerializer(*args, **kwargs)
 
 # TISSUES: Separar campos para admin vs usuario
-class BaseTissueSerializer(serializers.ModelSerializer):
+class BaseTissueSerializer(CachedFieldsMixin, SameRequestParentsMixin, serializers.ModelSerializer):
     request_id = serializers.CharField(source='request.id', read_only=True)
     shipment_id = serializers.CharField(source='shipment.id', read_only=True, allow_null=True)
     metadata_sample_id = serializers.CharField(source='metadata.original_sample_id', read_only=True)
-    scientific_name = serializers.CharField(source='metadata.scientific_name', read_only=True)
+    scientific_name = serializers.CharField(source='metadata.taxon.scientific_name', read_only=True)
+
+    def validate_tissue_barcode(self, value):
+        if codes.is_reserved_format('tissue_barcode', value):
+            raise serializers.ValidationError("Este formato está reservado para los códigos asignados por el servidor")
+        return value
 
 class TissueUserSerializer(BaseTissueSerializer):
     """Solo campos visibles para usuarios normales"""
@@ -167,11 +266,22 @@ class TissueSerializer(serializers.ModelSerializer):
             return TissueUserSerializer(*args, **kwargs)
 
 # DNA ALIQUOTS: Separar campos para admin vs usuario
-class BaseDnaAliquotSerializer(serializers.ModelSerializer):
+class BaseDnaAliquotSerializer(CachedFieldsMixin, SameRequestParentsMixin, serializers.ModelSerializer):
     request_id = serializers.CharField(source='request.id', read_only=True)
     shipment_id = serializers.CharField(source='shipment.id', read_only=True, allow_null=True)
     metadata_sample_id = serializers.CharField(source='metadata.original_sample_id', read_only=True)
-    scientific_name = serializers.CharField(source='metadata.scientific_name', read_only=True)
+    scientific_name = serializers.CharField(source='metadata.taxon.scientific_name', read_only=True)
+
+    def validate_dna_aliquot_qr_code(self, value):
+        if codes.is_reserved_format('dna_aliquot_qr_code', value):
+            raise serializers.ValidationError("Este formato está reservado para los códigos asignados por el servidor")
+        return value
+
+    def create(self, validated_data):
+        # Sin código del cliente: se asigna uno del bloque reservado por el proceso
+        if not validated_data.get('dna_aliquot_qr_code'):
+            validated_data['dna_aliquot_qr_code'] = codes.allocate('dna_aliquot_qr_code', 1)[0]
+        return super().create(validated_data)
 
 class DnaAliquotUserSerializer(BaseDnaAliquotSerializer):
     """Solo campos visibles para usuarios normales"""
@@ -208,4 +318,159 @@ class DnaAliquotSerializer(serializers.ModelSerializer):
         if request and request.user.is_staff:
             return DnaAliquotAdminSerializer(*args, **kwargs)
         else:
-            return DnaAliquotUserSerializer(*args, **kwargs)
\ No newline at end of file
+            return DnaAliquotUserSerializer(*args, **kwargs)
+
+class DnaAliquotBulkItemSerializer(serializers.Serializer):
+    metadata = serializers.IntegerField()
+    dna_aliquot_storage_location = serializers.CharField(
+        max_length=45, required=False, allow_null=True, allow_blank=True
+    )
+
+class DnaAliquotBulkSerializer(serializers.Serializer):
+    """Alta masiva de aliquots de un request; los códigos QR los asigna el servidor"""
+    request = serializers.PrimaryKeyRelatedField(queryset=Request.objects.select_related('requester'))
+    shipment = serializers.PrimaryKeyRelatedField(queryset=Shipment.objects.all(), required=False, allow_null=True)
+    items = DnaAliquotBulkItemSerializer(many=True, allow_empty=False)
+
+    def validate_items(self, items):
+        if len(items) > settings.BULK_ALIQUOTS_MAX_ITEMS:
+            raise serializers.ValidationError(f"Máximo {settings.BULK_ALIQUOTS_MAX_ITEMS} aliquots por petición")
+        return items
+
+    def validate(self, data):
+        request_obj = data['request']
+        user = self.context['request'].user
+        if not user.is_staff and request_obj.requester.user_id != user.id:
+            raise serializers.ValidationError("No puedes crear aliquots en requests de otro usuario")
+        if data.get('shipment') and data['shipment'].request_id != request_obj.pk:
+            raise serializers.ValidationError({'shipment': "El envío no pertenece a este request"})
+        # Una sola consulta para todos los metadata del lote
+        metadata_ids = {item['metadata'] for item in data['items']}
+        found = set(Metadata.objects.filter(request=request_obj, pk__in=metadata_ids).values_list('pk', flat=True))
+        missing = sorted(metadata_ids - found)
+        if missing:
+            raise serializers.ValidationError({'items': f"Metadata que no pertenecen al request: {missing}"})
+        return data
+
+    def create(self, validated_data):
+        items = [
+            {'metadata_id': item['metadata'],
+             'dna_aliquot_storage_location': item.get('dna_aliquot_storage_location')}
+            for item in validated_data['items']
+        ]
+        return bulk.create_aliquots(validated_data['request'], validated_data.get('shipment'), items)
+
+# Serializers por rol que elige el __new__ de RequestSerializer, ShipmentSerializer, ...
+ROLE_SERIALIZERS = [
+    RequestUserSerializer, RequestAdminSerializer,
+    ShipmentUserSerializer, ShipmentAdminSerializer,
+    TissueUserSerializer, TissueAdminSerializer,
+    DnaAliquotUserSerializer, DnaAliquotAdminSerializer,
+]
+
+def warm_field_cache():
+    """Construir los campos de cada serializer por rol al arrancar (AppConfig.ready)"""
+    if settings.SERIALIZER_FIELD_CACHE:
+        for serializer_class in ROLE_SERIALIZERS:
+            serializer_class().get_fields()
+
+# UPLOADS: subidas por partes de manifests, MTAs y permisos
+class UploadSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Upload
+        fields = [
+            'id', 'target', 'request', 'metadata', 'filename', 'size', 'checksum',
+            'offset', 'status', 'storage_path', 'created_at', 'updated_at'
+        ]
+        read_only_fields = ['id', 'offset', 'status', 'storage_path', 'created_at', 'updated_at']
+        extra_kwargs = {
+            'request': {'required': False},
+            'metadata': {'required': False, 'allow_null': True},
+        }
+
+    def validate_size(self, value):
+        if value <= 0:
+            raise serializers.ValidationError("El fichero está vacío")
+        if value > settings.UPLOAD_MAX_FILE_SIZE:
+            raise serializers.ValidationError(
+                f"El fichero supera el máximo de {settings.UPLOAD_MAX_FILE_SIZE} bytes"
+            )
+        return value
+
+    def validate_checksum(self, value):
+        value = value.lower()
+        if not re.fullmatch(r'[0-9a-f]{64}', value):
+            raise serializers.ValidationError("Se espera el SHA-256 del fichero en hexadecimal")
+        return value
+
+    def validate(self, data):
+        owner, _ = Upload.TARGET_FIELDS[data['target']]
+        if owner == 'metadata':
+            if not data.get('metadata'):
+                raise serializers.ValidationError({'metadata': "Obligatorio para los permisos"})
+            data['request'] = data['metadata'].request
+        else:
+            if not data.get('request'):
+                raise serializers.ValidationError({'request': "Obligatorio para manifest y MTA"})
+            data['metadata'] = None
+
+        user = self.context['request'].user
+        if not user.is_staff and data['request'].requester.user_id != user.id:
+            raise serializers.ValidationError("No puedes subir ficheros a requests de otro usuario")
+        return data
+
+
+# AUDIT: historial de cambios por objeto
+class AuditLogSerializer(serializers.ModelSerializer):
+    username = serializers.CharField(source='user.username', read_only=True, default=None)
+
+    class Meta:
+        model = AuditLog
+        fields = ['id', 'action', 'changes', 'user', 'username', 'ts']
+        read_only_fields = fields
+
+
+# JOBS: trabajos largos en segundo plano (ver jobs.py)
+class JobSerializer(serializers.ModelSerializer):
+    kind = serializers.ChoiceField(choices=sorted(jobs.JOB_KINDS))
+    file = serializers.FileField(write_only=True, required=False)
+    percent = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Job
+        fields = [
+            'id', 'kind', 'params', 'file', 'status', 'progress', 'total', 'percent', 'message',
+            'result', 'result_filename', 'error', 'attempts', 'created_at', 'started_at', 'finished_at'
+        ]
+        read_only_fields = [
+            'id', 'status', 'progress', 'total', 'message', 'result', 'result_filename',
+            'error', 'attempts', 'created_at', 'started_at', 'finished_at'
+        ]
+
+    def get_percent(self, obj):
+        if obj.status == Job.STATUS_SUCCEEDED:
+            return 100
+        if not obj.total:
+            return None
+        return min(100, int(obj.progress * 100 / obj.total))
+
+    def validate_kind(self, value):
+        if jobs.JOB_KINDS[value]['staff_only'] and not self.context['request'].user.is_staff:
+            raise serializers.ValidationError("Solo los administradores pueden lanzar este job")
+        return value
+
+    def validate_params(self, value):
+        if not isinstance(value, dict):
+            raise serializers.ValidationError("Se espera un objeto JSON")
+        return value
+
+    def validate(self, data):
+        if jobs.JOB_KINDS[data['kind']]['input_file'] and not data.get('file'):
+            raise serializers.ValidationError({'file': "Este job necesita un fichero de entrada"})
+        return data
+
+    def create(self, validated_data):
+        return jobs.enqueue(
+            self.context['request'].user, validated_data['kind'],
+            validated_data.get('params'), validated_data.get('file'),
+        )
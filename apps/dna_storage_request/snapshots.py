@@ -0,0 +1,31 @@
+# snapshots.py - Valores guardados de una instancia, leídos al guardarla y no al cargarla
+from django.db.models.signals import pre_save
+
+_tracked = set()
+
+
+def track(model):
+    """
+    Antes de cada save() de una instancia ya guardada de `model` se leen sus
+    valores en la base de datos: una consulta por save(), compartida por
+    contadores, auditoría y autocompletado, en vez de copiar cada instancia
+    al cargarla (listados y exportaciones no pagan nada).
+    """
+    if model not in _tracked:
+        _tracked.add(model)
+        pre_save.connect(_read_stored, sender=model, dispatch_uid=f'snapshots_{model.__name__}')
+
+
+def _read_stored(sender, instance, raw=False, using=None, **kwargs):
+    instance._stored_values = None
+    if raw or instance.pk is None:
+        return
+    attnames = [field.attname for field in sender._meta.concrete_fields]
+    instance._stored_values = (
+        sender._base_manager.using(using).filter(pk=instance.pk).values(*attnames).first()
+    )
+
+
+def stored_values(instance):
+    """Valores en la base de datos antes del save() en curso ({} en un alta)"""
+    return getattr(instance, '_stored_values', None) or {}
@@ -0,0 +1,251 @@
+# stream.py - Server-sent events con los cambios de envíos y muestras (ASGI)
+import asyncio
+import json
+import time
+import weakref
+from collections import deque
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Max, Q
+from django.http import JsonResponse, StreamingHttpResponse
+from rest_framework.authtoken.models import Token
+
+from . import events
+from .models import ChangeEvent
+
+# Ids no vistos se reintentan este tiempo: un INSERT con id menor puede
+# confirmarse después de uno con id mayor
+GAP_TIMEOUT_SECONDS = 10
+QUEUE_SIZE = 1000
+# Eventos por consulta al reenviar lo perdido desde Last-Event-ID
+BACKLOG_PAGE_SIZE = 1000
+
+
+def _format(event):
+    data = {
+        'id': event.pk,
+        'model': event.model,
+        'object_id': event.object_id,
+        'action': event.action,
+        'ts': event.ts,
+        **event.payload,
+    }
+    return f"id: {event.pk}\nevent: {event.model}\ndata: {json.dumps(data, cls=DjangoJSONEncoder)}\n\n"
+
+
+def _format_reset(last_event_id, up_to_id):
+    """
+    Los eventos posteriores a Last-Event-ID ya se purgaron: el cliente tiene
+    que resincronizar (?updated_since=) y seguir desde up_to_id.
+    """
+    data = {'reason': 'expired', 'last_event_id': last_event_id}
+    return f"id: {up_to_id}\nevent: reset\ndata: {json.dumps(data)}\n\n"
+
+
+class Subscription:
+    def __init__(self, broker, user, resume_from=None, resume_to=None):
+        self.broker = broker
+        self.user_id = user.pk
+        self.is_staff = user.is_staff
+        # (Last-Event-ID, último id al suscribirse): lo que hay que reenviar antes del directo
+        self.resume_from = resume_from
+        self.resume_to = resume_to
+        self.queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        self.overflowed = False
+        self._sent = deque(maxlen=QUEUE_SIZE)
+
+    def wants(self, event):
+        return self.is_staff or event.owner_id == self.user_id
+
+    def offer(self, event):
+        if self.overflowed or not self.wants(event):
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Cliente demasiado lento: se cierra y reconecta con Last-Event-ID
+            self.overflowed = True
+
+    async def backlog(self):
+        """Eventos entre Last-Event-ID y la suscripción, por páginas, o un reset si ya no están"""
+        after_id, up_to_id = self.resume_from, self.resume_to
+        if after_id is None or after_id >= up_to_id:
+            return
+        oldest = await sync_to_async(_min_event_id, thread_sensitive=False)()
+        if oldest is None or oldest > after_id + 1:
+            yield _format_reset(after_id, up_to_id)
+            return
+        owner_id = None if self.is_staff else self.user_id
+        while after_id < up_to_id:
+            page = await sync_to_async(_fetch_range, thread_sensitive=False)(after_id, up_to_id, owner_id)
+            if not page:
+                break
+            for event in page:
+                self._sent.append(event.pk)
+                yield _format(event)
+            after_id = page[-1].pk
+
+    async def stream(self):
+        heartbeat = getattr(settings, 'CHANGE_STREAM_HEARTBEAT_SECONDS', 15)
+        try:
+            yield "retry: 3000\n\n"
+            async for chunk in self.backlog():
+                yield chunk
+            while not self.overflowed:
+                try:
+                    event = await asyncio.wait_for(self.queue.get(), timeout=heartbeat)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if event.pk in self._sent:
+                    continue
+                self._sent.append(event.pk)
+                yield _format(event)
+        finally:
+            self.broker.unsubscribe(self)
+
+
+class ChangeBroker:
+    """
+    Pub/sub del proceso: una única tarea lee el registro de cambios por id
+    creciente (una consulta por intervalo, haya los suscriptores que haya) y
+    reparte los eventos. Las escrituras del propio proceso la despiertan antes.
+    Sin suscriptores no guarda referencias fuertes a su loop: cuando el loop
+    desaparece se libera el broker y, con él, su listener en events.
+    """
+
+    def __init__(self, loop):
+        self._loop = weakref.ref(loop)
+        self.subscribers = set()
+        self.last_id = None
+        self.gaps = {}
+        self._wakeup = asyncio.Event()
+        self._task = None
+        events.add_listener(self.notify)
+
+    def notify(self):
+        # Llamado desde hilos síncronos (on_commit de una vista)
+        loop = self._loop()
+        if self.subscribers and loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def subscribe(self, user, last_event_id=None):
+        if self.last_id is None:
+            self.last_id = await sync_to_async(_max_event_id, thread_sensitive=False)()
+        subscription = Subscription(self, user, last_event_id, self.last_id)
+        self.subscribers.add(subscription)
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        return subscription
+
+    def unsubscribe(self, subscription):
+        self.subscribers.discard(subscription)
+
+    async def _run(self):
+        interval = getattr(settings, 'CHANGE_STREAM_POLL_SECONDS', 1.0)
+        try:
+            while self.subscribers:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                new_events = await sync_to_async(_fetch_after, thread_sensitive=False)(
+                    self.last_id, list(self.gaps)
+                )
+                self._track_gaps(new_events)
+                for event in new_events:
+                    for subscription in list(self.subscribers):
+                        subscription.offer(event)
+        finally:
+            # Sin suscriptores (o el loop se cierra): la próxima suscripción
+            # parte del último id actual. La tarea y el Event quedan ligados
+            # al loop: se sueltan para no retenerlo
+            self.last_id = None
+            self.gaps.clear()
+            self._task = None
+            self._wakeup = asyncio.Event()
+
+    def _track_gaps(self, new_events):
+        now = time.monotonic()
+        seen = {event.pk for event in new_events}
+        for pk in seen:
+            self.gaps.pop(pk, None)
+        top = max((pk for pk in seen if pk > self.last_id), default=self.last_id)
+        for pk in range(self.last_id + 1, top):
+            if pk not in seen:
+                self.gaps[pk] = now
+        self.last_id = top
+        for pk, first_missing in list(self.gaps.items()):
+            if now - first_missing > GAP_TIMEOUT_SECONDS:
+                del self.gaps[pk]
+
+
+def _max_event_id():
+    return ChangeEvent.objects.aggregate(last=Max('pk'))['last'] or 0
+
+
+def _fetch_after(last_id, gaps):
+    query = Q(pk__gt=last_id)
+    if gaps:
+        query |= Q(pk__in=gaps)
+    return list(ChangeEvent.objects.filter(query).order_by('pk')[:QUEUE_SIZE])
+
+
+def _min_event_id():
+    return ChangeEvent.objects.order_by('pk').values_list('pk', flat=True).first()
+
+
+def _fetch_range(after_id, up_to_id, owner_id=None):
+    events = ChangeEvent.objects.filter(pk__gt=after_id, pk__lte=up_to_id)
+    if owner_id is not None:
+        events = events.filter(owner_id=owner_id)
+    return list(events.order_by('pk')[:BACKLOG_PAGE_SIZE])
+
+
+_brokers = weakref.WeakKeyDictionary()
+
+
+def get_broker():
+    loop = asyncio.get_running_loop()
+    if loop not in _brokers:
+        _brokers[loop] = ChangeBroker(loop)
+    return _brokers[loop]
+
+
+def _stream_user(request):
+    """Sesión o token (cabecera Authorization o ?token=, EventSource no envía cabeceras)"""
+    if request.user.is_authenticated:
+        return request.user
+    header = request.headers.get('Authorization', '')
+    key = header[6:].strip() if header.startswith('Token ') else request.GET.get('token')
+    if not key:
+        return None
+    token = Token.objects.select_related('user').filter(key=key).first()
+    if token is None or not token.user.is_active:
+        return None
+    return token.user
+
+
+async def change_stream_view(request):
+    """
+    Stream SSE de cambios en Shipment, Tissue y DnaAliquot dentro del alcance
+    del usuario. Reanuda desde Last-Event-ID si el cliente lo envía; si esos
+    eventos ya se purgaron envía un evento reset para que resincronice.
+    """
+    user = await sync_to_async(_stream_user)(request)
+    if user is None:
+        return JsonResponse({'detail': 'Las credenciales de autenticación no se proveyeron.'}, status=401)
+    try:
+        last_event_id = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id')
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        return JsonResponse({'detail': 'Last-Event-ID inválido'}, status=400)
+
+    subscription = await get_broker().subscribe(user, last_event_id)
+    response = StreamingHttpResponse(subscription.stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,188 @@
+# sync.py - Sincronización incremental (?updated_since=) y tombstones de borrado
+import base64
+import json
+from datetime import datetime, timedelta, timezone as dt_timezone
+from itertools import islice
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Model, Q
+from django.db.models.signals import post_delete
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django_filters.rest_framework import DjangoFilterBackend
+
+from .models import Requester, Request, Metadata, Shipment, Tissue, DnaAliquot, Tombstone
+
+SYNCED_MODELS = (Requester, Request, Metadata, Shipment, Tissue, DnaAliquot)
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+class SyncCursor:
+    """
+    Posición del cliente en dos líneas de tiempo: filas modificadas,
+    ordenadas por (updated_at, id), y tombstones, por (deleted_at, id).
+    """
+
+    def __init__(self, changed_at=_EPOCH, changed_id=0, deleted_at=_EPOCH, deleted_id=0):
+        self.changed_at = changed_at
+        self.changed_id = changed_id
+        self.deleted_at = deleted_at
+        self.deleted_id = deleted_id
+
+    @classmethod
+    def parse(cls, value):
+        """
+        Acepta un timestamp ISO 8601 (primera sincronización) o el cursor
+        opaco devuelto en next_since. Lanza ValueError si no es válido.
+        """
+        moment = parse_datetime(value.replace(' ', '+'))
+        if moment is not None:
+            if timezone.is_naive(moment):
+                moment = timezone.make_aware(moment, dt_timezone.utc)
+            return cls(moment, 0, moment, 0)
+        try:
+            padded = value + '=' * (-len(value) % 4)
+            changed_at, changed_id, deleted_at, deleted_id = (
+                base64.urlsafe_b64decode(padded).decode('ascii').split('|')
+            )
+            return cls(
+                datetime.fromisoformat(changed_at), int(changed_id),
+                datetime.fromisoformat(deleted_at), int(deleted_id),
+            )
+        except (ValueError, UnicodeDecodeError):
+            raise ValueError('updated_since debe ser un timestamp ISO 8601 o un cursor next_since')
+
+    def encode(self):
+        raw = f'{self.changed_at.isoformat()}|{self.changed_id}|{self.deleted_at.isoformat()}|{self.deleted_id}'
+        return base64.urlsafe_b64encode(raw.encode('ascii')).decode('ascii').rstrip('=')
+
+
+def horizon():
+    """
+    Límite superior de lo que se sirve: updated_at y deleted_at se fijan en
+    Python antes del COMMIT, así que una transacción lenta puede hacer visible
+    una fila con una marca anterior a un cursor ya entregado. Lo de los
+    últimos SYNC_SAFETY_LAG_SECONDS se deja para la siguiente consulta.
+    """
+    return timezone.now() - timedelta(seconds=settings.SYNC_SAFETY_LAG_SECONDS)
+
+
+def changed_since(queryset, cursor, until):
+    """Filas modificadas entre el cursor y until, en orden estable (usa el índice updated_at, id)"""
+    return queryset.filter(
+        Q(updated_at__gt=cursor.changed_at)
+        | Q(updated_at=cursor.changed_at, id__gt=cursor.changed_id),
+        updated_at__lte=until,
+    ).order_by('updated_at', 'id')
+
+
+def _json_value(value):
+    # El mismo formato con que se guarda Tombstone.fields
+    if isinstance(value, Model):
+        value = value.pk
+    return json.loads(json.dumps(value, cls=DjangoJSONEncoder))
+
+
+def tombstone_filters(view, request, queryset):
+    """
+    Filtros exactos del filterset del viewset sobre campos del modelo
+    ({attname: valor}) que se pueden aplicar al snapshot de los tombstones.
+    Los demás (rangos, search, filtros por relaciones) no reducen los
+    tombstones: un id que el cliente no tiene simplemente se ignora.
+    """
+    if DjangoFilterBackend not in view.filter_backends:
+        return {}
+    filterset = DjangoFilterBackend().get_filterset(request, queryset, view)
+    if filterset is None or not filterset.is_valid():
+        return {}
+    model = queryset.model
+    result = {}
+    for name, filter_ in filterset.filters.items():
+        value = filterset.form.cleaned_data.get(name)
+        if value in (None, '') or filter_.lookup_expr != 'exact' or filter_.exclude:
+            continue
+        try:
+            field = model._meta.get_field(filter_.field_name)
+        except FieldDoesNotExist:
+            continue
+        if field.concrete:
+            result[field.attname] = _json_value(value)
+    return result
+
+
+def deleted_since(model, cursor, user, until, filters=None):
+    """
+    Tombstones entre el cursor y until dentro del alcance del usuario y de
+    los filtros exactos del viewset (ver tombstone_filters). Los tombstones
+    sin snapshot (anteriores a guardarlo) pasan siempre.
+    """
+    tombstones = Tombstone.objects.filter(model=model._meta.model_name).filter(
+        Q(deleted_at__gt=cursor.deleted_at)
+        | Q(deleted_at=cursor.deleted_at, id__gt=cursor.deleted_id),
+        deleted_at__lte=until,
+    )
+    if not user.is_staff:
+        tombstones = tombstones.filter(owner_id=user.pk)
+    if filters:
+        tombstones = tombstones.filter(
+            Q(fields__isnull=True) | Q(**{f'fields__{attname}': value for attname, value in filters.items()})
+        )
+    return tombstones.order_by('deleted_at', 'id')
+
+
+def _owner_user_id(instance):
+    if isinstance(instance, Requester):
+        return instance.user_id
+    if isinstance(instance, Request):
+        request_filter = {'pk': instance.requester_id}
+    else:
+        request_filter = {'request__id': instance.request_id}
+    return Requester.objects.filter(**request_filter).values_list('user_id', flat=True).first()
+
+
+# Ruta al usuario dueño desde cada modelo sincronizado (el resto, vía request)
+_OWNER_PATHS = {Requester: 'user_id', Request: 'requester__user_id'}
+
+
+def create_tombstones(queryset, batch_size=500):
+    """
+    Tombstones de las filas del queryset antes de un DELETE sin señales
+    (archivar): para las copias de los clientes es un borrado. Llamar en la
+    misma transacción que el DELETE. Devuelve cuántos.
+    """
+    model = queryset.model
+    attnames = [field.attname for field in model._meta.concrete_fields]
+    owner_path = _OWNER_PATHS.get(model, 'request__requester__user_id')
+    now = timezone.now()
+    rows = queryset.order_by().values(*attnames, owner_path).iterator(chunk_size=batch_size)
+    total = 0
+    while True:
+        batch = [
+            Tombstone(
+                model=model._meta.model_name, object_id=row['id'], owner_id=row[owner_path], deleted_at=now,
+                fields={attname: row[attname] for attname in attnames},
+            )
+            for row in islice(rows, batch_size)
+        ]
+        if not batch:
+            return total
+        Tombstone.objects.bulk_create(batch)
+        total += len(batch)
+
+
+def _create_tombstone(sender, instance, **kwargs):
+    # Dentro de la misma transacción que el DELETE: si hay rollback, no hay tombstone
+    Tombstone.objects.create(
+        model=sender._meta.model_name,
+        object_id=instance.pk,
+        owner_id=_owner_user_id(instance),
+        deleted_at=timezone.now(),
+        fields={field.attname: getattr(instance, field.attname) for field in sender._meta.concrete_fields},
+    )
+
+
+for _model in SYNCED_MODELS:
+    post_delete.connect(_create_tombstone, sender=_model, dispatch_uid=f'sync_tombstone_{_model.__name__}')
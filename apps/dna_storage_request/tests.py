@@ -1,3 +1,1704 @@
-from django.test import TestCase
+import asyncio
+import csv
+import gc
+import hashlib
+import io
+import os
+import json
+import tempfile
+import time
+import uuid
+import zlib
+from datetime import date, timedelta
+from itertools import chain
+from pathlib import Path
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.management import call_command
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, IntegrityError, connection, router, transaction
+from django.db.models.signals import post_init
+from django.test import AsyncClient, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from . import (
+    archive, bulk, checks, codes, duplicates, events, facets, idempotency, jobs, labelrender, manifest, metrics,
+    profiling, reconciliation, stream, typeahead, uploads,
+)
+from .models import (
+    ArchivedRequest, ArchivedTissue, AuditLog, ChangeEvent, CodeBlock, CodeSequence, DnaAliquot, IdempotencyKey,
+    Job, Metadata, Request, Requester, RequestProfile, Shipment, Taxon, Tissue, Tombstone, Upload,
+)
+from .routers import is_pinned, use_replica
+from .serializers import ROLE_SERIALIZERS, MetadataSerializer, RequesterSerializer
+
+
+VALID_ROW = {
+    'original_sample_id': 'B 10 0123456',
+    'taxon_group': 'Plantae',
+    'family': 'Asteraceae',
+    'genus': 'Bellis',
+    'scientific_name': 'Bellis perennis',
+    'interspecific_epithet': 'perennis',
+    'collector_sample_id': 'JS-0042',
+    'collected_by': 'J. Smith',
+    'collector_affiliation': 'BGBM',
+    'date_of_collection': '2023-05-17',
+    'collection_location': 'Botanischer Garten, Berlin',
+    'decimal_latitude': '52.45540000',
+    'decimal_longitude': '13.30500000',
+    'habitat': 'Meadow',
+    'elevation': '50',
+    'identified_by': 'J. Smith',
+    'voucher_id': 'V-1',
+    'voucher_link': '',
+    'voucher_institution': 'B',
+    'sampling_permits_required': '0',
+    'sampling_permits_filename': '',
+    'nagoya_permits_required': '1',
+    'nagoya_permits_filename': 'nagoya.pdf',
+}
+TAXON_NAMES = {name: VALID_ROW[name] for name in Taxon.NAME_FIELDS}
+# Campos de Metadata de VALID_ROW (sin los nombres del taxón ni celdas vacías)
+SAMPLE = {name: value for name, value in VALID_ROW.items() if name not in Taxon.NAME_FIELDS and value != ''}
+
+
+def make_requester(user, **fields):
+    """Requester de `user`: Ana Pérez, BGBM, Berlin, salvo los campos que se pasen"""
+    return Requester.objects.create(user=user, **{
+        'first_name': 'Ana', 'last_name': 'Pérez', 'contact_person_email': user.email,
+        'requester_institution': 'BGBM', 'institution_location': 'Berlin', **fields,
+    })
+
+
+def make_request(user=None, requester=None, request_date=date(2024, 1, 10), **fields):
+    """Request de `requester` o de un requester nuevo de `user`"""
+    if requester is None:
+        requester = make_requester(user)
+    return Request.objects.create(requester=requester, request_date=request_date, **fields)
+
+
+def make_taxon(**names):
+    return Taxon.objects.create(**{**TAXON_NAMES, **names})
+
+
+def make_metadata(request, taxon=None, **fields):
+    """Metadata con la muestra de VALID_ROW; sin `taxon`, el de VALID_ROW"""
+    if taxon is None:
+        taxon, _ = Taxon.objects.get_or_create(**TAXON_NAMES)
+    return Metadata.objects.create(request=request, taxon=taxon, **{**SAMPLE, **fields})
+
+# (campo, celda) sobre VALID_ROW: una fila del manifest por variante
+VARIANTS = [
+    ('decimal_latitude', '91'), ('decimal_latitude', '-90'), ('decimal_latitude', '90.000000001'),
+    ('decimal_latitude', 'abc'), ('decimal_latitude', 'NaN'), ('decimal_latitude', '-Infinity'),
+    ('decimal_latitude', '1e2'), ('decimal_latitude', ' 45.5 '), ('decimal_latitude', '12345678901'),
+    ('decimal_latitude', '0.000000005'), ('decimal_latitude', ''), ('decimal_latitude', '9' * 1001),
+    ('decimal_longitude', '-181'), ('decimal_longitude', '180'), ('decimal_longitude', '179.999999999'),
+    ('elevation', '9001'), ('elevation', '-501'), ('elevation', '12.0'), ('elevation', '12.5'),
+    ('elevation', '1_000'), ('elevation', ' 7 '), ('elevation', 'x'), ('elevation', '+8848'),
+    ('date_of_collection', 'tomorrow'), ('date_of_collection', '2020-02-30'),
+    ('date_of_collection', '20200101'), ('date_of_collection', '2020-1-5'), ('date_of_collection', '17/05/2023'),
+    ('sampling_permits_required', '2'), ('sampling_permits_required', '-1'),
+    ('sampling_permits_required', '1.0'), ('sampling_permits_required', ''), ('nagoya_permits_required', 'yes'),
+    ('original_sample_id', 'x' * 101), ('original_sample_id', '  padded  '), ('original_sample_id', '   '),
+    ('taxon_group', 'a' * 13), ('collected_by', 'y' * 51), ('habitat', ''), ('habitat', 'h' * 5000),
+    ('voucher_link', 'https://example.org/v/1'), ('sampling_permits_filename', 'p' * 101),
+]
+
+
+def manifest_rows():
+    tomorrow = (timezone.localdate() + timedelta(days=1)).isoformat()
+    rows = [dict(VALID_ROW)]
+    for field, cell in VARIANTS:
+        rows.append({**VALID_ROW, field: tomorrow if cell == 'tomorrow' else cell})
+    return rows
+
+
+def manifest_csv(rows):
+    output = io.StringIO()
+    writer = csv.DictWriter(output, fieldnames=list(VALID_ROW))
+    writer.writeheader()
+    writer.writerows(rows)
+    return io.StringIO(output.getvalue())
+
+
+class ManifestParityTests(SimpleTestCase):
+    """La validación por columnas da los mismos errores que MetadataSerializer fila a fila"""
+
+    def engine_errors(self, report):
+        by_row = {}
+        for row, column, messages in report['errors']:
+            by_row.setdefault(row, {})[report['columns'][column]] = messages
+        return by_row
+
+    def serializer_errors(self, rows):
+        header = list(VALID_ROW)
+        by_row = {}
+        for index, row in enumerate(rows):
+            serializer = MetadataSerializer(data=manifest.row_payload(header, [row[name] for name in header]))
+            serializer.is_valid()
+            # El request no va en el manifest
+            errors = {field: [str(message) for message in messages]
+                      for field, messages in serializer.errors.items() if field != 'request'}
+            if errors:
+                by_row[index] = errors
+        return by_row
+
+    def test_errors_match_serializer(self):
+        rows = manifest_rows()
+        report = manifest.validate_manifest(manifest_csv(rows))
+        expected = self.serializer_errors(rows)
+        self.assertEqual(self.engine_errors(report), expected)
+        self.assertEqual(report['rows'], len(rows))
+        self.assertEqual(report['valid_rows'], len(rows) - len(expected))
+        self.assertFalse(report['missing_columns'])
+
+    @override_settings(MANIFEST_CHUNK_ROWS=7)
+    def test_chunked_matches_single_pass(self):
+        rows = manifest_rows()
+        with override_settings(MANIFEST_CHUNK_ROWS=len(rows) + 1):
+            single = manifest.validate_manifest(manifest_csv(rows))
+        self.assertEqual(manifest.validate_manifest(manifest_csv(rows)), single)
+
+    def test_large_manifest_in_many_chunks(self):
+        # 100000 filas (50 chunks con el MANIFEST_CHUNK_ROWS por defecto), una inválida cada 10000
+        total = 100000
+        header, valid, invalid = manifest_csv([VALID_ROW, {**VALID_ROW, 'elevation': '9001'}]).readlines()
+        lines = chain([header], (invalid if index % 10000 == 0 else valid for index in range(total)))
+        report = manifest.validate_manifest(lines)
+        self.assertEqual(report['rows'], total)
+        self.assertEqual([row for row, _, _ in report['errors']], list(range(0, total, 10000)))
+        self.assertEqual(report['valid_rows'], total - 10)
+
+    @override_settings(MANIFEST_MAX_ROWS=10)
+    def test_too_many_rows(self):
+        with self.assertRaisesMessage(manifest.ManifestError, 'máximo de 10 filas'):
+            manifest.validate_manifest(manifest_csv([VALID_ROW] * 11))
+
+    def test_missing_and_unknown_columns(self):
+        report = manifest.validate_manifest(io.StringIO('Original Sample ID,colour\nA-1,red\n'))
+        self.assertIn('habitat', report['missing_columns'])
+        self.assertNotIn('voucher_link', report['missing_columns'])
+        self.assertEqual(report['ignored_columns'], ['colour'])
+        self.assertEqual(report['valid_rows'], 0)
+
+
+REPLICA = settings.DATABASE_REPLICA
+
+
+@skipUnless(REPLICA, 'Sin réplica: python manage.py test --settings=bgbm_backend.test_settings')
+@override_settings(REPLICA_CHECK_SECONDS=0)
+class ReplicaRoutingTests(TransactionTestCase):
+    """
+    Primaria y réplica son bases de datos separadas: lo que se escribe en la
+    primaria no aparece en la réplica hasta llamar a replicate(), como con
+    retraso de replicación.
+    """
+    databases = {DEFAULT_DB_ALIAS, REPLICA} if REPLICA else set()
+
+    def setUp(self):
+        caches[settings.REPLICA_PIN_CACHE].clear()
+        self.owner = User.objects.create_user('owner', 'owner@example.org', 'x')
+        self.curator = User.objects.create_user('curator', 'curator@example.org', 'x', is_staff=True)
+        self.request = make_request(self.owner)
+        self.replicate()
+
+    def replicate(self):
+        """Copiar a la réplica las filas que aún no tiene (la replicación se pone al día)"""
+        for model in (User, Requester, Request, Taxon, Metadata, AuditLog, ChangeEvent):
+            copied = set(model.objects.using(REPLICA).values_list('pk', flat=True))
+            model.objects.using(REPLICA).bulk_create(
+                [obj for obj in model.objects.using(DEFAULT_DB_ALIAS).order_by('pk') if obj.pk not in copied]
+            )
+
+    def client_for(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def create_metadata(self, user):
+        response = self.client_for(user).post(
+            '/api/metadata/', {**VALID_ROW, 'request': self.request.pk}, format='json'
+        )
+        self.assertEqual(response.status_code, 201, response.data)
+
+    def listed(self, user):
+        return self.client_for(user).get('/api/metadata/').data['count']
+
+    def test_router_sends_reads_in_context_to_replica(self):
+        self.assertEqual(Metadata.objects.all().db, DEFAULT_DB_ALIAS)
+        with use_replica():
+            self.assertEqual(Metadata.objects.all().db, REPLICA)
+            self.assertEqual(router.db_for_write(Metadata), DEFAULT_DB_ALIAS)
+            with transaction.atomic():
+                # Dentro de una transacción de la primaria se lee de la primaria
+                self.assertEqual(Metadata.objects.all().db, DEFAULT_DB_ALIAS)
+        self.assertEqual(Metadata.objects.all().db, DEFAULT_DB_ALIAS)
+
+    def test_list_is_served_from_replica(self):
+        self.create_metadata(self.curator)
+        self.assertEqual(Metadata.objects.count(), 1)
+        # El dueño no ha escrito: lee de la réplica, que aún no tiene la fila
+        self.assertEqual(self.listed(self.owner), 0)
+        self.replicate()
+        self.assertEqual(self.listed(self.owner), 1)
+
+    def test_streamed_rows_are_read_from_replica(self):
+        self.create_metadata(self.curator)
+        url = f'/api/requests/{self.request.pk}/metadata/?stream=1'
+        # El cuerpo se genera al recorrer la respuesta, después de finalize_response
+        response = self.client_for(self.owner).get(url)
+        self.assertEqual(b''.join(response.streaming_content), b'')
+        self.replicate()
+        response = self.client_for(self.owner).get(url)
+        self.assertEqual(len(b''.join(response.streaming_content).splitlines()), 1)
+
+    def test_user_reads_own_writes_from_primary(self):
+        self.create_metadata(self.owner)
+        self.assertEqual(self.listed(self.owner), 1)
+        # Pasado REPLICA_STICKY_SECONDS vuelve a la réplica, todavía retrasada
+        caches[settings.REPLICA_PIN_CACHE].clear()
+        self.assertEqual(self.listed(self.owner), 0)
+
+    def test_pins_are_read_from_the_shared_cache_on_the_primary(self):
+        self.create_metadata(self.owner)
+        with use_replica():
+            cache_model = caches[settings.REPLICA_PIN_CACHE].cache_model_class
+            self.assertEqual(router.db_for_read(cache_model), DEFAULT_DB_ALIAS)
+        self.assertTrue(is_pinned(self.owner))
+
+    def test_lagging_replica_falls_back_to_primary(self):
+        self.create_metadata(self.curator)
+        # El último registro de auditoría que llegó a la réplica es de hace una hora
+        self.assertTrue(AuditLog.objects.using(REPLICA).exists())
+        AuditLog.objects.using(REPLICA).update(ts=timezone.now() - timedelta(hours=1))
+        with use_replica():
+            self.assertEqual(Metadata.objects.all().db, DEFAULT_DB_ALIAS)
+        self.assertEqual(self.listed(self.owner), 1)
+        with override_settings(REPLICA_MAX_LAG_SECONDS=2 * 3600), use_replica():
+            self.assertEqual(Metadata.objects.all().db, REPLICA)
+
+
+class ReplicaPinCacheCheckTests(SimpleTestCase):
+    """Con réplica, las marcas de lectura tras escritura necesitan una caché compartida"""
+
+    def errors(self):
+        return [error.id for error in checks.check_replica_pin_cache(None)]
+
+    @override_settings(DATABASE_REPLICA='replica', CACHES={
+        'replica_pins': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    })
+    def test_local_cache_with_replica_is_an_error(self):
+        self.assertEqual(self.errors(), ['dna_storage_request.E001'])
+        with override_settings(DATABASE_REPLICA=None):
+            self.assertEqual(self.errors(), [])
+
+    @override_settings(DATABASE_REPLICA='replica', CACHES={
+        'replica_pins': {'BACKEND': 'django.core.cache.backends.db.DatabaseCache', 'LOCATION': 'bgbm_cache'},
+    })
+    def test_shared_cache_passes(self):
+        self.assertEqual(self.errors(), [])
+
+
+class ArchiveTests(TestCase):
+    """Archivar y restaurar requests cerrados, y leerlos con ?include_archived=1"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user('owner', 'owner@example.org', 'x')
+        cls.closed = make_request(cls.owner, request_date=date(2022, 3, 1), mta_signed_date=date(2022, 4, 1))
+        cls.open = make_request(requester=cls.closed.requester, mta_signed_date=date(2024, 2, 1))
+        cls.parents = {}
+        for request, accession_date in ((cls.closed, date(2022, 6, 1)), (cls.open, None)):
+            shipment = Shipment.objects.create(request=request, accession_date=accession_date)
+            metadata = make_metadata(request)
+            cls.parents[request.pk] = (metadata, shipment)
+            Tissue.objects.create(request=request, shipment=shipment, metadata=metadata,
+                                  tissue_barcode=f'T-{request.pk}')
+            DnaAliquot.objects.create(request=request, shipment=shipment, metadata=metadata,
+                                      dna_aliquot_qr_code=f'Q-{request.pk}')
+        cls.closed.refresh_from_db()
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+
+    def archive(self):
+        return archive.archive_closed(before=timezone.now() + timedelta(seconds=1))
+
+    def test_moves_closed_request_with_children(self):
+        self.assertEqual(archive.archive_closed(before=self.closed.updated_at), 0)
+        self.assertEqual(self.archive(), 1)
+        self.assertFalse(Request.objects.filter(pk=self.closed.pk).exists())
+        self.assertTrue(Request.objects.filter(pk=self.open.pk).exists())
+        self.assertEqual(Tissue.objects.get().request_id, self.open.pk)
+        archived = ArchivedRequest.objects.get()
+        self.assertEqual(archived.pk, self.closed.pk)
+        self.assertEqual((archived.created_at, archived.updated_at, archived.tissue_count),
+                         (self.closed.created_at, self.closed.updated_at, 1))
+        self.assertEqual(ArchivedTissue.objects.get().tissue_barcode, f'T-{self.closed.pk}')
+
+    def test_restore_brings_rows_back(self):
+        self.archive()
+        self.assertEqual(archive.restore([self.closed.pk, self.open.pk]), 1)
+        self.assertFalse(ArchivedRequest.objects.exists())
+        # Vuelven como modificadas ahora, para que ?updated_since= las entregue de nuevo
+        self.assertGreater(Request.objects.get(pk=self.closed.pk).updated_at, self.closed.updated_at)
+        self.assertGreater(Tissue.objects.get(request=self.closed).updated_at, self.closed.updated_at)
+        self.assertEqual(Tissue.objects.count(), 2)
+        self.assertEqual(DnaAliquot.objects.filter(request=self.closed).count(), 1)
+
+    def test_api_opts_into_archived_rows(self):
+        self.archive()
+        response = self.client.get('/api/tissues/')
+        self.assertEqual([row['request'] for row in response.data['results']], [self.open.pk])
+
+        # Las archivadas van detrás de las vivas y se serializan igual
+        response = self.client.get('/api/tissues/', {'include_archived': '1'})
+        self.assertEqual([row['request'] for row in response.data['results']], [self.open.pk, self.closed.pk])
+        self.assertEqual(response.data['count'], 2)
+        self.assertEqual(response.data['results'][1]['scientific_name'], VALID_ROW['scientific_name'])
+
+        # ?request= de un request archivado: solo coincide en la parte archivada
+        response = self.client.get('/api/metadata/', {'include_archived': '1', 'request': self.closed.pk})
+        self.assertEqual([row['request'] for row in response.data['results']], [self.closed.pk])
+
+        self.assertEqual(self.client.get(f'/api/requests/{self.closed.pk}/').status_code, 404)
+        response = self.client.get(f'/api/requests/{self.closed.pk}/', {'include_archived': '1'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['tissue_count'], 1)
+
+    def test_rows_of_other_requests_keep_the_request_live(self):
+        metadata, shipment = self.parents[self.closed.pk]
+        for parent in ({'metadata': metadata}, {'shipment': shipment}):
+            row = Tissue.objects.create(**{'request': self.open, 'metadata': self.parents[self.open.pk][0],
+                                           **parent})
+            self.assertEqual(self.archive(), 0)
+            row.delete()
+        aliquot = DnaAliquot.objects.create(request=self.open, metadata=metadata, dna_aliquot_qr_code='Q-x')
+        self.assertEqual(self.archive(), 0)
+        aliquot.delete()
+        self.assertEqual(self.archive(), 1)
+        connection.check_constraints()
+
+    def test_serializers_reject_parents_of_another_request(self):
+        metadata, shipment = self.parents[self.closed.pk]
+        own_metadata = self.parents[self.open.pk][0]
+        for path in ('/api/tissues/', '/api/dna-aliquots/'):
+            response = self.client.post(path, {'request': self.open.pk, 'metadata': metadata.pk}, format='json')
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.data['metadata'], ['El metadata no pertenece a este request'])
+            response = self.client.post(path, {'request': self.open.pk, 'metadata': own_metadata.pk,
+                                               'shipment': shipment.pk}, format='json')
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.data['shipment'], ['El envío no pertenece a este request'])
+        # Cambiar solo el request también se comprueba contra el metadata guardado
+        tissue = Tissue.objects.get(request=self.open)
+        response = self.client.patch(f'/api/tissues/{tissue.pk}/', {'request': self.closed.pk}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('metadata', response.data)
+
+    @override_settings(SYNC_SAFETY_LAG_SECONDS=0)
+    def test_archiving_writes_tombstones(self):
+        since = timezone.now().isoformat()
+        tissue = Tissue.objects.get(request=self.closed)
+        self.archive()
+        tombstones = dict(Tombstone.objects.values_list('model', 'owner_id').distinct())
+        self.assertEqual(tombstones, {model: self.owner.pk for model in
+                                      ('request', 'metadata', 'shipment', 'tissue', 'dnaaliquot')})
+        self.assertEqual(Tombstone.objects.get(model='tissue').fields['tissue_barcode'], tissue.tissue_barcode)
+        response = self.client.get('/api/tissues/', {'updated_since': since})
+        self.assertEqual(response.data['deleted'], [tissue.pk])
+
+        # Al restaurar vuelve entre las modificadas
+        archive.restore([self.closed.pk])
+        response = self.client.get('/api/tissues/', {'updated_since': response.data['next_since']})
+        self.assertEqual([row['id'] for row in response.data['results']], [tissue.pk])
+
+    def test_archived_rows_are_scoped_to_owner(self):
+        self.archive()
+        other = User.objects.create_user('other', 'other@example.org', 'x')
+        self.client.force_authenticate(other)
+        response = self.client.get('/api/requests/', {'include_archived': '1'})
+        self.assertEqual(response.data['count'], 0)
+        response = self.client.get(f'/api/requests/{self.closed.pk}/', {'include_archived': '1'})
+        self.assertEqual(response.status_code, 404)
+
+
+
+class NestedActionTests(TestCase):
+    """requesters/{id}/requests/, requests/{id}/metadata/ y shipments/: cursor, filtros, rol y streaming"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user('owner', 'owner@example.org', 'x')
+        cls.staff = User.objects.create_user('curator', 'curator@example.org', 'x', is_staff=True)
+        cls.request = make_request(cls.owner)
+        cls.requester = cls.request.requester
+        for index in range(5):
+            make_metadata(cls.request, original_sample_id=f'B 10 {index}')
+        Shipment.objects.create(request=cls.request, tracking_number='TRK-1', accession_date=date(2024, 3, 1))
+
+    def get(self, user, url, **params):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client.get(url, params)
+
+    def test_metadata_pages_follow_the_cursor(self):
+        url = f'/api/requests/{self.request.pk}/metadata/'
+        response = self.get(self.owner, url, page_size=2)
+        ids = [row['id'] for row in response.data['results']]
+        while response.data['next']:
+            client = APIClient()
+            client.force_authenticate(self.owner)
+            response = client.get(response.data['next'])
+            ids.extend(row['id'] for row in response.data['results'])
+        self.assertEqual(ids, sorted(Metadata.objects.values_list('pk', flat=True), reverse=True))
+
+        # Búsqueda del viewset de metadata
+        response = self.get(self.owner, url, search='B 10 3')
+        self.assertEqual([row['original_sample_id'] for row in response.data['results']], ['B 10 3'])
+
+    def test_serializer_follows_the_role_and_scope(self):
+        url = f'/api/requests/{self.request.pk}/shipments/'
+        self.assertNotIn('accession_date', self.get(self.owner, url).data['results'][0])
+        self.assertEqual(self.get(self.staff, url).data['results'][0]['accession_date'], '2024-03-01')
+        response = self.get(self.staff, f'/api/requesters/{self.requester.pk}/requests/')
+        self.assertIn('mta_signed_date', response.data['results'][0])
+
+        other = User.objects.create_user('other', 'other@example.org', 'x')
+        self.assertEqual(self.get(other, url).status_code, 404)
+
+    @override_settings(NESTED_STREAM_CHUNK_SIZE=2)
+    def test_stream_returns_every_row_as_ndjson(self):
+        response = self.get(self.owner, f'/api/requests/{self.request.pk}/metadata/', stream='1')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([row['original_sample_id'] for row in rows], [f'B 10 {index}' for index in range(5)])
+
+class FieldCacheTests(SimpleTestCase):
+    """Los serializers por rol con campos copiados de la caché son iguales a los construidos"""
+
+    def test_cached_fields_match_built_fields(self):
+        for serializer_class in ROLE_SERIALIZERS:
+            with override_settings(SERIALIZER_FIELD_CACHE=False):
+                built = serializer_class().fields
+            cached = serializer_class().fields
+            with self.subTest(serializer=serializer_class.__name__):
+                self.assertEqual({name: repr(field) for name, field in cached.items()},
+                                 {name: repr(field) for name, field in built.items()})
+
+    def test_each_instance_binds_its_own_fields(self):
+        for serializer_class in ROLE_SERIALIZERS:
+            first, second = serializer_class(), serializer_class()
+            for name, field in second.fields.items():
+                self.assertIsNot(field, first.fields[name])
+                self.assertIs(field.parent, second)
+                self.assertIs(first.fields[name].parent, first)
+
+
+@override_settings(PROFILER_ENABLED=True, PROFILE_ROOT=tempfile.mkdtemp(prefix='bgbm-profiles-'))
+class ProfilerTests(TestCase):
+    """Perfiles pedidos por el staff o muestreados, y su descarga desde el admin"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user('curator', 'curator@example.org', 'x', is_staff=True,
+                                             is_superuser=True)
+        # Los usuarios nuevos quedan inactivos hasta verificar el email
+        User.objects.filter(pk=cls.staff.pk).update(is_active=True)
+        cls.user = User.objects.create_user('owner', 'owner@example.org', 'x')
+
+    def get(self, user, **kwargs):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client.get('/api/requests/', **kwargs)
+
+    def test_disabled_middleware_is_not_installed(self):
+        with override_settings(PROFILER_ENABLED=False), self.assertRaises(MiddlewareNotUsed):
+            profiling.ProfilerMiddleware(lambda request: None)
+
+    def test_staff_request_is_profiled(self):
+        response = self.get(self.staff, HTTP_X_PROFILE='1')
+        profile = RequestProfile.objects.get()
+        self.assertEqual(response['X-Profile-Id'], str(profile.pk))
+        self.assertEqual((profile.path, profile.status_code, profile.user, profile.trigger),
+                         ('/api/requests/', 200, self.staff, RequestProfile.TRIGGER_REQUESTED))
+        self.assertGreater(profile.sql_count, 0)
+        self.assertGreater(profile.serializer_ms, 0)
+        self.assertIn('function calls', profile.summary)
+        self.assertTrue(profiling.profile_path(profile.pk).exists())
+
+        self.client.force_login(self.staff)
+        response = self.client.get(f'/admin/dna_storage_request/requestprofile/{profile.pk}/download/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(b''.join(response.streaming_content))
+        self.assertEqual(self.client.get('/admin/dna_storage_request/requestprofile/').status_code, 200)
+
+    def test_non_staff_cannot_request_profiles(self):
+        response = self.get(self.user, data={'profile': '1'})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertFalse(RequestProfile.objects.exists())
+
+    def test_requests_are_profiled_under_asgi(self):
+        # AsyncClient monta la cadena de middleware async, como el handler ASGI
+        client = AsyncClient()
+        client.force_login(self.staff)
+        response = async_to_sync(client.get)('/api/requests/', headers={'X-Profile': '1'})
+        profile = RequestProfile.objects.get()
+        self.assertEqual(response['X-Profile-Id'], str(profile.pk))
+        self.assertGreater(profile.sql_count, 0)
+        self.assertIn('function calls', profile.summary)
+
+    @override_settings(PROFILER_SAMPLE_RATE=1.0, PROFILER_MAX_PROFILES=2)
+    def test_sampled_requests_are_kept_up_to_the_limit(self):
+        for _ in range(3):
+            response = self.get(self.user)
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertEqual(RequestProfile.objects.filter(trigger=RequestProfile.TRIGGER_SAMPLED).count(), 2)
+
+
+class MetricsTests(TestCase):
+    """Métricas por ruta y acción del router, sumadas entre workers, en /metrics"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user('curator', 'curator@example.org', 'x', is_staff=True)
+        cls.user = User.objects.create_user('owner', 'owner@example.org', 'x')
+
+    def setUp(self):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        self.root = root.name
+        settings_override = override_settings(METRICS_ROOT=self.root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        metrics.registry.clear()
+
+    def scrape(self, user=None, **extra):
+        client = APIClient()
+        if user is not None:
+            client.force_authenticate(user)
+        return client.get('/metrics', **extra)
+
+    def test_requests_are_labelled_by_router_prefix_and_action(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        client.get('/api/requests/')
+        client.get('/api/requests/999/')
+        client.get('/api/nowhere/')
+
+        body = self.scrape(self.staff).content.decode()
+        self.assertIn('bgbm_http_requests_total{route="requests",action="list",method="GET",status="200"} 1', body)
+        self.assertIn('bgbm_http_requests_total{route="requests",action="retrieve",method="GET",status="404"} 1',
+                      body)
+        self.assertIn('bgbm_http_requests_total{route="unmatched",action="",method="GET",status="404"} 1', body)
+        self.assertIn('bgbm_http_request_duration_seconds_count{route="requests",action="list",method="GET"} 1',
+                      body)
+        self.assertIn('bgbm_http_request_queries_bucket{route="requests",action="list",le="+Inf"} 1', body)
+        self.assertIn('bgbm_http_response_size_bytes_count{route="requests",action="list"} 1', body)
+
+    def test_queries_are_counted_under_asgi(self):
+        # AsyncClient monta la cadena de middleware async, como el handler ASGI
+        # Los usuarios nuevos quedan inactivos hasta verificar el email
+        User.objects.filter(pk=self.user.pk).update(is_active=True)
+        client = AsyncClient()
+        client.force_login(self.user)
+        self.assertEqual(async_to_sync(client.get)('/api/requests/').status_code, 200)
+        body = self.scrape(self.staff).content.decode()
+        self.assertIn('bgbm_http_requests_total{route="requests",action="list",method="GET",status="200"} 1', body)
+        self.assertIn('bgbm_http_request_queries_bucket{route="requests",action="list",le="+Inf"} 1', body)
+
+    def test_access_is_limited_to_staff_or_localhost(self):
+        remote = {'REMOTE_ADDR': '192.0.2.10'}
+        self.assertIn(self.scrape(**remote).status_code, (401, 403))
+        self.assertEqual(self.scrape(self.user, **remote).status_code, 403)
+        response = self.scrape(self.staff, **remote)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        self.assertEqual(self.scrape().status_code, 200)
+        # Detrás de un proxy local la petición no es local
+        self.assertIn(self.scrape(HTTP_X_FORWARDED_FOR='192.0.2.10').status_code, (401, 403))
+
+    def test_files_of_other_workers_are_summed_and_dead_ones_compacted(self):
+        labels = (('route', 'jobs'), ('action', 'list'), ('method', 'GET'), ('status', '200'))
+        # Un pid que no existe: un worker ya terminado
+        dead = Path(self.root) / '999999999-abcdef12.json'
+        with open(dead, 'w') as fh:
+            json.dump([['http_requests_total', [list(pair) for pair in labels], 3]], fh)
+        metrics.registry.inc('http_requests_total', labels, 2)
+
+        self.assertEqual(metrics.collect()[('http_requests_total', labels)], 5)
+        self.assertFalse(dead.exists())
+        # Lo compactado se sigue contando
+        self.assertEqual(metrics.collect()[('http_requests_total', labels)], 5)
+
+
+class IdempotencyTests(TestCase):
+    """Idempotency-Key: repetición de la respuesta, clave con otro cuerpo, espera y limpieza"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user('owner', 'owner@example.org', 'x')
+        cls.request = make_request(cls.owner)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+
+    def post(self, tracking_number='TRK-1', key='retry-1'):
+        return self.client.post('/api/shipments/', {'request': self.request.pk, 'tracking_number': tracking_number},
+                                format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_repeated_post_replays_the_first_response(self):
+        first = self.post()
+        second = self.post()
+        self.assertEqual((first.status_code, second.status_code), (201, 201))
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(json.loads(second.content), first.data)
+        self.assertEqual(Shipment.objects.count(), 1)
+
+        self.assertEqual(self.post(key='retry-2').status_code, 201)
+        self.assertEqual(Shipment.objects.count(), 2)
+
+    def test_key_reused_for_another_body_is_rejected(self):
+        self.post()
+        self.assertEqual(self.post(tracking_number='TRK-2').status_code, 422)
+        self.assertEqual(Shipment.objects.count(), 1)
+
+    @override_settings(IDEMPOTENCY_WAIT_SECONDS=0.3, IDEMPOTENCY_POLL_SECONDS=0.1)
+    def test_duplicate_of_request_in_progress_waits_then_conflicts(self):
+        self.post()
+        # Como si la primera petición siguiera en curso
+        IdempotencyKey.objects.update(status_code=None, response_body=None)
+        self.assertEqual(self.post().status_code, 409)
+
+        # Abandonada (worker caído): la clave se reserva de nuevo
+        old = timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_LOCK_SECONDS + 1)
+        IdempotencyKey.objects.update(created_at=old)
+        self.assertNotIn('Idempotent-Replayed', self.post())
+        self.assertEqual(Shipment.objects.count(), 2)
+
+        IdempotencyKey.objects.update(created_at=timezone.now() - timedelta(hours=settings.IDEMPOTENCY_TTL_HOURS + 1))
+        self.assertEqual(idempotency.purge_expired(), 1)
+
+
+class RequesterUniquenessTests(TestCase):
+    """Un requester por usuario: el IntegrityError de user_id se devuelve como 400"""
+
+    def test_second_requester_is_rejected(self):
+        user = User.objects.create_user('owner', 'owner@example.org', 'x')
+        client = APIClient()
+        client.force_authenticate(user)
+        data = {'first_name': 'Ana', 'last_name': 'Pérez', 'contact_person_email': 'owner@example.org',
+                'requester_institution': 'BGBM', 'institution_location': 'Berlin'}
+        self.assertEqual(client.post('/api/requesters/', data, format='json').status_code, 201)
+        response = client.post('/api/requesters/', data, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['non_field_errors'], [RequesterSerializer.duplicate_error_message])
+        self.assertEqual(Requester.objects.filter(user=user).count(), 1)
+
+    def test_other_integrity_errors_are_not_mapped(self):
+        user = User.objects.create_user('owner', 'owner@example.org', 'x')
+        client = APIClient()
+        client.force_authenticate(user)
+        data = {'first_name': 'Ana', 'last_name': 'Pérez', 'contact_person_email': 'owner@example.org',
+                'requester_institution': 'BGBM', 'institution_location': 'Berlin'}
+        error = IntegrityError('NOT NULL constraint failed: Requester.user_id')
+        with mock.patch.object(RequesterSerializer, 'save', side_effect=error), self.assertRaises(IntegrityError):
+            client.post('/api/requesters/', data, format='json')
+
+
+@override_settings(UPLOAD_MAX_CHUNK_SIZE=64 * 1024)
+class UploadTests(TestCase):
+    """Subidas por partes: reanudar, offsets en conflicto, checksums y descarga con Range"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('owner', 'owner@example.org', 'x')
+        cls.request_obj = make_request(cls.user, request_date=date(2024, 1, 1))
+        cls.data = os.urandom(150 * 1024)
+
+    def setUp(self):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        override = override_settings(UPLOAD_ROOT=root.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        response = self.client.post('/api/uploads/', {
+            'target': 'manifest', 'request': self.request_obj.pk, 'filename': 'manifest.xlsx',
+            'size': len(self.data), 'checksum': hashlib.sha256(self.data).hexdigest(),
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.url = f"/api/uploads/{response.data['id']}/"
+
+    def patch(self, offset, chunk, checksum=None):
+        headers = {'HTTP_UPLOAD_OFFSET': str(offset)}
+        if checksum:
+            headers['HTTP_UPLOAD_CHECKSUM'] = f'sha256 {checksum}'
+        return self.client.patch(self.url, chunk, content_type='application/offset+octet-stream', **headers)
+
+    def upload_all(self, offset=0):
+        for start in range(offset, len(self.data), 64 * 1024):
+            chunk = self.data[start:start + 64 * 1024]
+            response = self.patch(start, chunk, hashlib.sha256(chunk).hexdigest())
+            self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_resume_and_complete(self):
+        self.assertEqual(self.patch(0, self.data[:64 * 1024]).status_code, 200)
+        # El cliente reanuda desde el offset que devuelve el servidor
+        response = self.client.get(self.url)
+        self.assertEqual(response['Upload-Offset'], str(64 * 1024))
+        response = self.upload_all(int(response['Upload-Offset']))
+        self.assertEqual(response.data['status'], Upload.STATUS_COMPLETE)
+        self.request_obj.refresh_from_db()
+        self.assertEqual(self.request_obj.manifest_storage_path, response.data['storage_path'])
+        self.assertEqual(uploads.stored_path(response.data['storage_path']).read_bytes(), self.data)
+
+    def test_wrong_offset_is_a_conflict(self):
+        self.patch(0, self.data[:1024])
+        response = self.patch(0, self.data[:1024])
+        self.assertEqual((response.status_code, response['Upload-Offset']), (409, '1024'))
+
+    def test_chunk_in_progress_is_a_conflict_and_keeps_its_bytes(self):
+        upload = Upload.objects.get()
+        with uploads.chunk_lock(upload) as locked:
+            self.assertTrue(locked)
+            uploads.write_chunk(upload, 0, io.BytesIO(self.data[:1024]), 1024)
+            # Otro PATCH en el mismo offset no escribe ni trunca nada
+            self.assertEqual(self.patch(0, os.urandom(1024), '0' * 64).status_code, 409)
+        self.assertEqual(uploads.part_path(upload).read_bytes(), self.data[:1024])
+
+    def test_oversize_chunk(self):
+        self.assertEqual(self.patch(0, self.data[:64 * 1024 + 1]).status_code, 413)
+
+    def test_bad_chunk_checksum_is_discarded(self):
+        self.patch(0, self.data[:1024])
+        response = self.patch(1024, self.data[1024:2048], '0' * 64)
+        self.assertEqual(response.status_code, 400)
+        upload = Upload.objects.get()
+        self.assertEqual(upload.offset, 1024)
+        self.assertEqual(uploads.part_path(upload).read_bytes(), self.data[:1024])
+
+    def test_final_checksum_mismatch_fails_the_upload(self):
+        Upload.objects.update(checksum='0' * 64)
+        response = self.patch(0, self.data[:64 * 1024])
+        response = self.patch(64 * 1024, self.data[64 * 1024:128 * 1024])
+        response = self.patch(128 * 1024, self.data[128 * 1024:])
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Upload.objects.get().status, Upload.STATUS_FAILED)
+
+    def test_range_download(self):
+        self.upload_all()
+        response = self.client.get(self.url + 'download/', HTTP_RANGE='bytes=10-19')
+        self.assertEqual((response.status_code, response['Content-Range']),
+                         (206, f'bytes 10-19/{len(self.data)}'))
+        self.assertEqual(b''.join(response.streaming_content), self.data[10:20])
+        response = self.client.get(self.url + 'download/', HTTP_RANGE='bytes=-5')
+        self.assertEqual(b''.join(response.streaming_content), self.data[-5:])
+        response = self.client.get(self.url + 'download/', HTTP_RANGE=f'bytes={len(self.data)}-')
+        self.assertEqual(response.status_code, 416)
+
+
+class DeltaSyncTests(TestCase):
+    """?updated_since=: cursor, tombstones con el alcance del viewset y margen para COMMITs tardíos"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user('curator', 'curator@example.org', 'x', is_staff=True)
+        old = timezone.now() - timedelta(minutes=5)
+        cls.requesters = []
+        for index, institution in enumerate(['BGBM', 'BGBM', 'Kew']):
+            user = User.objects.create_user(f'user{index}', f'user{index}@example.org', 'x')
+            cls.requesters.append(make_requester(user, last_name=str(index), requester_institution=institution))
+        Requester.objects.update(updated_at=old)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.staff)
+
+    def sync(self, since, **params):
+        response = self.client.get('/api/requesters/', {'updated_since': since, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_cursor_round_trip(self):
+        first = self.sync('2000-01-01T00:00:00Z', limit=2)
+        self.assertTrue(first['has_more'])
+        second = self.sync(first['next_since'], limit=2)
+        self.assertFalse(second['has_more'])
+        ids = [row['id'] for row in first['results'] + second['results']]
+        self.assertEqual(ids, [requester.pk for requester in self.requesters])
+        self.assertEqual(self.sync(second['next_since'])['results'], [])
+
+    @override_settings(SYNC_SAFETY_LAG_SECONDS=0)
+    def test_delete_produces_a_tombstone_within_the_filters(self):
+        cursor = self.sync('2000-01-01T00:00:00Z')['next_since']
+        kew, bgbm = self.requesters[2], self.requesters[0]
+        kew_pk, bgbm_pk = kew.pk, bgbm.pk
+        kew.delete()
+        bgbm.delete()
+        self.assertEqual(self.sync(cursor)['deleted'], [kew_pk, bgbm_pk])
+        self.assertEqual(self.sync(cursor, requester_institution='BGBM')['deleted'], [bgbm_pk])
+
+        # Un usuario solo recibe los tombstones de sus objetos
+        self.client.force_authenticate(kew.user)
+        self.assertEqual(self.sync(cursor)['deleted'], [kew_pk])
+
+    def test_late_commit_is_not_skipped(self):
+        # Fila con updated_at reciente: su transacción podría no haber hecho COMMIT aún
+        late = self.requesters[1]
+        Requester.objects.filter(pk=late.pk).update(updated_at=timezone.now() - timedelta(seconds=5))
+        data = self.sync('2000-01-01T00:00:00Z')
+        self.assertNotIn(late.pk, [row['id'] for row in data['results']])
+        # El cursor no pasa por delante de ella: aparece cuando sale del margen
+        with override_settings(SYNC_SAFETY_LAG_SECONDS=0):
+            self.assertEqual([row['id'] for row in self.sync(data['next_since'])['results']], [late.pk])
+
+
+@override_settings(CHANGE_STREAM_HEARTBEAT_SECONDS=0.05, CHANGE_STREAM_POLL_SECONDS=0.05)
+class ChangeStreamTests(TransactionTestCase):
+    """Stream SSE: reanudación desde Last-Event-ID por páginas, alcance por usuario y reset"""
+
+    def setUp(self):
+        self.owner = User.objects.create_user('owner', 'owner@example.org', 'x')
+        self.other = User.objects.create_user('other', 'other@example.org', 'x')
+        self.staff = User.objects.create_user('curator', 'curator@example.org', 'x', is_staff=True)
+        now = timezone.now()
+        self.events = [
+            ChangeEvent.objects.create(model='tissue', object_id=index, action=AuditLog.ACTION_UPDATE,
+                                       owner=user, ts=now)
+            for index, user in enumerate([self.owner, self.other, self.owner, self.other, self.owner])
+        ]
+
+    def replay(self, user, last_event_id):
+        """Lo que recibe el cliente hasta el primer keepalive (fin del backlog)"""
+        async def read():
+            subscription = await stream.get_broker().subscribe(user, last_event_id)
+            chunks = []
+            generator = subscription.stream()
+            async for chunk in generator:
+                if chunk.startswith(': keepalive'):
+                    break
+                chunks.append(chunk)
+            await generator.aclose()
+            return chunks[1:]  # sin el retry:
+
+        return asyncio.run(read())
+
+    @staticmethod
+    def ids(chunks):
+        return [int(chunk.split('\n', 1)[0][len('id: '):]) for chunk in chunks]
+
+    def test_resume_is_scoped_to_the_owner(self):
+        chunks = self.replay(self.owner, self.events[0].pk)
+        self.assertEqual(self.ids(chunks), [self.events[2].pk, self.events[4].pk])
+
+    def test_resume_pages_through_the_whole_backlog(self):
+        with mock.patch.object(stream, 'BACKLOG_PAGE_SIZE', 2):
+            chunks = self.replay(self.staff, self.events[0].pk - 1)
+        self.assertEqual(self.ids(chunks), [event.pk for event in self.events])
+
+    def test_purged_backlog_sends_a_reset(self):
+        ChangeEvent.objects.filter(pk__lte=self.events[1].pk).delete()
+        chunks = self.replay(self.staff, self.events[0].pk)
+        self.assertEqual(len(chunks), 1)
+        self.assertIn('event: reset', chunks[0])
+        self.assertEqual(self.ids(chunks), [self.events[-1].pk])
+
+    def test_broker_is_released_with_its_loop(self):
+        self.replay(self.owner, None)
+        gc.collect()
+        listeners = [ref() for ref in events._listeners]
+        self.assertFalse([listener for listener in listeners
+                          if isinstance(getattr(listener, '__self__', None), stream.ChangeBroker)])
+
+
+class FacetTests(TestCase):
+    """?facets=: conteos por valor, invalidados en todos los workers tras una escritura"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user('curator', 'curator@example.org', 'x', is_staff=True)
+        request = make_request(cls.staff)
+        cls.taxon = make_taxon()
+        cls.metadata = [make_metadata(request, cls.taxon) for _ in range(2)]
+        for metadata in cls.metadata:
+            Tissue.objects.create(request=request, metadata=metadata)
+
+    def setUp(self):
+        caches[settings.FACETS_CACHE].clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.staff)
+
+    def facets(self, path, field):
+        response = self.client.get(path, {'facets': field})
+        self.assertEqual(response.status_code, 200)
+        return response.data['facets'][field]
+
+    def test_counts(self):
+        self.assertEqual(self.facets('/api/metadata/', 'genus'), [{'value': 'Bellis', 'count': 2}])
+        self.assertEqual(self.facets('/api/tissues/', 'scientific_name'),
+                         [{'value': 'Bellis perennis', 'count': 2}])
+
+    def test_taxon_and_metadata_writes_invalidate_tissue_facets(self):
+        self.facets('/api/tissues/', 'scientific_name')
+        with self.captureOnCommitCallbacks(execute=True):
+            other = make_taxon(scientific_name='Bellis annua', interspecific_epithet='annua')
+            self.metadata[0].taxon = other
+            self.metadata[0].save()
+        self.assertCountEqual(self.facets('/api/tissues/', 'scientific_name'),
+                              [{'value': 'Bellis annua', 'count': 1}, {'value': 'Bellis perennis', 'count': 1}])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            other.scientific_name = 'Bellis sylvestris'
+            other.save()
+        self.assertCountEqual(self.facets('/api/tissues/', 'scientific_name'),
+                              [{'value': 'Bellis sylvestris', 'count': 1}, {'value': 'Bellis perennis', 'count': 1}])
+
+    def test_generation_is_shared_between_workers(self):
+        self.facets('/api/metadata/', 'collected_by')
+        generation = facets._generation(Metadata)
+        # Otro worker escribe: su caché de conteos es otra, la generación es la misma
+        with self.captureOnCommitCallbacks(execute=True):
+            Metadata.objects.filter(pk=self.metadata[0].pk).update(collected_by='K. Lee')
+            Metadata.objects.get(pk=self.metadata[0].pk).save()
+        self.assertNotEqual(facets._generation(Metadata), generation)
+        self.assertEqual(caches[settings.FACETS_GENERATION_CACHE].get(facets._generation_key(Metadata)),
+                         facets._generation(Metadata))
+        self.assertIn({'value': 'K. Lee', 'count': 1}, self.facets('/api/metadata/', 'collected_by'))
+
+    def generation_queries(self, rows):
+        """Consultas a la caché de generaciones al dar de alta `rows` metadata en un POST"""
+        table = settings.CACHES[settings.FACETS_GENERATION_CACHE]['LOCATION']
+        request = self.metadata[0].request_id
+        payload = [{**VALID_ROW, 'request': request, 'sample_id': f'LIST-{rows}-{n}'} for n in range(rows)]
+        with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/metadata/', payload, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        return [query['sql'] for query in queries if table in query['sql']]
+
+    def test_list_create_invalidates_once(self):
+        generation = facets._generation(Metadata)
+        one = self.generation_queries(1)
+        self.assertNotEqual(facets._generation(Metadata), generation)
+        self.assertEqual(len(self.generation_queries(50)), len(one))
+
+    def test_rolled_back_writes_do_not_swallow_later_invalidations(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with self.assertRaises(DatabaseError), transaction.atomic():
+                self.metadata[0].save()
+                raise DatabaseError
+        self.assertEqual(callbacks, [])
+        generation = facets._generation(Metadata)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.metadata[1].save()
+        self.assertNotEqual(facets._generation(Metadata), generation)
+
+
+class SampleCounterTests(TestCase):
+    """Request.tissue_count / aliquot_count al crear, mover de request y borrar"""
+
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user('owner', 'owner@example.org', 'x')
+        cls.first = make_request(user)
+        cls.second = make_request(requester=cls.first.requester, request_date=date(2024, 2, 10))
+        cls.metadata = make_metadata(cls.first)
+
+    def counts(self):
+        return [Request.objects.values_list('tissue_count', flat=True).get(pk=request.pk)
+                for request in (self.first, self.second)]
+
+    def test_create_move_and_delete(self):
+        Tissue.objects.create(request=self.first, metadata=self.metadata)
+        self.assertEqual(self.counts(), [1, 0])
+
+        # Instancia cargada de la base de datos: el request anterior se lee al guardar
+        tissue = Tissue.objects.get()
+        tissue.request = self.second
+        tissue.save()
+        self.assertEqual(self.counts(), [0, 1])
+        tissue.save()
+        self.assertEqual(self.counts(), [0, 1])
+
+        Tissue.objects.get().delete()
+        self.assertEqual(self.counts(), [0, 0])
+
+
+class AuditTests(TestCase):
+    """Historial por campo: el valor anterior se lee al guardar, no al cargar la instancia"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user('curator', 'curator@example.org', 'x', is_staff=True)
+        cls.request_obj = make_request(cls.staff)
+
+    def entries(self):
+        return list(AuditLog.objects.filter(model='shipment').order_by('pk').values_list('action', 'changes'))
+
+    def test_update_and_delete(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            shipment = Shipment.objects.create(request=self.request_obj, tracking_number='A-1')
+        client = APIClient()
+        client.force_authenticate(self.staff)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.patch(f'/api/shipments/{shipment.pk}/', {'tracking_number': 'B-2'}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+        # Cambiado en la base de datos después de cargar la instancia: se compara con lo guardado
+        shipment = Shipment.objects.get()
+        Shipment.objects.update(tracking_number='C-3')
+        shipment.tracking_number = 'D-4'
+        with self.captureOnCommitCallbacks(execute=True):
+            shipment.save()
+            Shipment.objects.get().delete()
+
+        actions = self.entries()
+        self.assertEqual([action for action, _ in actions], [
+            AuditLog.ACTION_CREATE, AuditLog.ACTION_UPDATE, AuditLog.ACTION_UPDATE, AuditLog.ACTION_DELETE,
+        ])
+        self.assertEqual(actions[1][1], {'tracking_number': ['A-1', 'B-2']})
+        self.assertEqual(actions[2][1], {'tracking_number': ['C-3', 'D-4']})
+        self.assertEqual(actions[3][1]['tracking_number'], ['D-4', None])
+
+
+class LoadCostTests(TestCase):
+    """Cargar instancias (listados, exportaciones) no dispara receptores: el estado previo se lee al guardar"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user('curator', 'curator@example.org', 'x', is_staff=True)
+        cls.request_obj = make_request(cls.staff)
+        cls.taxon = make_taxon()
+        cls.metadata = make_metadata(cls.request_obj, cls.taxon)
+
+    def test_no_receivers_run_when_loading(self):
+        for model in (Requester, Request, Metadata, Taxon, Shipment, Tissue, DnaAliquot):
+            self.assertFalse(post_init.has_listeners(model), model.__name__)
+
+    def test_list_queries_do_not_grow_with_the_page(self):
+        client = APIClient()
+        client.force_authenticate(self.staff)
+        Tissue.objects.bulk_create([Tissue(request=self.request_obj, metadata=self.metadata) for _ in range(5)])
+        client.get('/api/tissues/')  # cachés de la primera petición
+        with CaptureQueriesContext(connection) as few:
+            self.assertEqual(client.get('/api/tissues/').status_code, 200)
+        Tissue.objects.bulk_create([Tissue(request=self.request_obj, metadata=self.metadata) for _ in range(45)])
+        with CaptureQueriesContext(connection) as many:
+            self.assertEqual(client.get('/api/tissues/', {'limit': 50}).status_code, 200)
+        self.assertEqual(len(many), len(few))
+
+    def test_save_reads_the_stored_row_once(self):
+        tissue = Tissue.objects.create(request=self.request_obj, metadata=self.metadata)
+        tissue = Tissue.objects.get(pk=tissue.pk)
+        tissue.tissue_sample_storage_location = 'Box 1'
+        with CaptureQueriesContext(connection) as queries:
+            tissue.save()
+        # Contadores y auditoría comparten la lectura del snapshot
+        reads = [query['sql'] for query in queries if query['sql'].startswith('SELECT') and '"Tissue"' in query['sql']]
+        self.assertEqual(len(reads), 1)
+
+    def test_typeahead_follows_renames(self):
+        index = typeahead.get_index('scientific_name')
+        index.load()
+        taxon = Taxon.objects.get(pk=self.taxon.pk)
+        taxon.scientific_name = 'Bellis annua'
+        taxon.save()
+        self.assertEqual(index.lookup('bellis'), ['Bellis annua'])
+
+
+class AutocompleteTests(TestCase):
+    """Autocompletado: instituciones con el alcance de cada usuario y taxones por uso en Metadata"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user('curator', 'curator@example.org', 'x', is_staff=True)
+        cls.users = {}
+        for username, institution in (('ana', 'Botanic Garden Berlin'), ('bea', 'Botanischer Verein')):
+            user = User.objects.create_user(username, f'{username}@example.org', 'x')
+            make_requester(user, first_name=username, last_name='X', requester_institution=institution)
+            cls.users[username] = user
+
+    def setUp(self):
+        for name in typeahead.SOURCES:
+            typeahead.get_index(name).loaded_at = None
+
+    def complete(self, user, path, **params):
+        client = APIClient()
+        client.force_authenticate(user)
+        response = client.get(path, params)
+        self.assertEqual(response.status_code, 200)
+        return response.data['results']
+
+    def test_institutions_are_scoped_to_the_user(self):
+        self.assertEqual(self.complete(self.users['ana'], '/api/requesters/autocomplete/', q='bot'),
+                         ['Botanic Garden Berlin'])
+        self.assertEqual(self.complete(self.users['bea'], '/api/requesters/autocomplete/', q='bot'),
+                         ['Botanischer Verein'])
+        self.assertEqual(self.complete(self.staff, '/api/requesters/autocomplete/', q='bot'),
+                         ['Botanic Garden Berlin', 'Botanischer Verein'])
+
+    def test_taxa_are_ranked_by_metadata_usage(self):
+        request_obj = make_request(requester=Requester.objects.get(user=self.users['ana']))
+        used = make_taxon(scientific_name='Bellis used')
+        make_taxon(scientific_name='Bellis unused')
+        for original_sample_id in ('A-1', 'A-2'):
+            make_metadata(request_obj, used, original_sample_id=original_sample_id)
+        with self.settings(TYPEAHEAD_MAX_ENTRIES=1):
+            results = self.complete(self.staff, '/api/metadata/autocomplete/', q='bellis')
+        self.assertEqual(results, ['Bellis used'])
+        index = typeahead.get_index('scientific_name')
+        self.assertEqual(index.counts, {'Bellis used': 1})
+
+
+class TaxonTests(TestCase):
+    """Nombres del taxón en Taxonomy: filtros por nombre, get_or_create al escribir y sin N+1 al listar"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user('curator', 'curator@example.org', 'x', is_staff=True, is_superuser=True)
+        User.objects.filter(pk=cls.staff.pk).update(is_active=True)  # el admin exige una cuenta activa
+        cls.request_obj = make_request(cls.staff)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.staff)
+
+    def post(self, **changes):
+        row = {name: value for name, value in VALID_ROW.items() if value != ''}
+        response = self.client.post('/api/metadata/', {**row, **changes, 'request': self.request_obj.pk},
+                                    format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        return response.data
+
+    def test_writes_reuse_or_create_the_taxon(self):
+        first = self.post()
+        second = self.post(original_sample_id='B 10 0999999')
+        self.assertEqual(Taxon.objects.count(), 1)
+        self.assertEqual(second['scientific_name'], 'Bellis perennis')
+
+        response = self.client.patch(f"/api/metadata/{first['id']}/",
+                                     {'scientific_name': 'Bellis annua', 'interspecific_epithet': 'annua'},
+                                     format='json')
+        self.assertEqual(response.status_code, 200)
+        moved = Metadata.objects.select_related('taxon').get(pk=first['id'])
+        self.assertEqual((moved.taxon.genus, moved.scientific_name), ('Bellis', 'Bellis annua'))
+        self.assertEqual(Metadata.objects.get(pk=second['id']).scientific_name, 'Bellis perennis')
+        self.assertEqual(Taxon.objects.count(), 2)
+
+    def test_name_filters(self):
+        self.post()
+        self.post(original_sample_id='B 10 0999999', family='Poaceae', genus='Poa',
+                  scientific_name='Poa annua', interspecific_epithet='annua')
+        for params, expected in (({'family': 'Poaceae'}, ['Poa annua']), ({'genus': 'Bellis'}, ['Bellis perennis']),
+                                 ({'taxon_group': 'Plantae'}, ['Bellis perennis', 'Poa annua']),
+                                 ({'genus': 'Quercus'}, [])):
+            response = self.client.get('/api/metadata/', params)
+            self.assertEqual(response.status_code, 200)
+            results = response.data['results'] if isinstance(response.data, dict) else response.data
+            self.assertCountEqual([row['scientific_name'] for row in results], expected, params)
+
+    def test_admin_changelist_joins_the_taxon(self):
+        self.client.force_login(self.staff)
+        self.post()
+        with CaptureQueriesContext(connection) as few:
+            self.assertEqual(self.client.get('/admin/dna_storage_request/metadata/').status_code, 200)
+        for index in range(5):
+            self.post(original_sample_id=f'B 10 {index}', scientific_name=f'Bellis {index}')
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get('/admin/dna_storage_request/metadata/')
+        self.assertContains(response, 'Bellis 4 - B 10 4')
+        self.assertEqual(len(many), len(few))
+
+
+CODES_TEST_SEQUENCES = {
+    'dna_aliquot_qr_code': {'prefix': 'DQ', 'width': 10, 'block_size': 5},
+    'tissue_barcode': {'prefix': 'TB', 'width': 10, 'block_size': 5},
+}
+
+
+@override_settings(CODE_SEQUENCES=CODES_TEST_SEQUENCES)
+class CodeAllocatorTests(TransactionTestCase):
+    """Bloques reservados por proceso (fuera de transacción) y reservas a la medida (dentro)"""
+
+    def setUp(self):
+        self.allocator = codes.CodeAllocator('dna_aliquot_qr_code')
+
+    def blocks(self):
+        return list(CodeBlock.objects.order_by('start').values_list('start', 'end', 'used_up_to'))
+
+    def test_block_is_reused_across_calls(self):
+        self.assertEqual(self.allocator.allocate(3), ['DQ0000000001', 'DQ0000000002', 'DQ0000000003'])
+        self.assertEqual(self.allocator.allocate(2), ['DQ0000000004', 'DQ0000000005'])
+        self.assertEqual(self.blocks(), [(1, 6, None)])
+        # Bloque agotado: se cierra entero y se reserva otro
+        self.assertEqual(self.allocator.allocate(1), ['DQ0000000006'])
+        self.assertEqual(self.blocks(), [(1, 6, 6), (6, 11, None)])
+        # Más que block_size: el bloque nuevo se reserva a la medida de lo que falta
+        self.assertEqual(len(set(self.allocator.allocate(12))), 12)
+        self.assertEqual(self.blocks(), [(1, 6, 6), (6, 11, 11), (11, 19, None)])
+        self.assertEqual(CodeSequence.objects.get(name='dna_aliquot_qr_code').next_value, 19)
+
+    def test_release_records_unused_ranges(self):
+        self.allocator.allocate(2)
+        self.assertEqual(codes.unused_ranges('dna_aliquot_qr_code'), [])
+        self.allocator.release()
+        self.assertEqual(codes.unused_ranges('dna_aliquot_qr_code'), [(3, 6)])
+        # Otro proceso sigue después del bloque liberado, nunca dentro
+        self.assertEqual(codes.CodeAllocator('dna_aliquot_qr_code').allocate(1), ['DQ0000000006'])
+
+    def test_inside_a_transaction_the_block_is_exact(self):
+        with transaction.atomic():
+            self.assertEqual(self.allocator.allocate(2), ['DQ0000000001', 'DQ0000000002'])
+        self.assertIsNone(self.allocator.block)
+        self.assertEqual(self.blocks(), [(1, 3, 3)])
+        self.assertEqual(codes.unused_ranges('dna_aliquot_qr_code'), [])
+
+    def test_rollback_does_not_reuse_codes_outside(self):
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            self.allocator.allocate(2)
+            raise RuntimeError
+        self.assertEqual(self.allocator.allocate(1), ['DQ0000000001'])
+
+
+@override_settings(CODE_SEQUENCES=CODES_TEST_SEQUENCES)
+class BulkAliquotTests(TestCase):
+    """bulk.create_aliquots deja contadores, auditoría y eventos como el alta de uno en uno"""
+
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user('owner', 'owner@example.org', 'x')
+        cls.single = make_request(user)
+        cls.bulk = make_request(requester=cls.single.requester, request_date=date(2024, 2, 10))
+        cls.metadata = make_metadata(cls.single)
+        Tissue.objects.create(request=cls.single, metadata=cls.metadata)
+        Tissue.objects.create(request=cls.bulk, metadata=cls.metadata)
+
+    def test_first_value_continues_after_existing_codes(self):
+        for code in ('DQ0000000041', 'DQ0000000007', 'DQ-manual-99', 'DQZZ'):
+            DnaAliquot.objects.create(request=self.single, metadata=self.metadata, dna_aliquot_qr_code=code)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(codes.allocate('dna_aliquot_qr_code', 1), ['DQ0000000042'])
+        self.assertFalse([query for query in queries if 'REGEXP' in query['sql'].upper()])
+        # Con la secuencia creada ya no se recorren los códigos existentes
+        DnaAliquot.objects.create(request=self.single, metadata=self.metadata, dna_aliquot_qr_code='DQ0000000900')
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(codes.allocate('dna_aliquot_qr_code', 1), ['DQ0000000043'])
+        self.assertFalse([query for query in queries if '"DNA_aliquot"' in query['sql']])
+
+    def test_bulk_matches_single_create(self):
+        items = [{'metadata_id': self.metadata.pk, 'dna_aliquot_storage_location': f'Rack {index}'}
+                 for index in range(3)]
+        with self.captureOnCommitCallbacks(execute=True):
+            for item in items:
+                DnaAliquot.objects.create(request=self.single, metadata=self.metadata,
+                                          dna_aliquot_qr_code=codes.allocate('dna_aliquot_qr_code', 1)[0],
+                                          dna_aliquot_storage_location=item['dna_aliquot_storage_location'])
+        with self.captureOnCommitCallbacks(execute=True):
+            created = bulk.create_aliquots(self.bulk, None, items)
+        self.assertEqual([aliquot.dna_aliquot_storage_location for aliquot in created],
+                         ['Rack 0', 'Rack 1', 'Rack 2'])
+
+        counts = dict(Request.objects.filter(pk__in=[self.single.pk, self.bulk.pk])
+                      .values_list('pk', 'aliquot_count'))
+        self.assertEqual(counts, {self.single.pk: 3, self.bulk.pk: 3})
+        self.assertEqual(Request.objects.get(pk=self.bulk.pk).tissue_count, 1)
+
+        def audit_fields(request):
+            pks = DnaAliquot.objects.filter(request=request).values_list('pk', flat=True)
+            entries = AuditLog.objects.filter(model='dnaaliquot', object_id__in=pks)
+            self.assertEqual({entry.action for entry in entries}, {AuditLog.ACTION_CREATE})
+            self.assertEqual(len(entries), 3)
+            return {frozenset(entry.changes) for entry in entries}
+
+        self.assertEqual(audit_fields(self.bulk), audit_fields(self.single))
+
+        def change_events(request):
+            pks = DnaAliquot.objects.filter(request=request).values_list('pk', flat=True)
+            rows = ChangeEvent.objects.filter(model='dnaaliquot', object_id__in=pks)
+            self.assertEqual(len(rows), 3)
+            return {(row.action, row.owner_id, frozenset(row.payload)) for row in rows}
+
+        self.assertEqual(change_events(self.bulk), change_events(self.single))
+
+
+class JobQueueTests(TestCase):
+    """Cola de jobs: reclamo condicional, cancelación, reencolado, limpieza y tipos solo para staff"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('owner', 'owner@example.org', 'x')
+        cls.staff = User.objects.create_user('curator', 'curator@example.org', 'x', is_staff=True)
+
+    def setUp(self):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        self.root = Path(root.name)
+        override = self.settings(JOB_ROOT=self.root, JOB_PROGRESS_SECONDS=0)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def test_racing_claims_take_one_job_each(self):
+        first = Job.objects.create(user=self.user, kind='export-metadata')
+        real_now = timezone.now
+        rival = []
+
+        def racing_now():
+            # Otro worker reclama entre la lectura de candidatos y el UPDATE de este
+            if not rival:
+                rival.append(None)
+                rival[0] = jobs.claim_next()
+            return real_now()
+
+        with mock.patch.object(jobs.timezone, 'now', side_effect=racing_now):
+            claimed = jobs.claim_next()
+        self.assertEqual((rival[0], claimed), (first.pk, None))
+        self.assertEqual(Job.objects.get(pk=first.pk).attempts, 1)
+
+        second = Job.objects.create(user=self.user, kind='export-metadata')
+        third = Job.objects.create(user=self.user, kind='export-metadata')
+        rival.clear()
+        with mock.patch.object(jobs.timezone, 'now', side_effect=racing_now):
+            claimed = jobs.claim_next()
+        self.assertEqual((rival[0], claimed), (second.pk, third.pk))
+        self.assertEqual(set(Job.objects.values_list('status', 'attempts').distinct()),
+                         {(Job.STATUS_RUNNING, 1)})
+
+    def test_progress_after_cancel_interrupts_the_handler(self):
+        job = Job.objects.create(user=self.user, kind='export-metadata')
+        jobs.claim_next()
+        job.refresh_from_db()
+        progress = jobs.JobProgress(job)
+        progress.update(1, total=10)
+        self.assertEqual(jobs.cancel(job), 1)
+        with self.assertRaises(jobs.JobCancelled):
+            progress.update(2)
+
+    def test_cancelled_job_keeps_its_status_and_drops_the_result(self):
+        job = Job.objects.create(user=self.user, kind='export-metadata')
+        jobs.claim_next()
+
+        def handler(job, progress):
+            with progress.open_result('out.csv') as fh:
+                fh.write('a\n')
+            jobs.cancel(job)
+            progress.update(1)
+
+        with mock.patch.dict(jobs.JOB_KINDS, {'export-metadata': {'handler': handler}}), \
+                mock.patch.object(jobs, 'connection'):
+            jobs.run_job(job.pk)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.STATUS_CANCELLED)
+        self.assertFalse(jobs.result_path(job).exists())
+
+    def test_requeue_stale_respects_max_attempts(self):
+        old = timezone.now() - timedelta(seconds=settings.JOB_STALE_SECONDS + 1)
+        retried = Job.objects.create(user=self.user, kind='export-metadata', status=Job.STATUS_RUNNING,
+                                     attempts=1, heartbeat_at=old)
+        exhausted = Job.objects.create(user=self.user, kind='export-metadata', status=Job.STATUS_RUNNING,
+                                       attempts=settings.JOB_MAX_ATTEMPTS, heartbeat_at=old)
+        alive = Job.objects.create(user=self.user, kind='export-metadata', status=Job.STATUS_RUNNING,
+                                   attempts=1, heartbeat_at=timezone.now())
+        self.assertEqual(jobs.requeue_stale(), (1, 1))
+        statuses = dict(Job.objects.values_list('pk', 'status'))
+        self.assertEqual(statuses, {retried.pk: Job.STATUS_QUEUED, exhausted.pk: Job.STATUS_FAILED,
+                                    alive.pk: Job.STATUS_RUNNING})
+
+    def test_prune_removes_old_jobs_and_orphan_directories(self):
+        long_ago = timezone.now() - timedelta(days=settings.JOB_RETENTION_DAYS + 1)
+        old = Job.objects.create(user=self.user, kind='export-metadata', status=Job.STATUS_SUCCEEDED,
+                                 finished_at=long_ago)
+        recent = Job.objects.create(user=self.user, kind='export-metadata', status=Job.STATUS_SUCCEEDED,
+                                    finished_at=timezone.now())
+        orphan, pending = uuid.uuid4(), uuid.uuid4()
+        for pk in (old.pk, recent.pk, orphan, pending):
+            jobs.job_dir(pk).mkdir(parents=True)
+        stale = time.time() - settings.JOB_STALE_SECONDS - 1
+        os.utime(jobs.job_dir(orphan), (stale, stale))
+        self.assertEqual(jobs.prune_finished(), 1)
+        self.assertEqual(list(Job.objects.values_list('pk', flat=True)), [recent.pk])
+        self.assertEqual({path.name for path in self.root.iterdir()}, {recent.pk.hex, pending.hex})
+
+    def test_failed_enqueue_leaves_no_input_file(self):
+        class BrokenUpload(io.BytesIO):
+            def chunks(self, size):
+                yield b'original_sample_id\n'
+                raise OSError('conexión cortada')
+
+        with self.assertRaises(OSError):
+            jobs.enqueue(self.user, 'validate-manifest', input_file=BrokenUpload())
+        self.assertFalse(Job.objects.exists())
+        self.assertEqual(list(self.root.iterdir()), [])
+
+    def test_staff_only_kinds(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.post('/api/jobs/', {'kind': 'rebuild-sample-counts'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('kind', response.data)
+        self.assertEqual(client.post('/api/jobs/', {'kind': 'export-metadata'}, format='json').status_code, 201)
+        client.force_authenticate(self.staff)
+        response = client.post('/api/jobs/', {'kind': 'rebuild-sample-counts'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Job.objects.filter(kind='rebuild-sample-counts').get().user, self.staff)
+
+
+class ReconciliationTests(TestCase):
+    """Reconciliación de is_in_jacq con un export: coincidencias, ausentes en cada lado y opciones de lectura"""
+
+    # tissue_barcode -> is_in_jacq antes de reconciliar
+    FLAGS = {'TB-1': 0, 'TB-2': 1, 'TB-3': 1, 'TB-4': None}
+    # TB-1 y TB-2 están en el export (con otro formato), XX-9 solo en el export
+    EXPORT = 'sheet;barcode\na; tb-1 \nb;TB-2\nc;XX-9\nd;TB-2\ne;\n'
+
+    @classmethod
+    def setUpTestData(cls):
+        request_obj = make_request(User.objects.create_user('owner', 'owner@example.org', 'x'))
+        metadata = make_metadata(request_obj)
+        for barcode, flag in cls.FLAGS.items():
+            Tissue.objects.create(request=request_obj, metadata=metadata, tissue_barcode=barcode, is_in_jacq=flag)
+        Tissue.objects.create(request=request_obj, metadata=metadata)  # sin código: no se compara
+
+    def reconcile(self, **options):
+        options = {'column': 1, 'delimiter': ';', 'has_header': True, 'chunk_size': 2, **options}
+        with self.captureOnCommitCallbacks(execute=True):
+            return reconciliation.reconcile('jacq', io.StringIO(self.EXPORT), **options)
+
+    def flags(self):
+        return dict(Tissue.objects.exclude(tissue_barcode=None).values_list('tissue_barcode', 'is_in_jacq'))
+
+    def test_report_and_updates(self):
+        report = self.reconcile()
+        self.assertEqual(
+            {key: report[key] for key in ('export_codes', 'checked', 'added', 'removed', 'unknown_in_export')},
+            {'export_codes': 4, 'checked': 4, 'added': 1, 'removed': 1, 'unknown_in_export': 1},
+        )
+        self.assertEqual((report['added_sample'], report['removed_sample']), (['TB-1'], ['TB-3']))
+        self.assertEqual(self.flags(), {'TB-1': 1, 'TB-2': 1, 'TB-3': 0, 'TB-4': None})
+        changes = sorted(AuditLog.objects.filter(model='tissue').values_list('changes', flat=True),
+                         key=lambda change: change['is_in_jacq'][1])
+        self.assertEqual(changes, [{'is_in_jacq': [1, 0]}, {'is_in_jacq': [0, 1]}])
+        # Segunda pasada: nada que cambiar
+        report = self.reconcile()
+        self.assertEqual((report['added'], report['removed']), (0, 0))
+
+    def test_dry_run_reports_without_updating(self):
+        report = self.reconcile(dry_run=True)
+        self.assertEqual((report['added'], report['removed'], report['dry_run']), (1, 1, True))
+        self.assertEqual(self.flags(), self.FLAGS)
+        self.assertFalse(AuditLog.objects.exists())
+
+    def test_reading_options(self):
+        # Sin saltar la cabecera, 'BARCODE' cuenta como código del export
+        report = self.reconcile(has_header=False, dry_run=True)
+        self.assertEqual((report['export_codes'], report['unknown_in_export']), (5, 2))
+        # Otra columna: ningún código coincide
+        report = self.reconcile(column=0, dry_run=True)
+        self.assertEqual((report['added'], report['removed'], report['unknown_in_export']), (0, 2, 5))
+        # Con el delimitador por defecto cada fila es una sola columna
+        report = self.reconcile(delimiter=',', column=0, dry_run=True)
+        self.assertEqual((report['added'], report['removed']), (0, 2))
+
+    def test_command_prints_the_report(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as fh:
+            fh.write(self.EXPORT)
+        self.addCleanup(os.unlink, fh.name)
+        out = io.StringIO()
+        call_command('reconcile_registry', 'jacq', fh.name, '--column', '1', '--delimiter', ';',
+                     '--has-header', '--dry-run', stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertEqual((report['added'], report['removed'], report['unknown_in_export']), (1, 1, 1))
+
+    def test_code_set_across_runs(self):
+        codes = reconciliation.RegistryCodeSet.from_codes(['A', 'B', 'A', 'C', 'D', 'B'], run_size=2)
+        self.assertEqual((codes.total, len(codes.runs)), (6, 3))
+        self.assertTrue(codes.contains(reconciliation.code_hash('B')))
+        self.assertFalse(codes.contains(reconciliation.code_hash('E')))
+        # B aparece en dos runs: marcado en ambos, no se cuenta como sin coincidencia
+        self.assertEqual(codes.unmatched_count(), 3)
+
+
+class DuplicateTests(TestCase):
+    """Claves de muestra normalizadas, clusters por union-find y altas en lote con '_duplicates'"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = {}
+        for username in ('ana', 'bea'):
+            user = User.objects.create_user(username, f'{username}@example.org', 'x')
+            requester = make_requester(user, first_name=username, last_name='X')
+            cls.users[username] = (user, make_request(requester=requester))
+        cls.taxon = make_taxon()
+
+    def create(self, username='ana', **changes):
+        return make_metadata(self.users[username][1], self.taxon, **changes)
+
+    def test_keys_normalize_identifiers_and_coordinates(self):
+        key = duplicates.duplicate_key('AB-0012 ', '52.45540000', '13.30500000', date(2023, 5, 17))
+        self.assertEqual(duplicates.duplicate_key('ab0012', '52.45541234', '13.305049', '2023-05-17'), key)
+        self.assertEqual(duplicates.duplicate_key('a.b/00 12', '52.4554', '13.3050', '2023-05-17'), key)
+        self.assertNotEqual(duplicates.duplicate_key('ab0012', '52.4556', '13.3050', '2023-05-17'), key)
+        self.assertNotEqual(duplicates.duplicate_key('ab0013', '52.4554', '13.3050', '2023-05-17'), key)
+        self.assertEqual(duplicates.duplicate_key(' - ', '52.4554', '13.3050', '2023-05-17'), '')
+
+    def test_keys_are_stored_on_save(self):
+        metadata = self.create(original_sample_id='AB-0012', decimal_latitude='52.45541234')
+        self.assertEqual(metadata.sample_key, duplicates.keys_for({
+            'original_sample_id': 'ab0012', 'decimal_latitude': '52.4554',
+            'decimal_longitude': VALID_ROW['decimal_longitude'], 'date_of_collection': '2023-05-17',
+        })['sample_key'])
+
+    def test_clusters_are_transitive(self):
+        first = self.create(original_sample_id='S-1', collector_sample_id='C-1')
+        # Comparte sample_key con la primera y collector_key con la tercera
+        second = self.create(original_sample_id='s1', collector_sample_id='C-2')
+        third = self.create(original_sample_id='S-3', collector_sample_id='c 2')
+        self.create(original_sample_id='S-4', collector_sample_id='C-4')
+        pair = [self.create(original_sample_id='S-5', collector_sample_id='C-5') for _ in range(2)]
+        self.assertEqual(duplicates.duplicate_clusters(),
+                         [[first.pk, second.pk, third.pk], sorted(metadata.pk for metadata in pair)])
+
+        clusters = duplicates._Clusters()
+        clusters.union([1, 2])
+        clusters.union([3, 4])
+        clusters.union([2, 3])
+        clusters.union([5])
+        self.assertCountEqual(clusters.groups(), [[1, 2, 3, 4], [5]])
+
+    def test_create_accepts_a_list(self):
+        existing_own = self.create(original_sample_id='S-1', collector_sample_id='C-9')
+        self.create('bea', original_sample_id='S-1', collector_sample_id='C-8')
+        user, request_obj = self.users['ana']
+        rows = [{**VALID_ROW, 'request': request_obj.pk, 'original_sample_id': sample_id,
+                 'collector_sample_id': collector_id}
+                for sample_id, collector_id in (('s 1', 'C-1'), ('S-2', 'C-2'), ('S2', 'C-3'))]
+        rows = [{name: value for name, value in row.items() if value != ''} for row in rows]
+        client = APIClient()
+        client.force_authenticate(user)
+        response = client.post('/api/metadata/', rows, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(len(response.data), 3)
+        self.assertEqual(response.data[0]['_duplicates'],
+                         {'in_batch': [], 'existing': [existing_own.pk], 'existing_other_owners': 1})
+        self.assertEqual(response.data[1]['_duplicates'],
+                         {'in_batch': [2], 'existing': [], 'existing_other_owners': 0})
+        self.assertEqual(response.data[2]['_duplicates']['in_batch'], [1])
+        self.assertEqual(Metadata.objects.filter(request=request_obj).count(), 4)
+
+        # Un lote con una fila inválida no crea ninguna
+        response = client.post('/api/metadata/', [rows[0], {**rows[1], 'decimal_latitude': '91'}], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Metadata.objects.filter(request=request_obj).count(), 4)
+
+
+def parse_pdf(data):
+    """
+    Comprobar la estructura de un PDF de LabelSheet: cada entrada de la xref
+    apunta a su objeto y startxref a la tabla. Devuelve {número: cuerpo}.
+    """
+    assert data.startswith(b'%PDF-1.4\n') and data.endswith(b'%%EOF\n')
+    xref_at = int(data.rsplit(b'startxref\n', 1)[1].split(b'\n', 1)[0])
+    assert data[xref_at:].startswith(b'xref\n0 ')
+    lines = data[xref_at:].split(b'\n')
+    size = int(lines[1].split()[1])
+    entries = lines[2:2 + size]
+    assert entries[0] == b'0000000000 65535 f '
+    assert f'/Size {size} '.encode('ascii') in data[xref_at:]
+    objects = {}
+    for number, entry in enumerate(entries[1:], 1):
+        offset = int(entry.split()[0])
+        start = f'{number} 0 obj\n'.encode('ascii')
+        assert data[offset:offset + len(start)] == start, number
+        objects[number] = data[offset + len(start):data.index(b'\nendobj\n', offset)]
+    return objects
+
+
+@override_settings(LABEL_POOL_THRESHOLD=10 ** 6)
+class LabelTests(TestCase):
+    """Code 128, estructura del PDF en streaming y límite de etiquetas por hoja"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user('curator', 'curator@example.org', 'x', is_staff=True)
+        cls.request_obj = make_request(cls.staff)
+        metadata = make_metadata(cls.request_obj)
+        cls.per_page = labelrender.LabelSheet(**settings.LABEL_SHEET).per_page
+        cls.count = 2 * cls.per_page + 3
+        Tissue.objects.bulk_create([
+            Tissue(request=cls.request_obj, metadata=metadata, tissue_barcode=f'TB{index:010d}')
+            for index in range(cls.count)
+        ] + [Tissue(request=cls.request_obj, metadata=metadata)])  # sin código: sin etiqueta
+
+    def setUp(self):
+        caches[settings.LABEL_CACHE].clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.staff)
+
+    @staticmethod
+    def code128_values(text):
+        """Valores de los símbolos (inicio, datos, control, stop) releídos de los anchos"""
+        widths = ''.join(str(width) for width in labelrender.code128_widths(text))
+        by_pattern = {pattern: value for value, pattern in enumerate(labelrender.CODE128_PATTERNS)}
+        symbols = [widths[start:start + 6] for start in range(0, len(widths) - 7, 6)] + [widths[-7:]]
+        return [by_pattern[symbol] for symbol in symbols]
+
+    @staticmethod
+    def page_content(objects, page):
+        content_id = int(page.split(b'/Contents ')[1].split()[0])
+        stream_body = objects[content_id].split(b'stream\n', 1)[1].rsplit(b'\nendstream', 1)[0]
+        return zlib.decompress(stream_body)
+
+    def test_code128_check_symbol(self):
+        # Juego B: 104 + 48·1 + 42·2 + 42·3 + 17·4 + 18·5 + 19·6 + 35·7 = 879 ≡ 55 (mod 103)
+        self.assertEqual(self.code128_values('PJJ123C'), [104, 48, 42, 42, 17, 18, 19, 35, 55, 106])
+        # Juego C (numérico par): 105 + 12·1 + 34·2 + 56·3 = 353 ≡ 44 (mod 103)
+        self.assertEqual(self.code128_values('123456'), [105, 12, 34, 56, 44, 106])
+        # Cada símbolo suma 11 módulos (el stop 13)
+        self.assertEqual(sum(labelrender.code128_widths('123456')), 11 * 5 + 13)
+        with self.assertRaises(ValueError):
+            labelrender.code128_widths('TB-é')
+
+    def test_streamed_pdf_has_one_label_per_code(self):
+        response = self.client.get('/api/tissues/labels/', {'request': self.request_obj.pk})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['X-Label-Count'], str(self.count))
+        chunks = list(response.streaming_content)
+        # Cabecera, una por página y el final con catálogo y xref
+        self.assertEqual(len(chunks), 1 + 3 + 1)
+        objects = parse_pdf(b''.join(chunks))
+
+        pages = [body for body in objects.values() if body.startswith(b'<< /Type /Page ')]
+        self.assertEqual(len(pages), 3)
+        self.assertIn(b'/Count 3 ', objects[2])
+        contents = [self.page_content(objects, page) for page in pages]
+        # Tres textos por etiqueta (código, muestra, taxón)
+        self.assertEqual([content.count(b'BT ') // 3 for content in contents], [self.per_page, self.per_page, 3])
+        self.assertTrue(all(b' re\n' in content for content in contents))
+        self.assertIn(b'(TB0000000000) Tj', contents[0])
+
+    def test_empty_selection_is_a_single_blank_page(self):
+        objects = parse_pdf(b''.join(labelrender.LabelSheet(**settings.LABEL_SHEET).pages([])))
+        self.assertIn(b'/Count 1 ', objects[2])
+
+    def test_too_many_labels(self):
+        with self.settings(LABEL_MAX_LABELS=self.count - 1):
+            response = self.client.get('/api/tissues/labels/', {'request': self.request_obj.pk})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(str(self.count), response.data['detail'])
+        with self.settings(LABEL_MAX_LABELS=self.count):
+            response = self.client.get('/api/tissues/labels/', {'request': self.request_obj.pk})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get('/api/tissues/labels/').status_code, 400)
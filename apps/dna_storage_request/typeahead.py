@@ -0,0 +1,176 @@
+# typeahead.py - Índices de prefijos en memoria para autocompletar nombres e instituciones
+import threading
+import time
+from bisect import bisect_left, insort
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Count
+from django.db.models.signals import post_save, post_delete
+
+from . import snapshots
+from .models import Requester, Taxon
+
+# nombre público -> (modelo, campo, uso). Con TYPEAHEAD_MAX_ENTRIES se quedan
+# los valores con más uso: los taxones por las filas de Metadata que los citan
+SOURCES = {
+    'scientific_name': (Taxon, 'scientific_name', 'metadata'),
+    'genus': (Taxon, 'genus', 'metadata'),
+    'family': (Taxon, 'family', 'metadata'),
+    'requester_institution': (Requester, 'requester_institution', 'pk'),
+}
+# Separa la clave normalizada del valor mostrado dentro de cada entrada
+SEPARATOR = '\x00'
+
+
+def normalize(value):
+    return value.strip().casefold().replace(SEPARATOR, '')
+
+
+class PrefixIndex:
+    """
+    Valores distintos de un campo como una lista ordenada de cadenas
+    "clave\\0valor": la búsqueda por prefijo es un bisect más un recorrido
+    corto. Se carga al primer uso, se actualiza con las escrituras del proceso
+    y se recarga en segundo plano cada TYPEAHEAD_REFRESH_SECONDS para recoger
+    las de otros workers. Como mucho TYPEAHEAD_MAX_ENTRIES valores (los más usados).
+    """
+
+    def __init__(self, model, field, usage='pk'):
+        self.model = model
+        self.field = field
+        self.usage = usage
+        self.entries = []
+        self.counts = {}
+        self.loaded_at = None
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    @staticmethod
+    def _entry(value):
+        return f'{normalize(value)}{SEPARATOR}{value}'
+
+    def _read(self):
+        # counts: filas del modelo con cada valor (para quitarlo al renombrar o
+        # borrar la última); el uso solo decide qué valores entran
+        rows = (
+            self.model.objects.exclude(**{self.field: ''}).exclude(**{f'{self.field}__isnull': True})
+            .values_list(self.field)
+            .annotate(n=Count('pk', distinct=True), uses=Count(self.usage))
+            .order_by('-uses', '-n')[:settings.TYPEAHEAD_MAX_ENTRIES]
+        )
+        counts = {value: n for value, n, _ in rows}
+        return sorted(self._entry(value) for value in counts), counts
+
+    def load(self):
+        entries, counts = self._read()
+        with self._lock:
+            self.entries, self.counts = entries, counts
+            self.loaded_at = time.monotonic()
+
+    def _refresh_in_background(self):
+        def run():
+            try:
+                self.load()
+            finally:
+                self._refreshing = False
+                connection.close()
+        self._refreshing = True
+        threading.Thread(target=run, name=f'typeahead-{self.field}', daemon=True).start()
+
+    def ensure_loaded(self):
+        if self.loaded_at is None:
+            self.load()
+        elif (not self._refreshing
+              and time.monotonic() - self.loaded_at > settings.TYPEAHEAD_REFRESH_SECONDS):
+            self._refresh_in_background()
+
+    def lookup(self, prefix, limit=10):
+        self.ensure_loaded()
+        key = normalize(prefix)
+        results = []
+        with self._lock:
+            index = bisect_left(self.entries, key)
+            while index < len(self.entries) and len(results) < limit:
+                entry = self.entries[index]
+                if not entry.startswith(key):
+                    break
+                results.append(entry.split(SEPARATOR, 1)[1])
+                index += 1
+        return results
+
+    def add(self, value):
+        if not value:
+            return
+        with self._lock:
+            if value in self.counts:
+                self.counts[value] += 1
+            elif len(self.counts) < settings.TYPEAHEAD_MAX_ENTRIES:
+                self.counts[value] = 1
+                insort(self.entries, self._entry(value))
+
+    def remove(self, value):
+        with self._lock:
+            if value not in self.counts:
+                return
+            self.counts[value] -= 1
+            if self.counts[value] <= 0:
+                del self.counts[value]
+                entry = self._entry(value)
+                index = bisect_left(self.entries, entry)
+                if index < len(self.entries) and self.entries[index] == entry:
+                    del self.entries[index]
+
+
+def lookup_queryset(queryset, field, prefix, limit=10):
+    """Valores distintos de field en queryset que empiezan por prefix, consultando la base de datos"""
+    values = (
+        queryset.filter(**{f'{field}__istartswith': prefix.strip()})
+        .order_by(field).values_list(field, flat=True).distinct()[:limit]
+    )
+    return list(values)
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(name):
+    if name not in _indexes:
+        with _indexes_lock:
+            if name not in _indexes:
+                _indexes[name] = PrefixIndex(*SOURCES[name])
+    return _indexes[name]
+
+
+def _loaded_indexes(model):
+    return [
+        index for index in list(_indexes.values())
+        if index.model is model and index.loaded_at is not None
+    ]
+
+
+def _saved(sender, instance, created, raw=False, **kwargs):
+    # Valor anterior leído al guardar (snapshots), no al cargar cada instancia
+    previous = {} if created else snapshots.stored_values(instance)
+    for index in _loaded_indexes(sender):
+        value = getattr(instance, index.field)
+        if created:
+            index.add(value)
+        elif index.field not in previous:
+            # Fila no encontrada al guardar: valor anterior desconocido
+            index.loaded_at = None
+        elif previous[index.field] != value:
+            index.remove(previous[index.field])
+            index.add(value)
+
+
+def _deleted(sender, instance, **kwargs):
+    for index in _loaded_indexes(sender):
+        index.remove(getattr(instance, index.field))
+
+
+for _model in {model for model, *_ in SOURCES.values()}:
+    snapshots.track(_model)
+    post_save.connect(_saved, sender=_model, dispatch_uid=f'typeahead_save_{_model.__name__}')
+    post_delete.connect(_deleted, sender=_model, dispatch_uid=f'typeahead_delete_{_model.__name__}')
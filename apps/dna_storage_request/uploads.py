@@ -0,0 +1,225 @@
+# uploads.py - Almacenamiento en disco local para las subidas por partes
+import fcntl
+import hashlib
+import os
+import re
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.conf import settings
+from django.db import transaction
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.http import content_disposition_header
+from django.utils.text import get_valid_filename
+
+from . import audit
+from .models import Upload, Request, Metadata
+
+# Tamaño de lectura/escritura: nunca se tiene un chunk completo en memoria
+BLOCK_SIZE = 64 * 1024
+
+_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def upload_root():
+    return Path(settings.UPLOAD_ROOT)
+
+
+def part_path(upload):
+    return upload_root() / 'partial' / f'{upload.pk.hex}.part'
+
+
+def lock_path(upload):
+    return upload_root() / 'partial' / f'{upload.pk.hex}.lock'
+
+
+@contextmanager
+def chunk_lock(upload):
+    """
+    Cerrojo exclusivo del fichero parcial mientras se escribe un chunk.
+    Devuelve False sin esperar si otro PATCH de la misma subida lo tiene:
+    el offset se comprueba y se escribe con el cerrojo cogido, así dos
+    chunks en el mismo offset nunca se pisan. Al terminar la subida se
+    borra el fichero de cerrojo (quien lo abra después ve el estado final).
+    """
+    path = lock_path(upload)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w') as fh:
+        try:
+            fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            if upload.status != Upload.STATUS_PENDING:
+                path.unlink(missing_ok=True)
+
+
+def stored_path(relative):
+    """Ruta absoluta de un fichero ya completado (relative viene de storage_path)"""
+    root = upload_root().resolve()
+    path = (root / relative).resolve()
+    if root not in path.parents:
+        raise ValueError('Ruta fuera de UPLOAD_ROOT')
+    return path
+
+
+def _relative_name(upload, max_length):
+    """'<uuid>/<nombre>' recortando el nombre para que quepa en el campo destino"""
+    prefix = f'{upload.pk.hex}/'
+    name = get_valid_filename(upload.filename) or 'file'
+    room = max_length - len(prefix)
+    if len(name) > room:
+        stem, ext = os.path.splitext(name)
+        if len(ext) >= room:
+            ext = ''
+        name = stem[:room - len(ext)] + ext
+    return prefix + name
+
+
+def write_chunk(upload, offset, stream, length):
+    """
+    Copiar hasta `length` bytes de `stream` al fichero parcial a partir de
+    `offset`. Devuelve (bytes escritos, sha256 del chunk). Si el cliente corta
+    la conexión se conserva lo recibido, así la subida se puede reanudar.
+    """
+    path = part_path(upload)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    digest = hashlib.sha256()
+    written = 0
+    with open(path, 'r+b' if path.exists() else 'wb') as fh:
+        fh.seek(offset)
+        fh.truncate()
+        while written < length:
+            block = stream.read(min(BLOCK_SIZE, length - written))
+            if not block:
+                break
+            fh.write(block)
+            digest.update(block)
+            written += len(block)
+    return written, digest.hexdigest()
+
+
+def truncate_part(upload, offset):
+    """Descartar lo escrito después de `offset` (chunk rechazado)"""
+    path = part_path(upload)
+    if path.exists():
+        with open(path, 'r+b') as fh:
+            fh.truncate(offset)
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for block in iter(lambda: fh.read(BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def complete_upload(upload):
+    """
+    Verificar el checksum del fichero completo, moverlo a su ruta definitiva y
+    rellenar el campo de ruta del Request/Metadata. Devuelve False si el
+    checksum no coincide (la subida queda como fallida).
+    """
+    part = part_path(upload)
+    if file_sha256(part) != upload.checksum:
+        part.unlink(missing_ok=True)
+        upload.status = Upload.STATUS_FAILED
+        upload.save(update_fields=['status', 'updated_at'])
+        return False
+
+    owner, field = Upload.TARGET_FIELDS[upload.target]
+    model = Request if owner == 'request' else Metadata
+    relative = _relative_name(upload, model._meta.get_field(field).max_length)
+    destination = upload_root() / relative
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    os.replace(part, destination)
+
+    changes = {field: relative, 'updated_at': timezone.now()}
+    if upload.target == Upload.TARGET_MANIFEST:
+        changes['has_manifest_file'] = 1
+    target_pk = getattr(upload, f'{owner}_id')
+    with transaction.atomic():
+        upload.status = Upload.STATUS_COMPLETE
+        upload.storage_path = relative
+        upload.save(update_fields=['status', 'storage_path', 'updated_at'])
+        if model in audit.AUDITED_MODELS:
+            previous = model.objects.filter(pk=target_pk).values_list(field, flat=True).first()
+            audit.record_bulk_update(model, [(target_pk, previous)], field, relative)
+        model.objects.filter(pk=target_pk).update(**changes)
+    return True
+
+
+def parse_range(header, size):
+    """
+    Interpretar una cabecera Range de un solo rango. Devuelve (inicio, fin)
+    inclusivos, None si no hay rango utilizable (se sirve el fichero completo).
+    """
+    if not header:
+        return None
+    match = _RANGE_RE.match(header.strip())
+    if not match:
+        return None
+    start, end = match.groups()
+    if start == '' and end == '':
+        return None
+    if start == '':
+        # bytes=-N: los últimos N bytes
+        length = int(end)
+        if length == 0:
+            raise RangeNotSatisfiable()
+        return max(size - length, 0), size - 1
+    start = int(start)
+    end = size - 1 if end == '' else min(int(end), size - 1)
+    if start >= size or start > end:
+        raise RangeNotSatisfiable()
+    return start, end
+
+
+def _iter_file_range(fh, start, length):
+    try:
+        fh.seek(start)
+        remaining = length
+        while remaining > 0:
+            block = fh.read(min(BLOCK_SIZE, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            yield block
+    finally:
+        fh.close()
+
+
+def file_download_response(path, filename, range_header=None):
+    """Respuesta en streaming del fichero, con soporte de Range (206)"""
+    size = path.stat().st_size
+    try:
+        byte_range = parse_range(range_header, size)
+    except RangeNotSatisfiable:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    if byte_range is None:
+        response = FileResponse(open(path, 'rb'), as_attachment=True, filename=filename)
+    else:
+        start, end = byte_range
+        length = end - start + 1
+        response = StreamingHttpResponse(
+            _iter_file_range(open(path, 'rb'), start, length),
+            status=206,
+            content_type='application/octet-stream',
+        )
+        response['Content-Length'] = str(length)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Disposition'] = content_disposition_header(True, filename)
+    response['Accept-Ranges'] = 'bytes'
+    return response
@@ -2,6 +2,7 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from . import views
+from .stream import change_stream_view
 
 # Configurar router con ViewSets (tu configuración original)
 router = DefaultRouter()
@@ -11,6 +12,11 @@ router.register(r'metadata', views.MetadataViewSet)
 router.register(r'shipments', views.ShipmentViewSet)
 router.register(r'tissues', views.TissueViewSet)
 router.register(r'dna-aliquots', views.DnaAliquotViewSet)
+router.register(r'uploads', views.UploadViewSet)
+router.register(r'jobs', views.JobViewSet)
 
 # Usar las rutas del router
-urlpatterns = router.urls
\ No newline at end of file
+urlpatterns = router.urls + [
+    # Stream SSE de cambios (vista async, servir con ASGI)
+    path('stream/changes/', change_stream_view, name='change-stream'),
+]
\ No newline at end of file
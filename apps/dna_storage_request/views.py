@@ -1,17 +1,396 @@
 # views.py - Actualizado con filtros por usuario y autenticación
-from rest_framework import viewsets, status, filters
+import csv
+import io
+import json
+from rest_framework import viewsets, mixins, status, filters
 from rest_framework.decorators import action
+from rest_framework.pagination import CursorPagination
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, IsAdminUser, SAFE_METHODS
+from rest_framework.exceptions import ValidationError
+from rest_framework.utils.encoders import JSONEncoder
 from django_filters.rest_framework import DjangoFilterBackend
+from django.db import IntegrityError, transaction
 from django.db.models import Q
-from .models import Requester, Request, Metadata, Shipment, Tissue, DnaAliquot
+from django.utils import timezone
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.http import Http404, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from apps.authentication.models import is_unique_violation
+from .models import Requester, Request, Metadata, Shipment, Tissue, DnaAliquot, Upload, AuditLog, Job
 from .serializers import (
     RequesterSerializer, RequestSerializer, MetadataSerializer,
-    ShipmentSerializer, TissueSerializer, DnaAliquotSerializer
+    ShipmentSerializer, TissueSerializer, DnaAliquotSerializer, DnaAliquotBulkSerializer, UploadSerializer,
+    AuditLogSerializer, JobSerializer
 )
+from . import archive, bulk, idempotency, jobs, labels, manifest, routers, typeahead, uploads
+from .duplicates import describe_clusters, duplicate_clusters, flag_duplicates
+from .facets import facet_counts
+from .filters import AliasOrderingFilter, ArchivedMetadataFilter, MetadataFilter
+from .reconciliation import reconcile
+from .sync import SyncCursor, changed_since, deleted_since, horizon, tombstone_filters
 
-class RequesterViewSet(viewsets.ModelViewSet):
+def _reconcile_response(request, registry):
+    """Ejecutar la reconciliación con el export subido como 'file' (multipart)"""
+    export = request.FILES.get('file')
+    if export is None:
+        return Response({'file': ['Este campo es obligatorio.']}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        column = int(request.data.get('column', 0))
+    except (TypeError, ValueError):
+        return Response({'column': ['Debe ser un número entero.']}, status=status.HTTP_400_BAD_REQUEST)
+    # UploadedFile se lee por líneas desde disco/memoria sin cargarlo entero
+    lines = io.TextIOWrapper(export.file, encoding='utf-8', newline='')
+    report = reconcile(
+        registry, lines,
+        column=column,
+        delimiter=request.data.get('delimiter', ','),
+        has_header=str(request.data.get('has_header', '')).lower() in ('1', 'true'),
+        dry_run=str(request.data.get('dry_run', '')).lower() in ('1', 'true'),
+    )
+    return Response(report)
+
+def _manifest_response(request):
+    """Validar el manifest subido como 'file' (multipart) o el de una subida completa ('upload')"""
+    export = request.FILES.get('file')
+    upload_id = request.data.get('upload')
+    if export is None and not upload_id:
+        return Response({'file': ['Este campo es obligatorio.']}, status=status.HTTP_400_BAD_REQUEST)
+    if export is not None:
+        lines = io.TextIOWrapper(export.file, encoding='utf-8-sig', newline='')
+    else:
+        uploads_qs = Upload.objects.filter(target=Upload.TARGET_MANIFEST, status=Upload.STATUS_COMPLETE)
+        if not request.user.is_staff:
+            uploads_qs = uploads_qs.filter(request__requester__user=request.user)
+        try:
+            upload = uploads_qs.get(pk=upload_id)
+        except (Upload.DoesNotExist, DjangoValidationError):
+            return Response({'upload': ['No existe un manifest completo con este id.']},
+                            status=status.HTTP_400_BAD_REQUEST)
+        lines = open(uploads.stored_path(upload.storage_path), encoding='utf-8-sig', newline='')
+    try:
+        with lines:
+            report = manifest.validate_manifest(lines, delimiter=request.data.get('delimiter', ','))
+    except (manifest.ManifestError, UnicodeDecodeError, csv.Error) as exc:
+        return Response({'file': [str(exc)]}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(report)
+
+class ReplicaReadMixin:
+    """
+    Las lecturas (GET/HEAD/OPTIONS) se sirven desde la réplica de
+    DATABASE_REPLICA, salvo para el usuario que acaba de escribir: una
+    escritura correcta lo fija a la primaria REPLICA_STICKY_SECONDS.
+    La autenticación y los permisos se resuelven antes, en la primaria.
+    Con replica_reads = False el viewset solo fija al usuario tras escribir.
+    El cuerpo de las respuestas en streaming (?stream=1, etiquetas) se genera
+    con el mismo alias de lectura que la vista.
+    """
+    replica_reads = True
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if self.replica_reads and request.method in SAFE_METHODS:
+            self._replica_token = routers.start_replica_reads(request.user)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        token = getattr(self, '_replica_token', None)
+        if token is not None:
+            self._replica_token = None
+            alias = routers.current_read_alias()
+            if alias is not None and isinstance(response, StreamingHttpResponse) and not response.is_async:
+                response.streaming_content = routers.iterate_with_read_alias(response.streaming_content, alias)
+            routers.stop_replica_reads(token)
+        elif request.method not in SAFE_METHODS and response.status_code < 400:
+            routers.pin_user(request.user)
+        return super().finalize_response(request, response, *args, **kwargs)
+
+class IdempotencyMixin:
+    """
+    Idempotency-Key en POST y PATCH (altas, lotes, acciones y chunks de
+    subida): la primera petición con la clave se ejecuta y su respuesta se
+    guarda; las repeticiones del mismo usuario la reciben tal cual
+    (Idempotent-Replayed: true) y las que llegan mientras sigue en curso la
+    esperan. Ver idempotency.py.
+    """
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self._idempotency_record = None
+        key = request.headers.get(idempotency.HEADER)
+        if key is None or request.method not in idempotency.METHODS:
+            return
+        record, replay = idempotency.begin(request, key)
+        if replay is not None:
+            # El handler de la acción se sustituye por la respuesta guardada
+            setattr(self, request.method.lower(), lambda *args, **kwargs: replay)
+        self._idempotency_record = record
+
+    def handle_exception(self, exc):
+        try:
+            return super().handle_exception(exc)
+        except Exception:
+            record = getattr(self, '_idempotency_record', None)
+            if record is not None:
+                self._idempotency_record = None
+                idempotency.release(record)
+            raise
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        record = getattr(self, '_idempotency_record', None)
+        if record is not None:
+            self._idempotency_record = None
+            idempotency.finish(record, response)
+        return response
+
+class ArchiveReadMixin:
+    """
+    ?include_archived=1 en list y retrieve incluye, de solo lectura, las filas
+    de los requests archivados (ver archive.py). En la lista van detrás de las
+    vivas y cada parte lleva los mismos filtros, búsqueda y orden.
+    """
+    archive_owner_field = 'request__requester__user'
+    archive_select_related = ()
+    archive_filterset_class = None
+
+    def include_archived(self):
+        return (self.action in ('list', 'retrieve')
+                and self.request.query_params.get('include_archived') in ('1', 'true'))
+
+    def get_archived_queryset(self):
+        model = archive.ARCHIVE_MODELS[self.queryset.model]
+        queryset = model.objects.select_related(*self.archive_select_related)
+        if not self.request.user.is_staff:
+            queryset = queryset.filter(**{self.archive_owner_field: self.request.user})
+        return queryset
+
+    def filter_archived_queryset(self, queryset):
+        live_filterset = getattr(self, 'filterset_class', None)
+        self.filterset_class = self.archive_filterset_class
+        try:
+            return self.filter_queryset(queryset)
+        finally:
+            self.filterset_class = live_filterset
+
+    def list(self, request, *args, **kwargs):
+        if not self.include_archived():
+            return super().list(request, *args, **kwargs)
+        unsupported = [param for param in ('updated_since', 'facets') if param in request.query_params]
+        if unsupported:
+            return Response({param: ['No disponible con include_archived.'] for param in unsupported},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        # Un filtro por id (?request=) solo es válido en una de las dos partes:
+        # en la otra no coincide con nada
+        parts, errors = [], []
+        for queryset, filter_part in ((self.get_queryset(), self.filter_queryset),
+                                      (self.get_archived_queryset(), self.filter_archived_queryset)):
+            try:
+                parts.append(filter_part(queryset))
+            except ValidationError as exc:
+                parts.append(queryset.none())
+                errors.append(exc)
+        if len(errors) == len(parts):
+            raise errors[0]
+
+        rows = archive.ArchiveChain(*parts)
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(self.get_serializer(page, many=True).data)
+        return Response(self.get_serializer(rows[:], many=True).data)
+
+    def get_object(self):
+        try:
+            return super().get_object()
+        except Http404:
+            if not self.include_archived():
+                raise
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        obj = get_object_or_404(self.get_archived_queryset(), **{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        self.check_object_permissions(self.request, obj)
+        return obj
+
+class AuditHistoryMixin:
+    """Acción history/ con el historial de cambios del objeto (índice model, object_id, ts)"""
+
+    @action(detail=True, methods=['get'])
+    def history(self, request, pk=None):
+        obj = self.get_object()
+        entries = AuditLog.objects.select_related('user').filter(
+            model=obj._meta.model_name, object_id=obj.pk
+        ).order_by('-ts', '-id')
+        page = self.paginate_queryset(entries)
+        serializer = AuditLogSerializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+class DeltaSyncMixin:
+    """
+    ?updated_since=<ISO 8601 | cursor> devuelve solo las filas modificadas y
+    los ids borrados desde entonces, con next_since para la siguiente consulta.
+    Se respetan los filtros y el alcance por usuario del viewset. Los cambios
+    de los últimos SYNC_SAFETY_LAG_SECONDS llegan en la consulta siguiente.
+    """
+    sync_max_limit = 1000
+
+    def list(self, request, *args, **kwargs):
+        if 'updated_since' not in request.query_params:
+            return super().list(request, *args, **kwargs)
+        try:
+            cursor = SyncCursor.parse(request.query_params['updated_since'])
+            limit = min(int(request.query_params.get('limit', settings.REST_FRAMEWORK['PAGE_SIZE'])),
+                        self.sync_max_limit)
+        except ValueError as exc:
+            return Response({'updated_since': [str(exc)]}, status=status.HTTP_400_BAD_REQUEST)
+
+        until = horizon()
+        queryset = self.filter_queryset(self.get_queryset())
+        changed = list(changed_since(queryset, cursor, until)[:limit + 1])
+        filters = tombstone_filters(self, request, self.get_queryset())
+        deleted = list(
+            deleted_since(queryset.model, cursor, request.user, until, filters)
+            .values_list('id', 'object_id', 'deleted_at')[:limit + 1]
+        )
+        has_more = len(changed) > limit or len(deleted) > limit
+        changed, deleted = changed[:limit], deleted[:limit]
+
+        if changed:
+            cursor.changed_at, cursor.changed_id = changed[-1].updated_at, changed[-1].pk
+        if deleted:
+            cursor.deleted_id, _, cursor.deleted_at = deleted[-1]
+        return Response({
+            'results': self.get_serializer(changed, many=True).data,
+            'deleted': [object_id for _, object_id, _ in deleted],
+            'next_since': cursor.encode(),
+            'has_more': has_more,
+        })
+
+def _labels_response(view, request):
+    """
+    Hoja PDF de etiquetas de las filas filtradas del viewset (?request=,
+    ?shipment= o ?ids=1,2,3), enviada en streaming página a página.
+    """
+    queryset = view.filter_queryset(view.get_queryset())
+    if request.query_params.get('ids'):
+        try:
+            ids = [int(pk) for pk in request.query_params['ids'].split(',') if pk]
+        except ValueError:
+            return Response({'ids': ['Lista de ids separados por comas.']}, status=status.HTTP_400_BAD_REQUEST)
+        queryset = queryset.filter(pk__in=ids)
+    elif not any(param in request.query_params for param in ('request', 'shipment')):
+        return Response({'detail': 'Indica request, shipment o ids.'}, status=status.HTTP_400_BAD_REQUEST)
+
+    count = labels.labelled(queryset).count()
+    if count > settings.LABEL_MAX_LABELS:
+        return Response(
+            {'detail': f'Demasiadas etiquetas ({count}); el máximo por hoja es {settings.LABEL_MAX_LABELS}.'},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    sheet = labels.get_sheet()
+    response = StreamingHttpResponse(sheet.pages(labels.iter_labels(queryset, sheet)), content_type='application/pdf')
+    response['Content-Disposition'] = f'inline; filename="{view.basename}-labels.pdf"'
+    response['X-Label-Count'] = str(count)
+    return response
+
+def _autocomplete_response(request, name, queryset=None):
+    """
+    Sugerencias por prefijo desde el índice en memoria (sin consultas a la base
+    de datos) o, con queryset, solo de las filas que el usuario puede ver.
+    """
+    prefix = request.query_params.get('q', '').strip()
+    if not prefix:
+        return Response({'q': ['Este parámetro es obligatorio.']}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        limit = min(int(request.query_params.get('limit', 10)), settings.TYPEAHEAD_MAX_RESULTS)
+    except ValueError:
+        return Response({'limit': ['Debe ser un número entero.']}, status=status.HTTP_400_BAD_REQUEST)
+    if queryset is not None:
+        field = typeahead.SOURCES[name][1]
+        return Response({'field': name, 'results': typeahead.lookup_queryset(queryset, field, prefix, limit)})
+    return Response({'field': name, 'results': typeahead.get_index(name).lookup(prefix, limit)})
+
+class NestedCursorPagination(CursorPagination):
+    """
+    Cursor de las acciones anidadas (requests/{id}/metadata/...): por id
+    descendente, lo sirve el índice de la FK sin ordenar el conjunto entero
+    y es estable aunque entren filas nuevas entre página y página
+    """
+    ordering = '-pk'
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+def _nested_response(view, viewset_class, parent_field):
+    """
+    Filas hijas del objeto de la vista con el alcance por usuario, los filtros,
+    la búsqueda y los serializers por rol de viewset_class, paginadas por
+    cursor (el orden es el del cursor: ?ordering= no aplica). ?stream=1
+    devuelve todas en NDJSON, leídas y serializadas por bloques.
+    """
+    request = view.request
+    # El padre sin los filtros de su propio viewset: los parámetros son para las hijas
+    parent = get_object_or_404(view.get_queryset(), pk=view.kwargs['pk'])
+    view.check_object_permissions(request, parent)
+
+    child = viewset_class(request=request, format_kwarg=view.format_kwarg, action='list', args=(), kwargs={})
+    queryset = child.get_queryset().filter(**{parent_field: parent})
+    for backend in child.filter_backends:
+        if not hasattr(backend, 'get_ordering'):
+            queryset = backend().filter_queryset(request, queryset, child)
+
+    if request.query_params.get('stream') in ('1', 'true'):
+        response = StreamingHttpResponse(_ndjson_rows(child, queryset), content_type='application/x-ndjson')
+        filename = f'{view.basename}-{view.kwargs["pk"]}-{view.action}.ndjson'
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+    paginator = NestedCursorPagination()
+    page = paginator.paginate_queryset(queryset, request)
+    return paginator.get_paginated_response(child.get_serializer(page, many=True).data)
+
+def _ndjson_rows(view, queryset):
+    """Una línea JSON por fila, recorriendo el queryset por bloques de pk"""
+    rows = queryset.order_by('pk')
+    last_pk = None
+    while True:
+        chunk = list((rows if last_pk is None else rows.filter(pk__gt=last_pk))[:settings.NESTED_STREAM_CHUNK_SIZE])
+        if not chunk:
+            return
+        last_pk = chunk[-1].pk
+        yield ''.join(
+            json.dumps(item, cls=JSONEncoder, ensure_ascii=False) + '\n'
+            for item in view.get_serializer(chunk, many=True).data
+        )
+
+class FacetMixin:
+    """
+    ?facets=campo1,campo2 añade a la lista los conteos por valor de esos campos
+    sobre el queryset filtrado y acotado al usuario (view.facet_fields).
+    """
+    facet_fields = {}
+
+    def list(self, request, *args, **kwargs):
+        if 'facets' not in request.query_params:
+            return super().list(request, *args, **kwargs)
+        fields = [field for field in request.query_params['facets'].split(',') if field]
+        unknown = [field for field in fields if field not in self.facet_fields]
+        if unknown:
+            return Response(
+                {'facets': [f"Campos no disponibles: {', '.join(unknown)}. "
+                            f"Opciones: {', '.join(self.facet_fields)}"]},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        response = super().list(request, *args, **kwargs)
+        scope = 'staff' if request.user.is_staff else f'user:{request.user.pk}'
+        counts = facet_counts(
+            self.filter_queryset(self.get_queryset()), fields, self.facet_fields, scope, request.query_params
+        )
+        if isinstance(response.data, dict):
+            response.data['facets'] = counts
+        else:
+            response.data = {'results': response.data, 'facets': counts}
+        return response
+
+class RequesterViewSet(IdempotencyMixin, ReplicaReadMixin, DeltaSyncMixin, viewsets.ModelViewSet):
     """
     ViewSet for managing Requesters - cada usuario solo ve/maneja su propio requester
     """
@@ -35,22 +414,31 @@ class RequesterViewSet(viewsets.ModelViewSet):
     
     def perform_create(self, serializer):
         """Automáticamente asignar el usuario actual al crear un requester"""
-        if Requester.objects.filter(user=self.request.user).exists():
-            from rest_framework.exceptions import ValidationError
+        # Un solo INSERT: el índice UNIQUE de user_id detecta el duplicado sin
+        # consultas previas y sin carrera entre la comprobación y la escritura
+        try:
+            with transaction.atomic():
+                serializer.save(user=self.request.user)
+        except IntegrityError as exc:
+            if not is_unique_violation(exc, Requester, Requester.USER_UNIQUE_INDEX):
+                raise
             raise ValidationError({
-                'non_field_errors': ['You already created a Requester']
+                'non_field_errors': [RequesterSerializer.duplicate_error_message]
             })
-        serializer.save(user=self.request.user)
     
     @action(detail=True, methods=['get'])
     def requests(self, request, pk=None):
-        """Get all requests for a specific requester"""
-        requester = self.get_object()
-        requests = Request.objects.filter(requester=requester)
-        serializer = RequestSerializer(requests, many=True)
-        return Response(serializer.data)
+        """Requests del requester, paginados por cursor con los filtros de /requests/ (?stream=1: todos)"""
+        return _nested_response(self, RequestViewSet, 'requester')
 
-class RequestViewSet(viewsets.ModelViewSet):
+    @action(detail=False, methods=['get'])
+    def autocomplete(self, request):
+        """Instituciones que empiezan por ?q=: todas para staff, las de sus requesters para los demás"""
+        if request.user.is_staff:
+            return _autocomplete_response(request, 'requester_institution')
+        return _autocomplete_response(request, 'requester_institution', self.get_queryset())
+
+class RequestViewSet(IdempotencyMixin, ReplicaReadMixin, ArchiveReadMixin, DeltaSyncMixin, AuditHistoryMixin, viewsets.ModelViewSet):
     """
     ViewSet for managing Requests - solo mostrar requests del usuario actual
     """
@@ -58,10 +446,17 @@ class RequestViewSet(viewsets.ModelViewSet):
     serializer_class = RequestSerializer
     permission_classes = [IsAuthenticated]
     filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
-    filterset_fields = ['requester', 'request_date']
+    filterset_fields = {
+        'requester': ['exact'],
+        'request_date': ['exact'],
+        'tissue_count': ['exact', 'gte', 'lte'],
+        'aliquot_count': ['exact', 'gte', 'lte'],
+    }
     search_fields = ['requester__first_name', 'requester__last_name', 'requester__requester_institution']
-    ordering_fields = ['created_at', 'request_date', 'mta_signed_date']
+    ordering_fields = ['created_at', 'request_date', 'mta_signed_date', 'tissue_count', 'aliquot_count']
     ordering = ['-created_at']
+    archive_owner_field = 'requester__user'
+    archive_select_related = ('requester',)
     
     def get_queryset(self):
         """Solo mostrar requests del usuario actual, o todos si es admin"""
@@ -74,34 +469,37 @@ class RequestViewSet(viewsets.ModelViewSet):
     
     @action(detail=True, methods=['get'])
     def metadata(self, request, pk=None):
-        """Get all metadata for a specific request"""
-        request_obj = self.get_object()
-        metadata = Metadata.objects.filter(request=request_obj)
-        serializer = MetadataSerializer(metadata, many=True)
-        return Response(serializer.data)
+        """Metadata del request, paginados por cursor con los filtros de /metadata/ (?stream=1: todos)"""
+        return _nested_response(self, MetadataViewSet, 'request')
     
     @action(detail=True, methods=['get'])
     def shipments(self, request, pk=None):
-        """Get all shipments for a specific request"""
-        request_obj = self.get_object()
-        shipments = Shipment.objects.filter(request=request_obj)
-        serializer = ShipmentSerializer(shipments, many=True)
-        return Response(serializer.data)
+        """Shipments del request, paginados por cursor con los filtros de /shipments/ (?stream=1: todos)"""
+        return _nested_response(self, ShipmentViewSet, 'request')
 
-class MetadataViewSet(viewsets.ModelViewSet):
+class MetadataViewSet(IdempotencyMixin, ReplicaReadMixin, ArchiveReadMixin, DeltaSyncMixin, FacetMixin, viewsets.ModelViewSet):
     """
     ViewSet for managing Metadata - solo mostrar metadata de requests del usuario
     """
-    queryset = Metadata.objects.select_related('request').all()
+    queryset = Metadata.objects.select_related('request', 'taxon').all()
     serializer_class = MetadataSerializer
     permission_classes = [IsAuthenticated]
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
-    filterset_fields = ['request', 'taxon_group', 'family', 'genus', 'collected_by']
+    filter_backends = [DjangoFilterBackend, filters.SearchFilter, AliasOrderingFilter]
+    filterset_class = MetadataFilter
     search_fields = [
-        'original_sample_id', 'scientific_name', 'family', 'genus', 
+        'original_sample_id', 'taxon__scientific_name', 'taxon__family', 'taxon__genus',
         'collected_by', 'collection_location', 'collector_sample_id'
     ]
     ordering_fields = ['created_at', 'date_of_collection', 'scientific_name']
+    ordering_aliases = {'scientific_name': 'taxon__scientific_name'}
+    archive_select_related = ('request', 'taxon')
+    archive_filterset_class = ArchivedMetadataFilter
+    facet_fields = {
+        'taxon_group': 'taxon__taxon_group',
+        'family': 'taxon__family',
+        'genus': 'taxon__genus',
+        'collected_by': 'collected_by',
+    }
     ordering = ['-created_at']
     
     def get_queryset(self):
@@ -110,10 +508,66 @@ class MetadataViewSet(viewsets.ModelViewSet):
             return Metadata.objects.none()
             
         if self.request.user.is_staff:
-            return Metadata.objects.select_related('request').all()
-        return Metadata.objects.select_related('request').filter(request__requester__user=self.request.user)
+            return Metadata.objects.select_related('request', 'taxon').all()
+        return Metadata.objects.select_related('request', 'taxon').filter(request__requester__user=self.request.user)
+
+    def create(self, request, *args, **kwargs):
+        """
+        Alta de una fila o de un lote (lista JSON) en una transacción. Las filas
+        que repiten una muestra del lote o de la tabla llevan '_duplicates'.
+        """
+        many = isinstance(request.data, list)
+        serializer = self.get_serializer(data=request.data, many=many)
+        serializer.is_valid(raise_exception=True)
+        rows = serializer.validated_data if many else [serializer.validated_data]
+        flags = flag_duplicates(rows, request.user)
+        with transaction.atomic():
+            self.perform_create(serializer)
+        data = serializer.data
+        for index, item in enumerate(data if many else [data]):
+            if index in flags:
+                item['_duplicates'] = flags[index]
+        headers = {} if many else self.get_success_headers(data)
+        return Response(data, status=status.HTTP_201_CREATED, headers=headers)
+
+    @action(detail=False, methods=['post'], url_path='check-duplicates')
+    def check_duplicates(self, request):
+        """Marcar los duplicados de un lote de filas (manifest) sin crear nada"""
+        if not isinstance(request.data, list):
+            return Response({'non_field_errors': ['Se espera una lista de filas.']},
+                            status=status.HTTP_400_BAD_REQUEST)
+        rows = [row if isinstance(row, dict) else {} for row in request.data]
+        flags = flag_duplicates(rows, request.user)
+        return Response({
+            'checked': len(rows),
+            'duplicates': [{'row': index, **flags[index]} for index in sorted(flags)],
+        })
+
+    @action(detail=False, methods=['get'], permission_classes=[IsAdminUser])
+    def duplicates(self, request):
+        """Clusters de muestras duplicadas de toda la tabla (solo admin), paginados"""
+        groups = duplicate_clusters(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(groups)
+        return self.get_paginated_response(describe_clusters(page))
 
-class ShipmentViewSet(viewsets.ModelViewSet):
+    @action(detail=False, methods=['get'])
+    def autocomplete(self, request):
+        """Nombres de taxón que empiezan por ?q=; ?field=scientific_name (defecto), genus o family"""
+        name = request.query_params.get('field', 'scientific_name')
+        if name not in ('scientific_name', 'genus', 'family'):
+            return Response({'field': ['Debe ser scientific_name, genus o family.']},
+                            status=status.HTTP_400_BAD_REQUEST)
+        return _autocomplete_response(request, name)
+
+    @action(detail=False, methods=['post'], url_path='validate-manifest')
+    def validate_manifest(self, request):
+        """
+        Validar un manifest CSV sin crear nada: matriz de errores por fila y
+        columna con los mismos mensajes que daría el alta fila a fila
+        """
+        return _manifest_response(request)
+
+class ShipmentViewSet(IdempotencyMixin, ReplicaReadMixin, ArchiveReadMixin, DeltaSyncMixin, AuditHistoryMixin, viewsets.ModelViewSet):
     """
     ViewSet for managing Shipments - solo mostrar shipments del usuario
     """
@@ -125,6 +579,7 @@ class ShipmentViewSet(viewsets.ModelViewSet):
     search_fields = ['tracking_number', 'request__requester__first_name', 'request__requester__last_name']
     ordering_fields = ['created_at', 'shipment_date', 'accession_date']
     ordering = ['-created_at']
+    archive_select_related = ('request',)
     
     def get_queryset(self):
         """Solo mostrar shipments de requests del usuario actual"""
@@ -135,11 +590,11 @@ class ShipmentViewSet(viewsets.ModelViewSet):
             return Shipment.objects.select_related('request').all()
         return Shipment.objects.select_related('request').filter(request__requester__user=self.request.user)
 
-class TissueViewSet(viewsets.ModelViewSet):
+class TissueViewSet(IdempotencyMixin, ReplicaReadMixin, ArchiveReadMixin, DeltaSyncMixin, FacetMixin, AuditHistoryMixin, viewsets.ModelViewSet):
     """
     ViewSet for managing Tissue samples - solo mostrar tissues del usuario
     """
-    queryset = Tissue.objects.select_related('request', 'shipment', 'metadata').all()
+    queryset = Tissue.objects.select_related('request', 'shipment', 'metadata__taxon').all()
     serializer_class = TissueSerializer
     permission_classes = [IsAuthenticated]
     filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
@@ -149,9 +604,17 @@ class TissueViewSet(viewsets.ModelViewSet):
     ]
     search_fields = [
         'tissue_barcode', 'tissue_sample_storage_location',
-        'metadata__scientific_name', 'metadata__original_sample_id'
+        'metadata__taxon__scientific_name', 'metadata__original_sample_id'
     ]
     ordering_fields = ['created_at', 'tissue_barcode']
+    archive_select_related = ('request', 'shipment', 'metadata__taxon')
+    facet_fields = {
+        'request': 'request',
+        'shipment': 'shipment',
+        'is_in_jacq': 'is_in_jacq',
+        'tissue_sample_storage_location': 'tissue_sample_storage_location',
+        'scientific_name': 'metadata__taxon__scientific_name',
+    }
     ordering = ['-created_at']
     
     def get_queryset(self):
@@ -160,16 +623,32 @@ class TissueViewSet(viewsets.ModelViewSet):
             return Tissue.objects.none()
             
         if self.request.user.is_staff:
-            return Tissue.objects.select_related('request', 'shipment', 'metadata').all()
-        return Tissue.objects.select_related('request', 'shipment', 'metadata').filter(
+            return Tissue.objects.select_related('request', 'shipment', 'metadata__taxon').all()
+        return Tissue.objects.select_related('request', 'shipment', 'metadata__taxon').filter(
             request__requester__user=self.request.user
         )
 
-class DnaAliquotViewSet(viewsets.ModelViewSet):
+    @action(detail=False, methods=['get'])
+    def labels(self, request):
+        """Etiquetas Code 128 de tissue_barcode en una hoja PDF imprimible"""
+        return _labels_response(self, request)
+
+    @action(detail=False, methods=['post'], permission_classes=[IsAdminUser], url_path='assign-barcodes')
+    def assign_barcodes(self, request):
+        """Asignar barcodes del servidor a los tissues filtrados que no tienen (solo admin)"""
+        assigned = bulk.assign_tissue_barcodes(self.filter_queryset(self.get_queryset()))
+        return Response({'assigned': assigned})
+
+    @action(detail=False, methods=['post'], permission_classes=[IsAdminUser], url_path='reconcile-jacq')
+    def reconcile_jacq(self, request):
+        """Actualizar is_in_jacq con un export de JACQ (solo admin)"""
+        return _reconcile_response(request, 'jacq')
+
+class DnaAliquotViewSet(IdempotencyMixin, ReplicaReadMixin, ArchiveReadMixin, DeltaSyncMixin, AuditHistoryMixin, viewsets.ModelViewSet):
     """
     ViewSet for managing DNA Aliquots - solo mostrar aliquots del usuario
     """
-    queryset = DnaAliquot.objects.select_related('request', 'shipment', 'metadata').all()
+    queryset = DnaAliquot.objects.select_related('request', 'shipment', 'metadata__taxon').all()
     serializer_class = DnaAliquotSerializer
     permission_classes = [IsAuthenticated]
     filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
@@ -179,10 +658,11 @@ class DnaAliquotViewSet(viewsets.ModelViewSet):
     ]
     search_fields = [
         'dna_aliquot_qr_code', 'dna_aliquot_storage_location',
-        'metadata__scientific_name', 'metadata__original_sample_id'
+        'metadata__taxon__scientific_name', 'metadata__original_sample_id'
     ]
     ordering_fields = ['created_at', 'dna_aliquot_qr_code']
     ordering = ['-created_at']
+    archive_select_related = ('request', 'shipment', 'metadata__taxon')
     
     def get_queryset(self):
         """Solo mostrar DNA aliquots de requests del usuario actual"""
@@ -190,7 +670,163 @@ class DnaAliquotViewSet(viewsets.ModelViewSet):
             return DnaAliquot.objects.none()
             
         if self.request.user.is_staff:
-            return DnaAliquot.objects.select_related('request', 'shipment', 'metadata').all()
-        return DnaAliquot.objects.select_related('request', 'shipment', 'metadata').filter(
+            return DnaAliquot.objects.select_related('request', 'shipment', 'metadata__taxon').all()
+        return DnaAliquot.objects.select_related('request', 'shipment', 'metadata__taxon').filter(
             request__requester__user=self.request.user
-        )
\ No newline at end of file
+        )
+
+    @action(detail=False, methods=['get'])
+    def labels(self, request):
+        """Etiquetas QR de dna_aliquot_qr_code en una hoja PDF imprimible"""
+        return _labels_response(self, request)
+
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """Alta masiva: {request, shipment?, items: [{metadata, dna_aliquot_storage_location?}]}"""
+        serializer = DnaAliquotBulkSerializer(data=request.data, context=self.get_serializer_context())
+        serializer.is_valid(raise_exception=True)
+        created = serializer.save()
+        data = DnaAliquotSerializer(created, many=True, context=self.get_serializer_context()).data
+        return Response(data, status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['post'], permission_classes=[IsAdminUser], url_path='reconcile-database')
+    def reconcile_database(self, request):
+        """Actualizar is_in_database con un export de la base de datos de ADN (solo admin)"""
+        return _reconcile_response(request, 'dna-database')
+
+class UploadViewSet(IdempotencyMixin, ReplicaReadMixin, mixins.CreateModelMixin, mixins.RetrieveModelMixin,
+                    mixins.ListModelMixin, viewsets.GenericViewSet):
+    """
+    Subidas por partes y reanudables de manifests, MTAs y permisos.
+
+    POST crea la subida (target, request/metadata, filename, size, checksum),
+    PATCH con el cuerpo en bruto y la cabecera Upload-Offset añade un chunk,
+    GET/HEAD devuelve el offset para reanudar y download/ sirve el fichero.
+    """
+    queryset = Upload.objects.all()
+    serializer_class = UploadSerializer
+    # El offset para reanudar tiene que ser el de la primaria
+    replica_reads = False
+    permission_classes = [IsAuthenticated]
+    filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
+    filterset_fields = ['target', 'request', 'metadata', 'status']
+    ordering_fields = ['created_at']
+    ordering = ['-created_at']
+
+    def get_queryset(self):
+        """Solo mostrar subidas de requests del usuario actual, o todas si es admin"""
+        if not self.request.user.is_authenticated:
+            return Upload.objects.none()
+
+        if self.request.user.is_staff:
+            return Upload.objects.all()
+        return Upload.objects.filter(request__requester__user=self.request.user)
+
+    def perform_create(self, serializer):
+        serializer.save(user=self.request.user)
+
+    def retrieve(self, request, *args, **kwargs):
+        response = super().retrieve(request, *args, **kwargs)
+        response['Upload-Offset'] = str(response.data['offset'])
+        return response
+
+    def partial_update(self, request, pk=None):
+        """Añadir un chunk (cuerpo en bruto) en la posición Upload-Offset"""
+        upload = self.get_object()
+        if upload.status != Upload.STATUS_PENDING:
+            return Response({'detail': f'La subida está {upload.status}'}, status=status.HTTP_409_CONFLICT)
+
+        try:
+            offset = int(request.headers['Upload-Offset'])
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except (KeyError, ValueError):
+            return Response({'detail': 'Cabecera Upload-Offset o Content-Length inválida'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if length > settings.UPLOAD_MAX_CHUNK_SIZE or offset + length > upload.size:
+            return Response({'detail': 'Chunk demasiado grande'},
+                            status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+        with uploads.chunk_lock(upload) as locked:
+            # Con el cerrojo cogido se relee el offset: nadie más escribe en el fichero
+            if locked:
+                upload.refresh_from_db(fields=['offset', 'status'])
+            if not locked or upload.status != Upload.STATUS_PENDING or offset != upload.offset:
+                return Response({'detail': 'Offset incorrecto', 'offset': upload.offset},
+                                status=status.HTTP_409_CONFLICT,
+                                headers={'Upload-Offset': str(upload.offset)})
+
+            written, chunk_digest = (0, None)
+            if length:
+                written, chunk_digest = uploads.write_chunk(upload, offset, request.stream, length)
+
+            # Checksum opcional del chunk: "Upload-Checksum: sha256 <hex>"
+            expected = request.headers.get('Upload-Checksum', '').partition(' ')[2].strip().lower()
+            if expected and written == length and chunk_digest != expected:
+                uploads.truncate_part(upload, offset)
+                return Response({'detail': 'El checksum del chunk no coincide', 'offset': offset},
+                                status=status.HTTP_400_BAD_REQUEST)
+
+            Upload.objects.filter(pk=upload.pk).update(offset=offset + written, updated_at=timezone.now())
+            upload.offset = offset + written
+
+            if upload.offset == upload.size and not uploads.complete_upload(upload):
+                return Response({'detail': 'El checksum del fichero no coincide, vuelve a subirlo'},
+                                status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+        serializer = self.get_serializer(upload)
+        return Response(serializer.data, headers={'Upload-Offset': str(upload.offset)})
+
+    @action(detail=True, methods=['get'])
+    def download(self, request, pk=None):
+        """Descargar el fichero completo en streaming (admite Range)"""
+        upload = self.get_object()
+        if upload.status != Upload.STATUS_COMPLETE:
+            return Response({'detail': 'La subida no está completa'}, status=status.HTTP_409_CONFLICT)
+        path = uploads.stored_path(upload.storage_path)
+        return uploads.file_download_response(path, upload.filename, request.headers.get('Range'))
+
+class JobViewSet(IdempotencyMixin, ReplicaReadMixin, mixins.CreateModelMixin, mixins.RetrieveModelMixin,
+                 mixins.ListModelMixin, viewsets.GenericViewSet):
+    """
+    Trabajos largos ejecutados por el comando run_jobs fuera de la petición.
+
+    POST crea el job (kind, params y 'file' si el tipo lo necesita), GET
+    devuelve estado y progreso para consultar periódicamente, result/
+    descarga el fichero de resultado y cancel/ lo cancela.
+    """
+    queryset = Job.objects.all()
+    serializer_class = JobSerializer
+    # El progreso lo escribe el worker: consultarlo en la primaria, sin retraso
+    replica_reads = False
+    permission_classes = [IsAuthenticated]
+    filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
+    filterset_fields = ['kind', 'status']
+    ordering_fields = ['created_at']
+    ordering = ['-created_at']
+
+    def get_queryset(self):
+        """Solo mostrar los jobs del usuario actual, o todos si es admin"""
+        if not self.request.user.is_authenticated:
+            return Job.objects.none()
+
+        if self.request.user.is_staff:
+            return Job.objects.all()
+        return Job.objects.filter(user=self.request.user)
+
+    @action(detail=True, methods=['get'])
+    def result(self, request, pk=None):
+        """Descargar el fichero de resultado (admite Range)"""
+        job = self.get_object()
+        path = jobs.result_path(job)
+        if job.status != Job.STATUS_SUCCEEDED or not job.result_filename or not path.exists():
+            return Response({'detail': 'El job no tiene fichero de resultado'}, status=status.HTTP_409_CONFLICT)
+        return uploads.file_download_response(path, job.result_filename, request.headers.get('Range'))
+
+    @action(detail=True, methods=['post'])
+    def cancel(self, request, pk=None):
+        """Cancelar un job en cola o en ejecución"""
+        job = self.get_object()
+        if not jobs.cancel(job):
+            return Response({'detail': f'El job está {job.status}'}, status=status.HTTP_409_CONFLICT)
+        job.refresh_from_db()
+        return Response(self.get_serializer(job).data)
@@ -3,6 +3,10 @@ ASGI bgbm_backend for bgbm_backend project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Serve the project through this module (uvicorn/daphne) for the server-sent
+events endpoint /api/stream/changes/: it is an async view that holds one
+coroutine per open connection instead of one worker thread.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
@@ -46,12 +46,15 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'apps.dna_storage_request.metrics.MetricsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'apps.dna_storage_request.profiling.ProfilerMiddleware',
+    'apps.dna_storage_request.audit.AuditMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -90,9 +93,35 @@ DATABASES = {
     }
 }
 
+# Réplica de lectura (apps/dna_storage_request/routers.py): alias de DATABASES
+# o None. Para activarla, añadir DATABASES['replica'] apuntando al servidor
+# réplica y poner DATABASE_REPLICA = 'replica'. REPLICA_PIN_CACHE tiene que
+# ser entonces una caché compartida por los workers (check dna_storage_request.E001).
+DATABASE_REPLICA = None
+DATABASE_ROUTERS = ['apps.dna_storage_request.routers.ReplicaRouter']
+REPLICA_PIN_CACHE = 'replica_pins'
+REPLICA_STICKY_SECONDS = 5
+REPLICA_MAX_LAG_SECONDS = 10
+REPLICA_CHECK_SECONDS = 2
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
+# El PBKDF2 por defecto, con un límite de hashes simultáneos (ver apps/authentication/hashers.py)
+PASSWORD_HASHERS = [
+    'apps.authentication.hashers.BoundedPBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+
+# Hashes simultáneos por proceso y peticiones que pueden esperar turno. Acota
+# la CPU del hashing; la petición sigue ocupando su worker mientras espera y calcula
+AUTH_HASHING_MAX_CONCURRENT = 2
+AUTH_HASHING_MAX_PENDING = 8
+AUTH_HASHING_WAIT_SECONDS = 2
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -129,6 +158,49 @@ STATICFILES_DIRS = [
     BASE_DIR / "static",
 ]
 
+# Subidas por partes (manifests, MTAs, permisos) en disco local
+UPLOAD_ROOT = BASE_DIR / 'uploads'
+UPLOAD_MAX_CHUNK_SIZE = 16 * 1024 * 1024
+UPLOAD_MAX_FILE_SIZE = 2 * 1024 * 1024 * 1024
+
+# Stream SSE de cambios (apps/dna_storage_request/stream.py)
+CHANGE_STREAM_POLL_SECONDS = 1.0
+CHANGE_STREAM_HEARTBEAT_SECONDS = 15
+CHANGE_EVENT_RETENTION_HOURS = 48
+
+# Jobs en segundo plano (apps/dna_storage_request/jobs.py, comando run_jobs)
+JOB_ROOT = BASE_DIR / 'jobs'
+JOB_WORKERS = 2
+JOB_POLL_SECONDS = 2
+JOB_PROGRESS_SECONDS = 1
+JOB_STALE_SECONDS = 300
+JOB_MAX_ATTEMPTS = 2
+JOB_RETENTION_DAYS = 7
+
+# Archivo de requests cerrados (apps/dna_storage_request/archive.py, comandos
+# archive_requests y restore_archived)
+ARCHIVE_AFTER_DAYS = 365
+ARCHIVE_BATCH_SIZE = 100
+
+# Perfiles de peticiones (apps/dna_storage_request/profiling.py): el staff los
+# pide con la cabecera X-Profile: 1 o ?profile=1, o se muestrea una fracción
+# de las peticiones. Con PROFILER_ENABLED = False el middleware no se instala.
+PROFILER_ENABLED = False
+PROFILE_ROOT = BASE_DIR / 'profiles'
+PROFILER_HEADER = 'X-Profile'
+PROFILER_QUERY_PARAM = 'profile'
+PROFILER_SAMPLE_RATE = 0.0
+PROFILER_MAX_PROFILES = 500
+
+# Métricas en /metrics (apps/dna_storage_request/metrics.py), para el staff o
+# desde la propia máquina. Cada worker vuelca las suyas en METRICS_ROOT cada
+# METRICS_FLUSH_SECONDS; /metrics suma las de todos. El directorio debe ser
+# local y común a los workers de la máquina.
+METRICS_ENABLED = True
+METRICS_ROOT = BASE_DIR / 'metrics'
+METRICS_FLUSH_SECONDS = 5
+METRICS_ALLOW_LOCALHOST = True
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -157,6 +229,108 @@ CORS_ALLOW_HEADERS = [
     'x-requested-with',
 ]
 
+# Caché local por proceso para los token buckets de autenticación
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'throttle': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'auth-throttle',
+    },
+    # Conteos de ?facets=, por proceso. La generación vigente de cada modelo
+    # va en facets_generations, compartida: una escritura invalida los de todos
+    'facets': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'facets',
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
+    # Tabla creada por la migración 0020 de dna_storage_request (createcachetable)
+    'facets_generations': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'bgbm_cache',
+    },
+    # Usuarios que acaban de escribir (leen de la primaria). Con
+    # DATABASE_REPLICA tiene que ser una caché compartida, p. ej.
+    # {'BACKEND': 'django.core.cache.backends.db.DatabaseCache', 'LOCATION': 'bgbm_cache'}
+    'replica_pins': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'replica-pins',
+    },
+    # Símbolos de etiquetas ya dibujados, por código (reimpresiones sin render)
+    'labels': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'labels',
+        'OPTIONS': {'MAX_ENTRIES': 20000},
+    },
+}
+AUTH_THROTTLE_CACHE = 'throttle'
+FACETS_CACHE = 'facets'
+FACETS_GENERATION_CACHE = 'facets_generations'
+FACETS_CACHE_SECONDS = 300
+FACETS_MAX_VALUES = 100
+
+# Etiquetas (apps/dna_storage_request/labels.py): hoja A4, medidas en mm
+LABEL_CACHE = 'labels'
+LABEL_CACHE_SECONDS = 60 * 60 * 24 * 7
+LABEL_RENDER_WORKERS = 2
+LABEL_POOL_THRESHOLD = 64
+LABEL_BATCH_SIZE = 400
+LABEL_MAX_LABELS = 5000
+LABEL_SHEET = {
+    'columns': 4,
+    'rows': 11,
+    'label_width_mm': 48.5,
+    'label_height_mm': 25.4,
+    'margin_mm': 8,
+}
+
+# Códigos asignados por el servidor (apps/dna_storage_request/codes.py).
+# prefijo + dígitos <= 15 caracteres; cada worker reserva block_size de una vez
+CODE_SEQUENCES = {
+    'dna_aliquot_qr_code': {'prefix': 'DQ', 'width': 10, 'block_size': 500},
+    'tissue_barcode': {'prefix': 'TB', 'width': 10, 'block_size': 500},
+}
+BULK_ALIQUOTS_MAX_ITEMS = 5000
+
+# Autocompletado (apps/dna_storage_request/typeahead.py): índices por proceso
+TYPEAHEAD_MAX_ENTRIES = 200000
+TYPEAHEAD_MAX_RESULTS = 50
+TYPEAHEAD_REFRESH_SECONDS = 600
+
+# Validación de manifests (apps/dna_storage_request/manifest.py): chunks de filas
+# repartidos en un pool de procesos cuando el manifest tiene más de uno.
+# MANIFEST_MAX_ROWS se puede subir por despliegue; por debajo de 100000 no
+# caben los manifests de placas completas
+MANIFEST_CHUNK_ROWS = 2000
+MANIFEST_WORKERS = 2
+MANIFEST_MAX_ROWS = 200000
+MANIFEST_MAX_ERRORS = 1000
+
+# Campos de los serializers por rol construidos una vez por clase y copiados
+# en cada instancia (apps/dna_storage_request/serializers.py, CachedFieldsMixin)
+SERIALIZER_FIELD_CACHE = True
+
+# Idempotency-Key en POST y PATCH (apps/dna_storage_request/idempotency.py).
+# Las claves caducadas las borra run_jobs (o el comando purge_idempotency_keys).
+IDEMPOTENCY_TTL_HOURS = 24
+# Espera de una repetición mientras la primera petición sigue en curso
+IDEMPOTENCY_WAIT_SECONDS = 10
+IDEMPOTENCY_POLL_SECONDS = 0.2
+# Una clave en curso más tiempo que esto se da por abandonada (worker caído)
+IDEMPOTENCY_LOCK_SECONDS = 600
+IDEMPOTENCY_MAX_RESPONSE_BYTES = 8 * 1024 * 1024
+
+# Filas leídas y serializadas por bloque en las acciones anidadas con
+# ?stream=1 (requesters/{id}/requests/, requests/{id}/metadata/ y shipments/)
+NESTED_STREAM_CHUNK_SIZE = 1000
+
+# Sincronización incremental (?updated_since=, apps/dna_storage_request/sync.py).
+# updated_at se fija antes del COMMIT: lo modificado en los últimos segundos no
+# se sirve aún, para que una transacción lenta no quede detrás de un cursor ya
+# entregado. Tiene que superar la transacción de escritura más larga.
+SYNC_SAFETY_LAG_SECONDS = 30
+
 # REST Framework Configuration - MEJORADO
 REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'rest_framework.schemas.openapi.AutoSchema',
@@ -177,16 +351,37 @@ REST_FRAMEWORK = {
     'DEFAULT_RENDERER_CLASSES': [
         'rest_framework.renderers.JSONRenderer',
     ],
+    # Token buckets de apps/authentication/throttles.py
+    'DEFAULT_THROTTLE_RATES': {
+        'auth_ip': '30/min',
+        'auth_username': '10/min',
+        'auth_email': '5/hour',
+    },
 }
 
-# Configuración adicional para debugging
+# Logging. Las vistas de autenticación (apps/authentication/logs.py) escriben
+# JSON desde un hilo aparte, con contraseñas y tokens redactados; de sus
+# registros DEBUG solo pasa la fracción AUTH_LOG_DEBUG_SAMPLE_RATE.
+AUTH_LOG_LEVEL = 'DEBUG' if DEBUG else 'INFO'
+AUTH_LOG_DEBUG_SAMPLE_RATE = 1.0
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
+    'filters': {
+        'auth_debug_sample': {
+            '()': 'apps.authentication.logs.DebugSampleFilter',
+            'rate': AUTH_LOG_DEBUG_SAMPLE_RATE,
+        },
+    },
     'handlers': {
         'console': {
             'class': 'logging.StreamHandler',
         },
+        'auth': {
+            '()': 'apps.authentication.logs.BackgroundHandler',
+            'filters': ['auth_debug_sample'],
+        },
     },
     'loggers': {
         'django': {
@@ -194,8 +389,9 @@ LOGGING = {
             'level': 'INFO',
         },
         'apps.authentication': {
-            'handlers': ['console'],
-            'level': 'DEBUG',
+            'handlers': ['auth'],
+            'level': AUTH_LOG_LEVEL,
+            'propagate': False,
         },
     },
 }
@@ -228,4 +424,5 @@ FRONTEND_URL = 'http://localhost:3000'
 
 # Configuración adicional para verificación de email
 ACCOUNT_EMAIL_VERIFICATION = 'mandatory'
-ACCOUNT_EMAIL_REQUIRED = True
\ No newline at end of file
+ACCOUNT_EMAIL_REQUIRED = True
+EMAIL_VERIFICATION_TOKEN_HOURS = 24
\ No newline at end of file
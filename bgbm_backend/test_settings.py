@@ -0,0 +1,38 @@
+# test_settings.py - Tests con dos ficheros SQLite: primaria (default) y réplica
+#
+#   python manage.py test --settings=bgbm_backend.test_settings
+import tempfile
+from pathlib import Path
+
+from .settings import *  # noqa: F401,F403
+
+_TEST_DB_DIR = Path(tempfile.gettempdir())
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': _TEST_DB_DIR / 'bgbm_primary.sqlite3',
+        'TEST': {'NAME': _TEST_DB_DIR / 'bgbm_test_primary.sqlite3'},
+    },
+    # Fichero aparte (no MIRROR): los tests simulan el retraso de replicación
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': _TEST_DB_DIR / 'bgbm_replica.sqlite3',
+        'TEST': {'NAME': _TEST_DB_DIR / 'bgbm_test_replica.sqlite3'},
+    },
+}
+DATABASE_REPLICA = 'replica'
+# Con réplica las marcas de lectura tras escritura van en una caché compartida
+CACHES = {
+    **CACHES,  # noqa: F405
+    'replica_pins': {'BACKEND': 'django.core.cache.backends.db.DatabaseCache', 'LOCATION': 'bgbm_cache'},
+}
+
+# 0001 parte de tablas no gestionadas (creadas con sql_export.sql): en los
+# tests el esquema de la app se crea directamente desde los modelos
+MIGRATION_MODULES = {'dna_storage_request': None}
+
+UPLOAD_ROOT = _TEST_DB_DIR / 'bgbm_test_uploads'
+JOB_ROOT = _TEST_DB_DIR / 'bgbm_test_jobs'
+PROFILE_ROOT = _TEST_DB_DIR / 'bgbm_test_profiles'
+METRICS_ROOT = _TEST_DB_DIR / 'bgbm_test_metrics'
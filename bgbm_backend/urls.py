@@ -1,8 +1,11 @@
 from django.contrib import admin
 from django.urls import path, include
 
+from apps.dna_storage_request.metrics import metrics_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('apps.dna_storage_request.urls')),  # API endpoints para datos
     path('api/auth/', include('apps.authentication.urls')),  # API endpoints para autenticación
+    path('metrics', metrics_view, name='metrics'),  # Métricas para Prometheus (staff o localhost)
 ]
\ No newline at end of file